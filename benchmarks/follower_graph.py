@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the follower graph with the equivalent joins over an in-memory
+sqlite followers table, for "mutual follows", "followed by people you
+follow" and follower counts.
+
+Usage: python benchmarks/follower_graph.py [users] [follows per user]
+"""
+from os.path import abspath, dirname
+import random
+import sqlite3
+import sys
+import timeit
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from syrinx.models.graph import FollowerGraph
+
+MUTUAL = """SELECT a.whom_id FROM followers a JOIN followers b
+            ON a.whom_id = b.who_id AND b.whom_id = a.who_id
+            WHERE a.who_id = ?"""
+FOLLOWED_BY = """SELECT a.whom_id FROM followers a JOIN followers b
+                 ON a.whom_id = b.who_id
+                 WHERE a.who_id = ? AND b.whom_id = ?"""
+COUNT = """SELECT count(*) FROM followers WHERE whom_id = ?"""
+
+
+def main(users=10000, follows=200, iterations=2000):
+    random.seed(0)
+    pairs = set()
+    for who in xrange(users):
+        for whom in random.sample(xrange(users), follows):
+            if whom != who:
+                pairs.add((who, whom))
+    graph = FollowerGraph()
+    graph.load(pairs)
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE followers (who_id INTEGER, whom_id INTEGER, '
+               'PRIMARY KEY (who_id, whom_id))')
+    db.execute('CREATE INDEX followers_whom_id ON followers (whom_id, who_id)')
+    db.executemany('INSERT INTO followers VALUES (?, ?)', pairs)
+    print '%d users, %d follows' % (users, len(pairs))
+    cases = (
+        ('mutual', lambda u, v: graph.mutual(u),
+         lambda u, v: db.execute(MUTUAL, (u, )).fetchall()),
+        ('followed by', lambda u, v: graph.followed_by_following(u, v),
+         lambda u, v: db.execute(FOLLOWED_BY, (u, v)).fetchall()),
+        ('count', lambda u, v: graph.count_followers(u),
+         lambda u, v: db.execute(COUNT, (u, )).fetchone()),
+    )
+    samples = [(random.randrange(users), random.randrange(users))
+               for i in xrange(iterations)]
+    for name, in_graph, in_sql in cases:
+        results = []
+        for func in (in_graph, in_sql):
+            timer = timeit.Timer(lambda: [func(u, v) for u, v in samples])
+            elapsed = min(timer.repeat(3, 1))
+            results.append(elapsed / iterations * 1e6)
+        print '%-12s graph %8.2f us/call   sql %8.2f us/call' % (
+            name, results[0], results[1])
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
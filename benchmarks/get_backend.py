@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the overhead of looking up a model backend, as done on every
+save(), delete(), follow(), etc. of the domain models.
+
+Usage: python benchmarks/get_backend.py [iterations]
+"""
+from os.path import abspath, dirname
+import sys
+import timeit
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from syrinx.models import LocalUser
+from syrinx.models.backends.utils import (get_backend, load_backend_class,
+    reset_backends)
+
+BACKEND = 'syrinx.models.backends.dummy'
+
+
+def uncached(instance):
+    """What get_backend() used to do: import, look up and instantiate."""
+    name = instance.__class__.__name__ + 'Backend'
+    return load_backend_class(BACKEND, name)()
+
+
+def cached(instance):
+    return get_backend(instance, BACKEND)
+
+
+def main(iterations=100000):
+    user = LocalUser(username='tuxie')
+    reset_backends()
+    for func in (uncached, cached):
+        timer = timeit.Timer(lambda: func(user))
+        elapsed = min(timer.repeat(3, iterations))
+        print '%-10s %8.3f us/call' % (func.__name__,
+                                       elapsed / iterations * 1e6)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
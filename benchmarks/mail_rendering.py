@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Reports how many email messages per second are created and rendered, with
+the rendered signatures and message skeletons cached and without them.
+
+Usage: python benchmarks/mail_rendering.py [messages]
+"""
+from os.path import abspath, dirname, join
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from syrinx import settings
+from syrinx.core.mail import message as mail_message
+from syrinx.core.mail.message import EmailMessage
+
+SIGNATURE = u"""--
+{{ _('Sent by Syrinx, a microblogging application.') }}
+"""
+BODY = u"""Hola,
+
+Alguien empezó a seguirte en Syrinx. Éste es un mensaje de prueba con
+suficiente texto como para que codificarlo cueste algo.
+""" * 4
+
+
+def render(count, cached):
+    started = time.time()
+    for number in xrange(count):
+        if not cached:
+            mail_message.clear_caches()
+        message = EmailMessage(subject=u'Tenés un nuevo seguidor', body=BODY,
+                               from_email='syrinx@example.com',
+                               to=['user%d@example.com' % number])
+        message.message().as_string()
+    return count / (time.time() - started)
+
+
+def main(count=5000):
+    templates = tempfile.mkdtemp()
+    try:
+        signature = open(join(templates, 'signature.txt'), 'w')
+        signature.write(SIGNATURE.encode('utf-8'))
+        signature.close()
+        settings.TEMPLATES_DIR = templates
+        settings.EMAIL_SIGNATURE_TEMPLATE = 'signature.txt'
+        for cached in (False, True):
+            print '%-10s %10.1f messages/s' % (
+                cached and 'cached' or 'uncached', render(count, cached))
+    finally:
+        shutil.rmtree(templates)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
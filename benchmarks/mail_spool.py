@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Reports how many email messages per second the file based email backend
+writes, to a single file and to a spool, and how long reading the spool
+takes, from the start and from its last tenth.
+
+Usage: python benchmarks/mail_spool.py [messages] [messages per batch]
+"""
+from os.path import abspath, dirname
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from syrinx import settings
+from syrinx.core.mail import spool
+from syrinx.core.mail.backends.filebased import EmailBackend
+from syrinx.core.mail.message import RenderedMessage
+
+DATA = 'Subject: Test\nTo: user@example.com\n\n' + 'Hello, world.\n' * 40
+
+
+def write(backend, messages, batch_size):
+    started = time.time()
+    for start in xrange(0, len(messages), batch_size):
+        backend.send_messages(messages[start:start + batch_size])
+    return len(messages) / (time.time() - started)
+
+
+def main(count=100000, batch_size=100):
+    settings.EMAIL_FILE_SEGMENT_SIZE = 8 * 1024 * 1024
+    messages = [RenderedMessage('syrinx@example.com',
+                                ['user%d@example.com' % number], None, DATA)
+                for number in xrange(count)]
+    directory = tempfile.mkdtemp()
+    try:
+        print '%-24s %10.1f messages/s' % ('single file', write(
+            EmailBackend(file_path=directory + '/file', spool=False),
+            messages, batch_size))
+        path = directory + '/spool'
+        started = time.time()
+        print '%-24s %10.1f messages/s' % ('spool', write(
+            EmailBackend(file_path=path, spool=True), messages, batch_size))
+        middle = time.time()
+        since = started + (middle - started) * 0.9
+        spool.close_writers()
+        print '%-24s %10d in %d segments' % ('spooled',
+            spool.count_messages(path), len(spool.get_segments(path)))
+        for name, since in (('read all', None), ('read last tenth', since)):
+            started = time.time()
+            read = sum(1 for message in spool.read_spool(path, since))
+            print '%-24s %10d in %.3fs' % (name, read, time.time() - started)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
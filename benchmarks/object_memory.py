@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Reports the memory taken by the domain and API objects, now slotted, against
+the same fields kept in a __dict__ per instance, as they used to be.
+
+Sizes are those of the instances and their __dict__, the field values being
+the same either way.
+
+Usage: python benchmarks/object_memory.py [instances]
+"""
+from os.path import abspath, dirname
+from datetime import datetime
+import sys
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from syrinx import microblogging
+from syrinx.models import LocalUser, Notice, User
+
+NOW = datetime.now()
+CREATED_AT = 'Sat Jan 27 04:17:38 +0000 2007'
+
+CASES = (
+    (User, 'pk', {
+        'username': 'tuxie', 'server': 'http://syrinx.org', 'location': None,
+        'profile_uri': None, 'created': NOW}),
+    (LocalUser, 'pk', {
+        'username': 'tuxie', 'server': 'http://syrinx.org', 'location': None,
+        'profile_uri': None, 'created': NOW, '_password': 'x' * 60,
+        'first_name': 'Tuxie', 'last_name': None, 'bio': None,
+        'status': None, 'email': 'tuxie@syrinx.org', 'web': None,
+        'date_joined': NOW, 'user_config': None, 'admin_user': None,
+        'twitter_user': None}),
+    (Notice, 'pk', {
+        'content': 'Hello world', 'repeats': None, 'date_publish': NOW}),
+    (microblogging.Status, 'id', {
+        'created_at': CREATED_AT, 'favorited': False, 'text': 'Hello world',
+        'user': None, '_now': None}),
+    (microblogging.User, 'id', {
+        'name': 'Tuxie', 'screen_name': 'tuxie', 'location': None,
+        'description': None, 'profile_image_url': None, 'url': None,
+        'status': None}),
+    (microblogging.DirectMessage, 'id', {
+        'created_at': CREATED_AT, 'sender_id': 1,
+        'sender_screen_name': 'tuxie', 'recipient_id': 2,
+        'recipient_screen_name': 'syrinx', 'text': 'Hello world'}),
+)
+
+
+def build(cls, key, fields, count):
+    """Creates instances as the backends load them, without __init__, each
+    with its own key.
+    """
+    instances = []
+    for number in xrange(count):
+        instance = object.__new__(cls)
+        for name, value in fields.iteritems():
+            setattr(instance, name, value)
+        setattr(instance, key, number)
+        instances.append(instance)
+    return instances
+
+
+def size(instances):
+    total = 0
+    for instance in instances:
+        total += sys.getsizeof(instance)
+        if hasattr(instance, '__dict__'):
+            total += sys.getsizeof(instance.__dict__)
+    return total
+
+
+def main(count=100000):
+    print '%d instances, bytes per object' % count
+    for cls, key, fields in CASES:
+        # The same class with no __slots__ of its own and no base class
+        # defining any.
+        unslotted = type(cls.__name__, (object, ), {})
+        name = '%s.%s' % (cls.__module__, cls.__name__)
+        results = []
+        for model in (unslotted, cls):
+            instances = build(model, key, fields, count)
+            results.append(float(size(instances)) / count)
+            del instances
+        print '%-36s __dict__ %6.1f   __slots__ %6.1f' % (
+            name, results[0], results[1])
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Reports the hashes per second of each password hashing method, at its
+default work factor, and the work factor each is calibrated to for a target
+time per hash.
+
+Usage: python benchmarks/password_hashing.py [target ms] [seconds per method]
+"""
+from os.path import abspath, dirname
+import sys
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from syrinx.utils.security import (HashingPolicy, bcrypt,
+    generate_password_hash)
+
+PASSWORD = 'correct horse battery staple'
+
+
+def rate(func, seconds):
+    """Returns how many times per second func runs."""
+    count = 0
+    start = time.time()
+    while True:
+        func(PASSWORD)
+        count += 1
+        elapsed = time.time() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def main(target=50, seconds=2):
+    print '%-14s %12s %12s %22s' % ('method', 'work factor', 'hashes/s',
+                                    'calibrated to %d ms' % target)
+    print '%-14s %12s %12.1f %22s' % (
+        'sha1 (legacy)', '-', rate(generate_password_hash, seconds), '-')
+    methods = ['pbkdf2:sha1', 'pbkdf2:sha256']
+    if bcrypt is not None:
+        methods.append('bcrypt')
+    for method in methods:
+        policy = HashingPolicy(method)
+        work_factor = policy.work_factor
+        hashes = rate(policy.hash, seconds)
+        calibrated = policy.calibrate(target / 1000.0)
+        print '%-14s %12d %12.1f %22d' % (method, work_factor, hashes,
+                                          calibrated)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
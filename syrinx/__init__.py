@@ -12,6 +12,7 @@ from flask import Flask
 from flaskext.script import Manager, Server
 import hashlib
 import logging
+import os
 import sys
 
 __author__ = u'Alvaro Mouriño <alvaro@mourino.net>'
@@ -26,6 +27,8 @@ except ImportError:
 
 app = Flask(__name__)
 app.config.from_object(settings)
+# Templates and static files are those of the web interface.
+app.root_path = os.path.join(settings.PROJECT_DIR, 'interface', 'www')
 
 manager = Manager(app)
 manager.add_command("runserver", Server())
@@ -51,6 +54,52 @@ app.jinja_env.filters['datetimeformat'] = format_datetime
 app.jinja_env.filters['gravatar'] = gravatar_url
 
 from syrinx import models
+from syrinx.core import passwords
+
+# Tuned to the machine by the password pool, while requests are served.
+passwords.calibrate()
+
+
+@manager.command
+def intern_user_ids():
+    """Moves follows, messages and timelines from usernames to user ids."""
+    from syrinx.models.backends.sqlalchemy.migrations import intern_user_ids
+    tables = intern_user_ids()
+    print 'Moved: %s' % (', '.join(tables) or 'nothing, already done')
+
+
+@manager.command
+def add_user_columns():
+    """Adds the columns of the users table missing from the database."""
+    from syrinx.models.backends.sqlalchemy.migrations import add_user_columns
+    columns = add_user_columns()
+    print 'Added: %s' % (', '.join(columns) or 'nothing, already done')
+
+
+@manager.command
+def send_queued_mail(once=False):
+    """Sends the queued email as it is due, or until none is left."""
+    from syrinx.core.mail.queue import Worker
+    logging.basicConfig(level=logging.INFO)
+    Worker().run(once=once)
+
+
+@manager.command
+def mail_queue_stats():
+    """Shows how many messages are waiting in the email queue."""
+    from syrinx.core.mail.queue import get_queue
+    stats = get_queue().stats()
+    print ('%(queued)d queued, %(due)d due, %(retrying)d retrying, '
+           '%(dead)d dead, oldest queued %(oldest_age).0fs ago' % stats)
+
+
+@manager.command
+def send_digests(once=False):
+    """Sends the notification digests as they are due, or until none is
+    left."""
+    from syrinx.core.mail.digest import DigestScheduler
+    logging.basicConfig(level=logging.INFO)
+    DigestScheduler().run(once=once)
 
 if not app.config['SECRET_KEY']:
     logging.warning(' '.join('Missing settings.SECRET_KEY. Run'
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Caching framework.
+
+This package defines a set of cache backends that all conform to a simple API.
+In a nutshell, a cache is a set of values -- which can be any object that may
+be pickled -- identified by string keys. For the complete API, see the
+abstract BaseCache class in syrinx.core.cache.backends.base.
+
+The backend to use is given by a URI, as in settings.CACHE_BACKEND:
+
+    locmem://?timeout=60&max_entries=1000
+    memcached://127.0.0.1:11211;127.0.0.1:11212/
+    dummy://
+"""
+
+from syrinx import settings
+from syrinx.core.exceptions import ImproperlyConfigured
+from syrinx.utils.importlib import import_module
+
+from urlparse import parse_qsl
+
+# Name for use in settings file --> name of module in "backends" directory.
+# Any backend scheme that is not in this dictionary is treated as a Python
+# import path to a custom backend.
+BACKENDS = {
+    'dummy': 'dummy',
+    'locmem': 'locmem',
+    'memcached': 'memcached',
+}
+
+
+def parse_backend_uri(backend_uri):
+    """
+    Converts the "backend_uri" into a cache scheme ('locmem', 'memcached',
+    etc), a host and any extra params that are required for the backend.
+    Returns a (scheme, host, params) tuple.
+    """
+    if backend_uri.find(':') == -1:
+        raise ImproperlyConfigured('Backend URI must start with scheme://')
+    scheme, rest = backend_uri.split(':', 1)
+    if not rest.startswith('//'):
+        raise ImproperlyConfigured('Backend URI must start with scheme://')
+
+    host = rest[2:]
+    qpos = rest.find('?')
+    if qpos != -1:
+        params = dict(parse_qsl(rest[qpos + 1:]))
+        host = rest[2:qpos]
+    else:
+        params = {}
+    if host.endswith('/'):
+        host = host[:-1]
+
+    return scheme, host, params
+
+
+def get_cache(backend_uri=None):
+    """Load a cache backend and return an instance of it.
+
+    If backend_uri is None (default) settings.CACHE_BACKEND is used.
+    """
+    scheme, host, params = parse_backend_uri(
+        backend_uri or settings.CACHE_BACKEND)
+    if scheme in BACKENDS:
+        name = 'syrinx.core.cache.backends.%s' % BACKENDS[scheme]
+    else:
+        name = scheme
+    try:
+        module = import_module(name)
+    except ImportError, e:
+        raise ImproperlyConfigured(
+            'Error importing cache backend module %s: "%s"' % (name, e))
+    return module.CacheClass(host, params)
+
+cache = get_cache()
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# Cache backends shipped with Django.
+# Ported to Syrinx =)
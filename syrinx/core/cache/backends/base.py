@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Base cache class."""
+
+from syrinx.core.exceptions import ImproperlyConfigured
+
+import threading
+
+
+class InvalidCacheBackendError(ImproperlyConfigured):
+
+    pass
+
+
+# Stands for a missing key, as None is a valid value to cache.
+MISSING = object()
+
+
+class BaseCache(object):
+    """
+    Base class for cache backend implementations.
+
+    Subclasses must at least overwrite _get(), set(), add() and delete().
+    Every lookup is accounted as a hit or a miss, see stats().
+    """
+
+    def __init__(self, params):
+        timeout = params.get('timeout', 300)
+        try:
+            timeout = int(timeout)
+        except (ValueError, TypeError):
+            timeout = 300
+        self.default_timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _get(self, key, default=MISSING):
+        """
+        Fetch a given key from the cache. If the key does not exist, return
+        default. Used by get() and get_many().
+        """
+        raise NotImplementedError
+
+    def _record(self, hits, misses):
+        self._stats_lock.acquire()
+        try:
+            self.hits += hits
+            self.misses += misses
+        finally:
+            self._stats_lock.release()
+
+    def add(self, key, value, timeout=None):
+        """
+        Set a value in the cache if the key does not already exist. If
+        timeout is given, that timeout will be used for the key; otherwise
+        the default cache timeout will be used.
+
+        Returns True if the value was stored, False otherwise.
+        """
+        raise NotImplementedError
+
+    def get(self, key, default=None):
+        """
+        Fetch a given key from the cache. If the key does not exist, return
+        default, which itself defaults to None.
+        """
+        value = self._get(key)
+        if value is MISSING:
+            self._record(0, 1)
+            return default
+        self._record(1, 0)
+        return value
+
+    def set(self, key, value, timeout=None):
+        """
+        Set a value in the cache. If timeout is given, that timeout will be
+        used for the key; otherwise the default cache timeout will be used.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Delete a key from the cache, failing silently."""
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """
+        Fetch a bunch of keys from the cache. For certain backends (memcached)
+        this is much more efficient than calling get() multiple times.
+
+        Returns a dict mapping each key in keys to its value. If the given
+        key is missing, it will be missing from the response dict.
+        """
+        d = {}
+        for k in keys:
+            val = self._get(k)
+            if val is not MISSING:
+                d[k] = val
+        self._record(len(d), len(keys) - len(d))
+        return d
+
+    def has_key(self, key):
+        """Returns True if the key is in the cache and has not expired."""
+        return self._get(key) is not MISSING
+
+    def incr(self, key, delta=1):
+        """
+        Add delta to value in the cache. If the key does not exist, raise a
+        ValueError exception.
+        """
+        value = self._get(key)
+        if value is MISSING:
+            raise ValueError("Key '%s' not found" % key)
+        new_value = value + delta
+        self.set(key, new_value)
+        return new_value
+
+    def decr(self, key, delta=1):
+        """
+        Subtract delta from value in the cache. If the key does not exist,
+        raise a ValueError exception.
+        """
+        return self.incr(key, -delta)
+
+    def __contains__(self, key):
+        """Returns True if the key is in the cache and has not expired."""
+        # This is a separate method, rather than just a copy of has_key(),
+        # so that it always has the same functionality as has_key(), even
+        # if a subclass overrides it.
+        return self.has_key(key)
+
+    def set_many(self, data, timeout=None):
+        """
+        Set a bunch of values in the cache at once from a dict of key/value
+        pairs.  For certain backends (memcached), this is much more efficient
+        than calling set() multiple times.
+
+        If timeout is given, that timeout will be used for the key; otherwise
+        the default cache timeout will be used.
+        """
+        for key, value in data.items():
+            self.set(key, value, timeout)
+
+    def delete_many(self, keys):
+        """
+        Set a bunch of values in the cache at once.  For certain backends
+        (memcached), this is much more efficient than calling delete()
+        multiple times.
+        """
+        for key in keys:
+            self.delete(key)
+
+    def clear(self):
+        """Remove *all* values from the cache at once."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns the hit and miss counters of this cache instance."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': lookups and float(self.hits) / lookups or 0.0,
+        }
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Dummy cache backend that does nothing."""
+
+from syrinx.core.cache.backends.base import BaseCache, MISSING
+
+
+class CacheClass(BaseCache):
+
+    def __init__(self, host, *args, **kwargs):
+        BaseCache.__init__(self, *args, **kwargs)
+
+    def _get(self, key, default=MISSING):
+        return default
+
+    def add(self, key, value, timeout=None):
+        return True
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
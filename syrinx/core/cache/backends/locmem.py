@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Thread-safe in-memory cache backend, with LRU eviction."""
+
+from syrinx.core.cache.backends.base import BaseCache, MISSING
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class CacheClass(BaseCache):
+    """
+    A per-process cache. Entries expire after their timeout and, once the
+    cache holds max_entries, the least recently used entry is evicted to make
+    room for a new one.
+
+    Values are stored as is (not pickled), so they must not be modified
+    after being cached.
+    """
+
+    def __init__(self, _, params):
+        BaseCache.__init__(self, params)
+        # Keys to (expiration, value) pairs, least recently used first.
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        max_entries = params.get('max_entries', 300)
+        try:
+            self._max_entries = int(max_entries)
+        except (ValueError, TypeError):
+            self._max_entries = 300
+
+    def _get(self, key, default=MISSING):
+        self._lock.acquire()
+        try:
+            try:
+                expiration, value = self._cache.pop(key)
+            except KeyError:
+                return default
+            if expiration is not None and expiration <= time.time():
+                return default
+            # Reinsert it as the most recently used key.
+            self._cache[key] = (expiration, value)
+            return value
+        finally:
+            self._lock.release()
+
+    def _set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        self._cache.pop(key, None)
+        while len(self._cache) >= self._max_entries:
+            self._cache.popitem(last=False)
+        expiration = timeout and time.time() + timeout or None
+        self._cache[key] = (expiration, value)
+
+    def add(self, key, value, timeout=None):
+        self._lock.acquire()
+        try:
+            entry = self._cache.get(key)
+            if entry is None or (entry[0] is not None and
+                                 entry[0] <= time.time()):
+                self._set(key, value, timeout)
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, timeout=None):
+        self._lock.acquire()
+        try:
+            self._set(key, value, timeout)
+        finally:
+            self._lock.release()
+
+    def incr(self, key, delta=1):
+        # Overridden to make the read and the write a single atomic step.
+        self._lock.acquire()
+        try:
+            entry = self._cache.get(key)
+            if entry is None or (entry[0] is not None and
+                                 entry[0] <= time.time()):
+                raise ValueError("Key '%s' not found" % key)
+            value = entry[1] + delta
+            self._cache[key] = (entry[0], value)
+            return value
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._cache.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._cache.clear()
+        finally:
+            self._lock.release()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Memcached cache backend, shared among processes and hosts."""
+
+from syrinx.core.cache.backends.base import (BaseCache,
+    InvalidCacheBackendError, MISSING)
+
+try:
+    import cmemcache as memcache
+except ImportError:
+    try:
+        import memcache
+    except:
+        raise InvalidCacheBackendError(
+            'Memcached cache backend requires either the "memcache" or '
+            '"cmemcache" library')
+
+
+class CacheClass(BaseCache):
+
+    def __init__(self, server, params):
+        BaseCache.__init__(self, params)
+        self._cache = memcache.Client(server.split(';'))
+
+    def _get_memcache_timeout(self, timeout):
+        """
+        Memcached deals with long (> 30 days) timeouts in a special
+        way. Call this function to obtain a safe value for your timeout.
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout > 2592000:  # 60*60*24*30, 30 days
+            # See http://code.google.com/p/memcached/wiki/FAQ
+            # "You can set expire times up to 30 days in the future. After
+            # that memcached interprets it as a date, and will expire the item
+            # after said date. This is a simple (but obscure) mechanic."
+            #
+            # This means that we have to switch to absolute timestamps.
+            import time
+            timeout += int(time.time())
+        return timeout
+
+    def _encode(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return key
+
+    def _get(self, key, default=MISSING):
+        # memcached does not tell a missing key apart from a None value, so
+        # None can not be cached with this backend.
+        value = self._cache.get(self._encode(key))
+        if value is None:
+            return default
+        return value
+
+    def add(self, key, value, timeout=None):
+        return self._cache.add(self._encode(key), value,
+                               self._get_memcache_timeout(timeout))
+
+    def set(self, key, value, timeout=None):
+        self._cache.set(self._encode(key), value,
+                        self._get_memcache_timeout(timeout))
+
+    def delete(self, key):
+        self._cache.delete(self._encode(key))
+
+    def get_many(self, keys):
+        # Returned under the keys as given, not as sent to memcached.
+        encoded = dict((self._encode(key), key) for key in keys)
+        found = self._cache.get_multi(encoded.keys())
+        self._record(len(found), len(keys) - len(found))
+        return dict((encoded[key], value) for key, value in found.items())
+
+    def incr(self, key, delta=1):
+        # memcached increments the value in place, atomically.
+        value = self._cache.incr(self._encode(key), delta)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def decr(self, key, delta=1):
+        value = self._cache.decr(self._encode(key), delta)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def set_many(self, data, timeout=None):
+        safe_data = dict((self._encode(key), value)
+                         for key, value in data.items())
+        self._cache.set_multi(safe_data, self._get_memcache_timeout(timeout))
+
+    def delete_many(self, keys):
+        self._cache.delete_multi(map(self._encode, keys))
+
+    def clear(self):
+        self._cache.flush_all()
+
+    def close(self, **kwargs):
+        self._cache.disconnect_all()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from syrinx.core.cache import get_cache, parse_backend_uri
+from syrinx.core.cache.backends import locmem
+from syrinx.core.exceptions import ImproperlyConfigured
+
+import unittest2 as unittest
+
+try:
+    import memcache
+except ImportError:
+    memcache = None
+
+
+class Clock(object):
+    """Stands for the time module, with a time that only moves when told
+    to.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class MemcacheClient(object):
+    """Stands for a memcache.Client, keeping the keys it is given."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def get_multi(self, keys):
+        return dict((key, self.data[key]) for key in keys
+                    if key in self.data)
+
+    def set(self, key, value, timeout=0):
+        self.data[key] = value
+
+    def set_multi(self, data, timeout=0):
+        self.data.update(data)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class BackendURITests(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEquals(parse_backend_uri('dummy://'), ('dummy', '', {}))
+        self.assertEquals(
+            parse_backend_uri('memcached://127.0.0.1:11211;127.0.0.1:11212/'),
+            ('memcached', '127.0.0.1:11211;127.0.0.1:11212', {}))
+        self.assertEquals(
+            parse_backend_uri('locmem://?timeout=60&max_entries=10'),
+            ('locmem', '', {'timeout': '60', 'max_entries': '10'}))
+
+    def test_invalid(self):
+        self.assertRaises(ImproperlyConfigured, parse_backend_uri, 'locmem')
+        self.assertRaises(ImproperlyConfigured, parse_backend_uri, 'locmem:')
+        self.assertRaises(ImproperlyConfigured, get_cache, 'nosuchcache://')
+
+    def test_params(self):
+        cache = get_cache('locmem://?timeout=60&max_entries=10')
+        self.assertEquals(cache.default_timeout, 60)
+        self.assertEquals(cache._max_entries, 10)
+        cache = get_cache('locmem://?timeout=soon')
+        self.assertEquals(cache.default_timeout, 300)
+
+
+class LocMemCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.time = locmem.time
+        self.clock = locmem.time = Clock()
+        self.cache = get_cache('locmem://?timeout=60&max_entries=3')
+
+    def tearDown(self):
+        locmem.time = self.time
+
+    def test_get_set(self):
+        self.assertEquals(self.cache.get('key'), None)
+        self.assertEquals(self.cache.get('key', 'default'), 'default')
+        self.cache.set('key', 'value')
+        self.assertEquals(self.cache.get('key'), 'value')
+        # None is a value like any other.
+        self.cache.set('none', None)
+        self.assertTrue('none' in self.cache)
+        self.assertEquals(self.cache.get('none', 'default'), None)
+        self.cache.delete('key')
+        self.assertFalse('key' in self.cache)
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('key', 'first'))
+        self.assertFalse(self.cache.add('key', 'second'))
+        self.assertEquals(self.cache.get('key'), 'first')
+        self.clock.now += 60
+        self.assertTrue(self.cache.add('key', 'third'))
+        self.assertEquals(self.cache.get('key'), 'third')
+
+    def test_expiry(self):
+        self.cache.set('default', 1)
+        self.cache.set('short', 2, 10)
+        self.cache.set('forever', 3, 0)
+        self.clock.now += 10
+        self.assertFalse('short' in self.cache)
+        self.assertEquals(self.cache.get('default'), 1)
+        self.clock.now += 50
+        self.assertFalse('default' in self.cache)
+        self.clock.now += 10 ** 6
+        self.assertEquals(self.cache.get('forever'), 3)
+
+    def test_lru_eviction(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, key)
+        # Reading 'a' makes 'b' the least recently used.
+        self.cache.get('a')
+        self.cache.set('d', 'd')
+        self.assertEquals(sorted(self.cache.get_many(['a', 'b', 'c', 'd'])),
+                          ['a', 'c', 'd'])
+        # Setting an existing key does not evict anything.
+        self.cache.set('c', 'C')
+        self.assertEquals(self.cache.get_many(['a', 'c', 'd']),
+                          {'a': 'a', 'c': 'C', 'd': 'd'})
+
+    def test_incr(self):
+        self.assertRaises(ValueError, self.cache.incr, 'count')
+        self.cache.set('count', 1, 10)
+        self.assertEquals(self.cache.incr('count'), 2)
+        self.assertEquals(self.cache.decr('count', 3), -1)
+        # Incrementing does not extend the life of the entry.
+        self.clock.now += 10
+        self.assertRaises(ValueError, self.cache.incr, 'count')
+
+    def test_stats(self):
+        self.assertEquals(self.cache.stats(),
+                          {'hits': 0, 'misses': 0, 'hit_ratio': 0.0})
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.get('b')
+        self.cache.get_many(['a', 'b', 'c'])
+        self.assertEquals(self.cache.stats(),
+                          {'hits': 2, 'misses': 3, 'hit_ratio': 0.4})
+        # Checking for a key is not a lookup.
+        'a' in self.cache
+        self.assertEquals(self.cache.stats()['hits'], 2)
+
+
+class DummyCacheTests(unittest.TestCase):
+
+    def test_nothing_cached(self):
+        cache = get_cache('dummy://')
+        cache.set('key', 'value')
+        self.assertTrue(cache.add('key', 'value'))
+        self.assertEquals(cache.get('key', 'default'), 'default')
+        self.assertEquals(cache.get_many(['key']), {})
+        self.assertEquals(cache.stats(),
+                          {'hits': 0, 'misses': 2, 'hit_ratio': 0.0})
+
+
+@unittest.skipIf(memcache is None, 'requires the memcache library')
+class MemcachedCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = get_cache('memcached://127.0.0.1:11211/')
+        self.client = self.cache._cache = MemcacheClient()
+
+    def test_unicode_keys(self):
+        self.cache.set(u'caf\xe9', 'value')
+        self.assertEquals(self.client.data.keys(), ['caf\xc3\xa9'])
+        self.assertEquals(self.cache.get(u'caf\xe9'), 'value')
+        self.cache.delete(u'caf\xe9')
+        self.assertEquals(self.client.data, {})
+
+    def test_get_many(self):
+        self.cache.set_many({u'caf\xe9': 1, 'tea': 2})
+        found = self.cache.get_many([u'caf\xe9', 'tea', 'water'])
+        self.assertEquals(found, {u'caf\xe9': 1, 'tea': 2})
+        self.assertEquals(self.cache.stats()['misses'], 1)
+
+    def test_long_timeout(self):
+        self.assertEquals(self.cache._get_memcache_timeout(None), 300)
+        self.assertTrue(self.cache._get_memcache_timeout(2592001) > 2592001)
@@ -5,6 +5,7 @@ Tools for sending email.
 
 from syrinx import settings
 from syrinx.core.exceptions import ImproperlyConfigured
+from syrinx.core.mail.bulk import group_datatuple, send_bulk
 from syrinx.core.mail.backends.smtp import EmailBackend as _SMTPConnection
 from syrinx.core.mail.message import (BadHeaderError,
     DEFAULT_ATTACHMENT_MIME_TYPE, EmailMessage, EmailMultiAlternatives,
@@ -72,15 +73,16 @@ def send_mass_mail(datatuple, fail_silently=False, auth_user=None,
 
     Note: The API for this method is frozen. New code wanting to extend the
     functionality should use the EmailMessage class directly.
+
+    Each message is rendered once for all the recipients of the same
+    subject, message and sender. Without a connection, they are sent by
+    several connections at once, see syrinx.core.mail.bulk.send_bulk().
     """
-    connection = connection or get_connection(username=auth_user,
-                                              password=auth_password,
-                                              fail_silently=fail_silently)
-    messages = [
-        EmailMessage(subject=subject, body=message, from_email=sender,
-                     to=[recipient])
-        for subject, message, sender, recipient in datatuple]
-    return connection.send_messages(messages)
+    messages = group_datatuple(datatuple)
+    if connection is not None:
+        return connection.send_messages(messages)
+    return send_bulk(messages, fail_silently=fail_silently,
+                     username=auth_user, password=auth_password)
 
 
 def mail_admins(subject, message, fail_silently=False, connection=None,
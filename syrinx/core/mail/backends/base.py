@@ -8,6 +8,11 @@ class BaseEmailBackend(object):
 
     Subclasses must at least overwrite send_messages().
     """
+
+    # Whether messages are sent faster by several connections at once, as
+    # to a remote server, see syrinx.core.mail.bulk.send_bulk().
+    parallel = False
+
     def __init__(self, fail_silently=False, **kwargs):
         self.fail_silently = fail_silently
 
@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
-"""Email backend that writes messages to a file."""
+"""
+Email backend that writes messages to a file.
+
+With spool set, or settings.EMAIL_FILE_SPOOL, messages are appended to the
+segments of a spool instead, see syrinx.core.mail.spool.
+"""
 
 from syrinx import settings
 from syrinx.core.exceptions import ImproperlyConfigured
 from syrinx.core.mail.backends.console import EmailBackend \
                                               as ConsoleEmailBackend
+from syrinx.core.mail.spool import get_writer
 
 import datetime
 import os
@@ -17,6 +23,9 @@ class EmailBackend(ConsoleEmailBackend):
             self.file_path = kwargs.pop('file_path')
         else:
             self.file_path = getattr(settings, 'EMAIL_FILE_PATH', None)
+        self.spool = kwargs.pop('spool', None)
+        if self.spool is None:
+            self.spool = settings.EMAIL_FILE_SPOOL
         # Make sure self.file_path is a string.
         if not isinstance(self.file_path, basestring):
             raise ImproperlyConfigured(
@@ -55,6 +64,9 @@ class EmailBackend(ConsoleEmailBackend):
         return self._fname
 
     def open(self):
+        if self.spool:
+            # The spool keeps its segment open.
+            return False
         if self.stream is None:
             self.stream = open(self._get_filename(), 'a')
             return True
@@ -66,3 +78,16 @@ class EmailBackend(ConsoleEmailBackend):
                 self.stream.close()
         finally:
             self.stream = None
+
+    def send_messages(self, email_messages):
+        """Writes the messages, to the spool if in spool mode."""
+        if not self.spool:
+            return super(EmailBackend, self).send_messages(email_messages)
+        if not email_messages:
+            return
+        try:
+            return get_writer(self.file_path).write(email_messages)
+        except:
+            if not self.fail_silently:
+                raise
+            return 0
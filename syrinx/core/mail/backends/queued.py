@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Email backend that queues messages, to be sent by a separate worker.
+
+See syrinx.core.mail.queue.
+"""
+
+from syrinx.core.mail.backends.base import BaseEmailBackend
+from syrinx.core.mail.queue import get_queue
+
+
+class EmailBackend(BaseEmailBackend):
+
+    def __init__(self, *args, **kwargs):
+        self.queue = kwargs.pop('queue', None) or get_queue()
+        super(EmailBackend, self).__init__(*args, **kwargs)
+
+    def send_messages(self, email_messages):
+        """Queues the messages, returning how many were queued."""
+        if not email_messages:
+            return
+        try:
+            return self.queue.put(email_messages)
+        except:
+            if not self.fail_silently:
+                raise
+            return 0
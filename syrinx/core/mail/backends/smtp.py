@@ -6,16 +6,222 @@ from syrinx.core.mail.backends.base import BaseEmailBackend
 from syrinx.core.mail.utils import DNS_NAME
 from syrinx.core.mail.message import sanitize_address
 
+import atexit
 import smtplib
 import socket
 import threading
+import time
+
+
+def _connect(host, port, username, password, use_tls):
+    """Opens a connection to an email server, logged in if a username and a
+    password are given.
+    """
+    # If local_hostname is not specified, socket.getfqdn() gets used.
+    # For performance, we use the cached FQDN for local_hostname.
+    connection = smtplib.SMTP(host, port, local_hostname=DNS_NAME.get_fqdn())
+    if use_tls:
+        connection.ehlo()
+        connection.starttls()
+        connection.ehlo()
+    if username and password:
+        connection.login(username, password)
+    return connection
+
+
+def _quit(connection):
+    """Closes a connection, ignoring errors: it is not used anymore."""
+    try:
+        connection.quit()
+    except socket.sslerror:
+        # This happens when calling quit() on a TLS connection sometimes.
+        connection.close()
+    except (smtplib.SMTPException, socket.error):
+        connection.close()
+
+
+class PoolTimeout(smtplib.SMTPException):
+    """No connection of a pool was released in time."""
+
+    pass
+
+
+class PooledConnection(object):
+    """A connection of a pool, along with how much it has been used.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.sent = 0
+        self.last_used = time.time()
+        # Set when the connection failed, it is not reused then.
+        self.broken = False
+
+
+class ConnectionPool(object):
+    """Connections to an email server, kept open to be reused.
+
+    At most `size` connections are used at once, acquire() waits up to
+    `timeout` seconds for one to be released past that. Connections are
+    closed once they have sent `max_messages` messages, or when they have
+    been idle for `keepalive` seconds. Those idle for more than
+    `check_after` seconds are checked with a NOOP before being reused.
+    """
+
+    def __init__(self, connect_args, size, max_messages, keepalive,
+                 check_after, timeout):
+        self.connect_args = connect_args
+        self.size = size
+        self.max_messages = max_messages
+        self.keepalive = keepalive
+        self.check_after = check_after
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        # Notified when a connection is released.
+        self._released = threading.Condition(self._lock)
+        self._in_use = 0
+
+    def _pop_idle(self):
+        """Returns the connection released last, closing the expired ones."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            expired = [pooled for pooled in self._idle
+                       if now - pooled.last_used > self.keepalive]
+            self._idle = [pooled for pooled in self._idle
+                          if now - pooled.last_used <= self.keepalive]
+            pooled = self._idle and self._idle.pop() or None
+        finally:
+            self._lock.release()
+        for candidate in expired:
+            _quit(candidate.connection)
+        return pooled
+
+    def _is_alive(self, pooled):
+        if time.time() - pooled.last_used < self.check_after:
+            return True
+        try:
+            return pooled.connection.noop()[0] == 250
+        except (smtplib.SMTPException, socket.error):
+            return False
+
+    def _take_slot(self):
+        deadline = time.time() + self.timeout
+        self._lock.acquire()
+        try:
+            while self._in_use >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout('No connection to %s:%s was released '
+                        'in %s seconds' % (self.connect_args[0],
+                                           self.connect_args[1],
+                                           self.timeout))
+                self._released.wait(remaining)
+            self._in_use += 1
+        finally:
+            self._lock.release()
+
+    def _release_slot(self):
+        self._lock.acquire()
+        try:
+            self._in_use -= 1
+            self._released.notify()
+        finally:
+            self._lock.release()
+
+    def acquire(self):
+        """Returns an open connection, waiting for one to be released if
+        all are in use. Raises PoolTimeout if none is in time.
+        """
+        self._take_slot()
+        try:
+            while True:
+                pooled = self._pop_idle()
+                if pooled is None:
+                    return PooledConnection(_connect(*self.connect_args))
+                if self._is_alive(pooled):
+                    return pooled
+                _quit(pooled.connection)
+        except:
+            self._release_slot()
+            raise
+
+    def release(self, pooled):
+        """Gives a connection back, to be reused unless it has failed or is
+        done.
+        """
+        try:
+            if pooled.broken or pooled.sent >= self.max_messages:
+                _quit(pooled.connection)
+            else:
+                pooled.last_used = time.time()
+                self._lock.acquire()
+                try:
+                    self._idle.append(pooled)
+                finally:
+                    self._lock.release()
+        finally:
+            self._release_slot()
+
+    def close(self):
+        """Closes the idle connections."""
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for pooled in idle:
+            _quit(pooled.connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host, port, username, password, use_tls):
+    """Returns the pool of connections to a server with the given
+    credentials, shared by the backends of the process.
+    """
+    key = (host, port, username, password, use_tls)
+    _pools_lock.acquire()
+    try:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(key, settings.EMAIL_POOL_SIZE,
+                settings.EMAIL_POOL_MAX_MESSAGES,
+                settings.EMAIL_POOL_KEEPALIVE,
+                settings.EMAIL_POOL_CHECK_AFTER,
+                settings.EMAIL_POOL_TIMEOUT)
+        return _pools[key]
+    finally:
+        _pools_lock.release()
+
+
+def close_pools():
+    """Closes the idle connections of every pool."""
+    _pools_lock.acquire()
+    try:
+        pools = _pools.values()
+    finally:
+        _pools_lock.release()
+    for pool in pools:
+        pool.close()
+
+atexit.register(close_pools)
 
 
 class EmailBackend(BaseEmailBackend):
     """
     A wrapper that manages the SMTP network connection.
+
+    Connections are taken from a pool shared by the backends of the process
+    and given back after each batch of messages, unless open() was called:
+    the connection is kept until close() then. Backends sending at the
+    same time use different connections.
     """
 
+    parallel = True
+
     def __init__(self, host=None, port=None, username=None, password=None,
                  use_tls=None, fail_silently=False, **kwargs):
         super(EmailBackend, self).__init__(fail_silently=fail_silently)
@@ -27,9 +233,19 @@ class EmailBackend(BaseEmailBackend):
             self.use_tls = settings.EMAIL_USE_TLS
         else:
             self.use_tls = use_tls
+        self.pool = get_pool(self.host, self.port, self.username,
+                             self.password, self.use_tls)
         self.connection = None
+        self._pooled = None
         self._lock = threading.RLock()
 
+    def _acquire(self):
+        try:
+            return self.pool.acquire()
+        except:
+            if not self.fail_silently:
+                raise
+
     def open(self):
         """
         Ensures we have a connection to the email server. Returns whether or
@@ -38,37 +254,18 @@ class EmailBackend(BaseEmailBackend):
         if self.connection:
             # Nothing to do if the connection is already open.
             return False
-        try:
-            # If local_hostname is not specified, socket.getfqdn() gets used.
-            # For performance, we use the cached FQDN for local_hostname.
-            self.connection = smtplib.SMTP(self.host, self.port,
-                                           local_hostname=DNS_NAME.get_fqdn())
-            if self.use_tls:
-                self.connection.ehlo()
-                self.connection.starttls()
-                self.connection.ehlo()
-            if self.username and self.password:
-                self.connection.login(self.username, self.password)
-            return True
-        except:
-            if not self.fail_silently:
-                raise
+        self._pooled = self._acquire()
+        if self._pooled is None:
+            return None
+        self.connection = self._pooled.connection
+        return True
 
     def close(self):
-        """Closes the connection to the email server."""
-        try:
-            try:
-                self.connection.quit()
-            except socket.sslerror:
-                # This happens when calling quit() on a TLS connection
-                # sometimes.
-                self.connection.close()
-            except:
-                if self.fail_silently:
-                    return
-                raise
-        finally:
-            self.connection = None
+        """Gives the connection back to the pool."""
+        pooled, self._pooled = self._pooled, None
+        self.connection = None
+        if pooled is not None:
+            self.pool.release(pooled)
 
     def send_messages(self, email_messages):
         """
@@ -77,25 +274,47 @@ class EmailBackend(BaseEmailBackend):
         """
         if not email_messages:
             return
+        if self._pooled is None:
+            return self._send_all(email_messages, held=False)
+        # The connection opened is used by one thread at a time.
         self._lock.acquire()
         try:
-            new_conn_created = self.open()
-            if not self.connection:
-                # We failed silently on open().
+            return self._send_all(email_messages, held=True)
+        finally:
+            self._lock.release()
+
+    def _send_all(self, email_messages, held):
+        if held:
+            pooled = self._pooled
+        else:
+            pooled = self._acquire()
+            if pooled is None:
+                # We failed silently on acquire().
                 # Trying to send would be pointless.
                 return
-            num_sent = 0
+        num_sent = 0
+        try:
             for message in email_messages:
-                sent = self._send(message)
+                if (pooled.broken or
+                    pooled.sent >= self.pool.max_messages):
+                    # Recycled, along with the rest of the batch.
+                    self.pool.release(pooled)
+                    pooled = None
+                    pooled = self._acquire()
+                    if pooled is None:
+                        break
+                sent = self._send(pooled, message)
                 if sent:
                     num_sent += 1
-            if new_conn_created:
-                self.close()
         finally:
-            self._lock.release()
+            if held:
+                self._pooled = pooled
+                self.connection = pooled and pooled.connection or None
+            elif pooled is not None:
+                self.pool.release(pooled)
         return num_sent
 
-    def _send(self, email_message):
+    def _send(self, pooled, email_message):
         """A helper method that does the actual sending."""
         if not email_message.recipients():
             return False
@@ -104,10 +323,17 @@ class EmailBackend(BaseEmailBackend):
         recipients = [sanitize_address(addr, email_message.encoding)
                       for addr in email_message.recipients()]
         try:
-            self.connection.sendmail(from_email, recipients,
+            pooled.connection.sendmail(from_email, recipients,
                     email_message.message().as_string())
+        except (smtplib.SMTPServerDisconnected, socket.error):
+            pooled.broken = True
+            if not self.fail_silently:
+                raise
+            return False
         except:
             if not self.fail_silently:
                 raise
             return False
+        finally:
+            pooled.sent += 1
         return True
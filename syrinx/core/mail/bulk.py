@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Sending the same message to many recipients, as notifications to every
+follower of a user.
+
+Recipients of the same subject, body and sender share a single rendering
+of the message: only their To and Message-ID headers are added to it.
+Messages are then sent in batches, by several threads with a connection
+each when sending to a remote server, see send_bulk().
+"""
+
+from syrinx import settings
+from syrinx.core.mail.message import (EmailMessage, RenderedMessage,
+    forbid_multi_line_headers, make_msgid)
+
+from Queue import Empty, Queue
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger('syrinx.core.mail.bulk')
+
+# Headers that change for each recipient.
+RECIPIENT_HEADERS = ('To', 'Message-ID')
+
+# Added to the Message-IDs, which would otherwise only differ by a random
+# number for the messages rendered within a second.
+_message_numbers = itertools.count()
+
+
+def render_once(email_message, recipients):
+    """Returns a RenderedMessage of email_message for each recipient,
+    rendering it a single time.
+    """
+    encoding = email_message.encoding or settings.DEFAULT_CHARSET
+    message = email_message.message()
+    for name in RECIPIENT_HEADERS:
+        del message[name]
+    rendered = message.as_string()
+    messages = []
+    for recipient in recipients:
+        name, to = forbid_multi_line_headers('To', recipient, encoding)
+        data = 'To: %s\nMessage-ID: %s\n%s' % (
+            to, make_msgid(str(_message_numbers.next())), rendered)
+        messages.append(RenderedMessage(email_message.from_email,
+                                        [recipient], email_message.encoding,
+                                        data))
+    return messages
+
+
+def group_datatuple(datatuple):
+    """Renders the (subject, message, from_email, recipient_list) tuples of
+    send_mass_mail() into one message per recipient, once per distinct
+    subject, message and sender.
+    """
+    groups = []
+    recipients = {}
+    for subject, message, sender, recipient_list in datatuple:
+        if isinstance(recipient_list, basestring):
+            recipient_list = [recipient_list]
+        key = (subject, message, sender)
+        if key not in recipients:
+            recipients[key] = []
+            groups.append(key)
+        recipients[key].extend(recipient_list)
+    messages = []
+    for subject, message, sender in groups:
+        email_message = EmailMessage(subject=subject, body=message,
+                                     from_email=sender)
+        messages.extend(render_once(email_message,
+                                    recipients[(subject, message, sender)]))
+    return messages
+
+
+def send_bulk(messages, backend=None, workers=None, batch_size=None,
+              fail_silently=False, **kwargs):
+    """Sends messages in batches of batch_size, by as many threads as
+    workers, each with its own connection of the given backend. Returns the
+    number of messages sent.
+
+    Backends which are not parallel, such as the queued or the file based
+    ones, gain nothing from several threads: the messages are sent by the
+    calling thread then.
+
+    Keyword arguments are used to create the connections, see
+    get_connection().
+    """
+    from syrinx.core.mail import get_connection
+    if not messages:
+        return 0
+    workers = workers or settings.EMAIL_BULK_WORKERS
+    batch_size = batch_size or settings.EMAIL_BULK_BATCH_SIZE
+    batches = Queue()
+    for start in xrange(0, len(messages), batch_size):
+        batches.put(messages[start:start + batch_size])
+    state = {'sent': 0, 'error': None}
+    lock = threading.Lock()
+    first = get_connection(backend, fail_silently=fail_silently, **kwargs)
+    if not getattr(first, 'parallel', False):
+        workers = 1
+
+    def work(connection=None):
+        if connection is None:
+            connection = get_connection(backend,
+                                        fail_silently=fail_silently, **kwargs)
+        connection.open()
+        try:
+            while state['error'] is None:
+                try:
+                    batch = batches.get_nowait()
+                except Empty:
+                    return
+                started = time.time()
+                sent = connection.send_messages(batch) or 0
+                elapsed = time.time() - started
+                logger.info('Sent %d of %d messages in %.2fs (%.0f/s)', sent,
+                            len(batch), elapsed, sent / max(elapsed, 1e-6))
+                lock.acquire()
+                try:
+                    state['sent'] += sent
+                finally:
+                    lock.release()
+        finally:
+            connection.close()
+
+    def run(connection=None):
+        try:
+            work(connection)
+        except Exception, e:
+            # The other threads stop after their current batch.
+            state['error'] = e
+
+    started = time.time()
+    threads = []
+    if workers == 1:
+        run(first)
+    else:
+        threads = [threading.Thread(target=run, args=(first, ))]
+        threads.extend(threading.Thread(target=run)
+                       for i in xrange(min(workers, batches.qsize()) - 1))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.time() - started
+    logger.info('Sent %d of %d messages in %.2fs (%.0f/s) by %d threads',
+                state['sent'], len(messages), elapsed,
+                state['sent'] / max(elapsed, 1e-6), max(len(threads), 1))
+    if state['error'] is not None and not fail_silently:
+        raise state['error']
+    return state['sent']
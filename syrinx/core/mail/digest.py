@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Notification digests: one summary email per user instead of one email per
+new follower or private notice.
+
+Events are recorded with notify(), which only writes a row to a sqlite
+database at settings.NOTIFICATION_DIGEST_PATH. They are gathered per
+recipient and sent in a single message once the oldest one is
+settings.NOTIFICATION_DIGEST_WINDOW seconds old, by the scheduler run
+with:
+
+    python runserver.py send_digests
+
+Digests are sent through syrinx.core.mail, and so queued with the default
+settings. Events are removed once their digest is handed to the backend:
+should that fail, they are sent in the next digest. A single scheduler
+should be run per database.
+"""
+
+from syrinx import settings
+from syrinx.core.mail.message import EmailMessage
+from syrinx.core.mail.queue import SpoolDatabase
+
+from gettext import gettext as _
+import logging
+import time
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipient TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        text TEXT NOT NULL,
+        created REAL NOT NULL)""",
+    """CREATE INDEX IF NOT EXISTS events_recipient
+        ON events (recipient, created)""",
+)
+
+# Headings of the sections of a digest, by kind of event.
+KINDS = {
+    'follow': _('New followers'),
+    'private_notice': _('New private notices'),
+}
+
+logger = logging.getLogger('syrinx.core.mail.digest')
+
+
+class Event(object):
+    """Something a user is to be told about.
+    """
+
+    __slots__ = ('pk', 'recipient', 'kind', 'text', 'created')
+
+    def __init__(self, pk, recipient, kind, text, created):
+        self.pk = pk
+        self.recipient = recipient
+        self.kind = kind
+        self.text = text
+        self.created = created
+
+
+class DigestStore(SpoolDatabase):
+    """The events waiting to be sent in a digest, in a sqlite database.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path=None):
+        super(DigestStore, self).__init__(
+            path or settings.NOTIFICATION_DIGEST_PATH)
+
+    def add(self, recipient, kind, text):
+        """Records an event for the given email address."""
+        self._transaction(lambda connection: connection.execute(
+            """INSERT INTO events (recipient, kind, text, created)
+               VALUES (?, ?, ?, ?)""",
+            (recipient, kind, text, time.time())))
+
+    def due(self, window, limit):
+        """Returns the events of up to limit recipients whose oldest event
+        is at least window seconds old, by recipient.
+        """
+        connection = self._connection()
+        recipients = [row[0] for row in connection.execute(
+            """SELECT recipient FROM events GROUP BY recipient
+               HAVING min(created) <= ? ORDER BY min(created) LIMIT ?""",
+            (time.time() - window, limit))]
+        events = {}
+        for recipient in recipients:
+            events[recipient] = [Event(*row) for row in connection.execute(
+                """SELECT id, recipient, kind, text, created FROM events
+                   WHERE recipient = ? ORDER BY created, id""",
+                (recipient, ))]
+        return events
+
+    def remove(self, events):
+        """Removes events sent."""
+        self._transaction(lambda connection: connection.executemany(
+            'DELETE FROM events WHERE id = ?',
+            [(event.pk, ) for event in events]))
+
+    def stats(self):
+        """Returns the number of events waiting, how many recipients they
+        are for and how long ago the oldest one happened.
+        """
+        row = self._connection().execute(
+            'SELECT count(*), count(DISTINCT recipient), min(created) '
+            'FROM events').fetchone()
+        return {
+            'events': row[0],
+            'recipients': row[1],
+            'oldest_age': row[2] is not None and time.time() - row[2] or 0.0,
+        }
+
+
+_default_store = None
+
+
+def get_store():
+    """Returns the store at settings.NOTIFICATION_DIGEST_PATH."""
+    global _default_store
+    if _default_store is None:
+        _default_store = DigestStore()
+    return _default_store
+
+
+def notify(recipient, kind, text):
+    """Tells the user at the recipient email address about an event of the
+    given kind, in their next digest.
+    """
+    get_store().add(recipient, kind, text)
+
+
+def render_digest(events, max_items=None):
+    """Returns the body of the digest of events, listing up to max_items of
+    them grouped by kind.
+    """
+    max_items = max_items or settings.NOTIFICATION_DIGEST_MAX_ITEMS
+    kinds = []
+    by_kind = {}
+    for event in events:
+        if event.kind not in by_kind:
+            by_kind[event.kind] = []
+            kinds.append(event.kind)
+        by_kind[event.kind].append(event.text)
+    lines = [_('You have %d new notifications.') % len(events)]
+    shown = 0
+    for kind in kinds:
+        texts = by_kind[kind][:max(max_items - shown, 0)]
+        if not texts:
+            break
+        lines.extend(['', KINDS.get(kind, kind) + ':'])
+        lines.extend(['  - %s' % text for text in texts])
+        shown += len(texts)
+    if shown < len(events):
+        lines.extend(['', _('And %d more.') % (len(events) - shown)])
+    return u'\n'.join(lines) + u'\n'
+
+
+class DigestScheduler(object):
+    """Sends the digests due, keeping count of how many events they
+    spared sending one by one.
+    """
+
+    def __init__(self, store=None, connection=None):
+        from syrinx.core.mail import get_connection
+        self.store = store or get_store()
+        self.connection = connection or get_connection()
+        self.events = 0
+        self.digests = 0
+
+    def send_due(self):
+        """Sends a batch of the digests due. Returns how many there were.
+        """
+        due = self.store.due(settings.NOTIFICATION_DIGEST_WINDOW,
+                             settings.NOTIFICATION_DIGEST_BATCH_SIZE)
+        if not due:
+            return 0
+        subject = settings.EMAIL_SUBJECT_PREFIX + \
+            settings.NOTIFICATION_DIGEST_SUBJECT
+        messages = []
+        events = []
+        for recipient, recipient_events in due.iteritems():
+            messages.append(EmailMessage(subject=subject,
+                body=render_digest(recipient_events),
+                from_email=settings.SERVER_EMAIL, to=[recipient]))
+            events.extend(recipient_events)
+        self.connection.send_messages(messages)
+        self.store.remove(events)
+        self.events += len(events)
+        self.digests += len(messages)
+        return len(messages)
+
+    def stats(self):
+        stats = self.store.stats()
+        stats.update({
+            'sent_events': self.events,
+            'digests': self.digests,
+            'ratio': self.digests and float(self.events) / self.digests or 0.0,
+        })
+        return stats
+
+    def run(self, once=False):
+        """Sends digests as they are due. With once, stops when there are
+        none left.
+        """
+        while True:
+            try:
+                count = self.send_due()
+            except Exception:
+                logger.exception('Could not send notification digests')
+                count = 0
+            if count:
+                logger.info('Sent %(digests)d digests of %(sent_events)d '
+                            'events (%(ratio).1f per message), %(events)d '
+                            'events waiting for %(recipients)d recipients',
+                            self.stats())
+            elif once:
+                return
+            else:
+                time.sleep(settings.NOTIFICATION_DIGEST_POLL_INTERVAL)
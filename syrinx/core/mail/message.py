@@ -10,6 +10,7 @@ from email.MIMEBase import MIMEBase
 from email.MIMEMultipart import MIMEMultipart
 from email.MIMEText import MIMEText
 from email.Utils import formatdate, getaddresses, formataddr, parseaddr
+import copy
 import mimetypes
 import os
 import random
@@ -34,6 +35,74 @@ class BadHeaderError(ValueError):
     pass
 
 
+# Headers that change from one message to another. They are left out of
+# the message skeletons, see EmailMessage.message().
+MESSAGE_HEADERS = ('to', 'cc', 'date', 'message-id')
+
+# Rendered message skeletons, by everything they are made of.
+_skeletons = {}
+
+# Rendered signatures, by template name.
+_signatures = {}
+
+_signature_environment = None
+
+# The second formatdate() was last called at, and what it returned.
+_date = (None, None)
+
+
+def clear_caches():
+    """Forgets the rendered signatures and message skeletons, as when their
+    templates change.
+    """
+    global _signature_environment
+    _skeletons.clear()
+    _signatures.clear()
+    _signature_environment = None
+
+
+def render_signature(template_name):
+    """Returns a signature template rendered, rendering it only the first
+    time. Its translations are those of the process.
+    """
+    global _signature_environment
+    try:
+        return _signatures[template_name]
+    except KeyError:
+        pass
+    from jinja2 import Environment, loaders
+    from gettext import gettext, ngettext
+
+    if _signature_environment is None:
+        fsloader = loaders.FileSystemLoader(settings.TEMPLATES_DIR)
+        environment = Environment(
+            extensions=['jinja2.ext.i18n'],
+            loader=fsloader)
+        environment.install_gettext_callables(gettext, ngettext, newstyle=True)
+        _signature_environment = environment
+    signature = _signature_environment.get_template(template_name).render()
+    _signatures[template_name] = signature
+    return signature
+
+
+def _formatdate():
+    """formatdate(), called once a second at most."""
+    global _date
+    now = int(time.time())
+    second, date = _date
+    if second != now:
+        date = formatdate(now)
+        _date = (now, date)
+    return date
+
+
+def _copy_message(msg):
+    """Returns a copy of a single part message, with its own headers."""
+    msg_copy = copy.copy(msg)
+    msg_copy._headers = list(msg._headers)
+    return msg_copy
+
+
 # Copied from Python standard library, with the following modifications:
 # * Used cached hostname for performance.
 # * Added try/except to support lack of getpid() in Jython (#5496).
@@ -167,6 +236,29 @@ class SafeMIMEMultipart(MIMEMultipart):
         return fp.getvalue()
 
 
+class RenderedMessage(object):
+    """A message already rendered, to be sent as it is.
+
+    It can be given to any email backend in place of an EmailMessage: it
+    is its own message().
+    """
+
+    def __init__(self, from_email, to, encoding, data):
+        self.from_email = from_email
+        self.to = to
+        self.encoding = encoding
+        self.data = data
+
+    def recipients(self):
+        return self.to
+
+    def message(self):
+        return self
+
+    def as_string(self):
+        return self.data
+
+
 class EmailMessage(object):
     """
     A container for email information.
@@ -213,19 +305,10 @@ class EmailMessage(object):
         self.connection = connection
 
     def get_body(self, body, signature_template=None):
-        from jinja2 import Environment, loaders
-        from gettext import gettext, ngettext
-
         signature = signature_template or settings.EMAIL_SIGNATURE_TEMPLATE
         if not signature:
             return body
-        fsloader = loaders.FileSystemLoader(settings.TEMPLATES_DIR)
-        environment = Environment(
-            extensions=['jinja2.ext.i18n'],
-            loader=fsloader)
-        environment.install_gettext_callables(gettext, ngettext, newstyle=True)
-        template = environment.get_template(signature)
-        return unicode('\n'.join((body, template.render())))
+        return unicode('\n'.join((body, render_signature(signature))))
 
     def get_connection(self, fail_silently=False):
         from syrinx.core.mail import get_connection
@@ -235,11 +318,7 @@ class EmailMessage(object):
 
     def message(self):
         encoding = self.encoding or settings.DEFAULT_CHARSET
-        msg = SafeMIMEText(smart_str(self.body, encoding),
-                           self.content_subtype, encoding)
-        msg = self._create_message(msg)
-        msg['Subject'] = self.subject
-        msg['From'] = self.extra_headers.get('From', self.from_email)
+        msg = self._get_skeleton(encoding)
         msg['To'] = ', '.join(self.to)
         if self.cc:
             msg['Cc'] = ', '.join(self.cc)
@@ -248,15 +327,60 @@ class EmailMessage(object):
         # accommodate that when doing comparisons.
         header_names = [key.lower() for key in self.extra_headers]
         if 'date' not in header_names:
-            msg['Date'] = formatdate()
+            msg['Date'] = _formatdate()
         if 'message-id' not in header_names:
             msg['Message-ID'] = make_msgid()
         for name, value in self.extra_headers.items():
-            if name.lower() == 'from':  # From is already handled
-                continue
-            msg[name] = value
+            if name.lower() in MESSAGE_HEADERS:
+                msg[name] = value
+        return msg
+
+    def _skeleton_key(self, encoding):
+        """Returns what the skeleton of the message is made of, or None if
+        it is not to be cached: messages with attachments or alternatives
+        are rendered each time.
+        """
+        if self.attachments or getattr(self, 'alternatives', None):
+            return None
+        headers = tuple(sorted(
+            (name, value) for name, value in self.extra_headers.items()
+            if name.lower() not in MESSAGE_HEADERS))
+        key = (self.__class__, self.content_subtype, encoding, self.subject,
+               self.from_email, self.body, headers)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _render_skeleton(self, encoding):
+        """Renders the message without the headers in MESSAGE_HEADERS."""
+        msg = SafeMIMEText(smart_str(self.body, encoding),
+                           self.content_subtype, encoding)
+        msg = self._create_message(msg)
+        msg['Subject'] = self.subject
+        msg['From'] = self.extra_headers.get('From', self.from_email)
+        for name, value in self.extra_headers.items():
+            # From is already handled.
+            if name.lower() not in MESSAGE_HEADERS + ('from', ):
+                msg[name] = value
         return msg
 
+    def _get_skeleton(self, encoding):
+        """Returns a copy of the skeleton of the message, rendered once for
+        every message made of the same subject, sender, body and headers.
+        """
+        key = self._skeleton_key(encoding)
+        if key is None:
+            return self._render_skeleton(encoding)
+        skeleton = _skeletons.get(key)
+        if skeleton is None:
+            skeleton = self._render_skeleton(encoding)
+            if len(_skeletons) >= settings.EMAIL_SKELETON_CACHE_SIZE:
+                _skeletons.clear()
+            _skeletons[key] = skeleton
+        return _copy_message(skeleton)
+
     def recipients(self):
         """
         Returns a list of all recipients of the email (includes direct
@@ -363,8 +487,9 @@ class EmailMultiAlternatives(EmailMessage):
         bytestrings). The SafeMIMEText class will handle any necessary encoding
         conversions.
         """
-        super(EmailMultiAlternatives, self).__init__(subject, body, from_email,
-            to, bcc, connection, attachments, headers, cc)
+        super(EmailMultiAlternatives, self).__init__(subject, body,
+            from_email=from_email, to=to, bcc=bcc, connection=connection,
+            attachments=attachments, headers=headers, cc=cc)
         self.alternatives = alternatives or []
 
     def attach_alternative(self, content, mimetype):
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+A local, durable queue of outgoing email.
+
+Queueing is opt-in: messages are queued when settings.EMAIL_BACKEND is
+syrinx.core.mail.backends.queued.EmailBackend. They are rendered when
+queued and kept in a sqlite database at settings.EMAIL_QUEUE_PATH, so
+queueing them takes no longer than writing a row. They are delivered by a
+separate worker, which must be running for them to be sent at all:
+
+    python runserver.py send_queued_mail
+
+which sends them with settings.EMAIL_QUEUE_BACKEND. Messages that fail are
+tried again later, waiting twice as long after each attempt, and are set
+aside as dead after settings.EMAIL_QUEUE_MAX_ATTEMPTS attempts.
+
+Several workers may share a queue: each claims the messages it sends for
+settings.EMAIL_QUEUE_LEASE seconds.
+"""
+
+from syrinx import settings
+from syrinx.core.mail.message import RenderedMessage
+
+import logging
+import sqlite3
+import threading
+import time
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_email TEXT NOT NULL,
+        recipients TEXT NOT NULL,
+        encoding TEXT,
+        data BLOB NOT NULL,
+        queued REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL NOT NULL,
+        claimed_until REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        dead INTEGER NOT NULL DEFAULT 0)""",
+    """CREATE INDEX IF NOT EXISTS messages_due
+        ON messages (dead, next_attempt)""",
+)
+
+logger = logging.getLogger('syrinx.core.mail.queue')
+
+
+class QueuedMessage(RenderedMessage):
+    """A message taken from the queue, as rendered when it was queued.
+    """
+
+    def __init__(self, pk, from_email, recipients, encoding, data, queued,
+                 attempts):
+        super(QueuedMessage, self).__init__(from_email, recipients, encoding,
+                                            data)
+        self.pk = pk
+        self.queued = queued
+        self.attempts = attempts
+
+
+class SpoolDatabase(object):
+    """A sqlite database shared by the threads and the processes of a
+    spool, created with the statements in schema.
+    """
+
+    schema = ()
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        """Returns the connection of the current thread to the database."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Transactions are started explicitly, see _transaction().
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            for statement in self.schema:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self, func, *args):
+        connection = self._connection()
+        # Taking the write lock first, other workers wait instead of
+        # claiming the same rows.
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(connection, *args)
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+
+class MailQueue(SpoolDatabase):
+    """The messages waiting to be sent, in a sqlite database.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path=None):
+        super(MailQueue, self).__init__(path or settings.EMAIL_QUEUE_PATH)
+
+    def put(self, email_messages):
+        """Queues EmailMessage objects, returning how many were queued."""
+        now = time.time()
+        rows = []
+        for message in email_messages:
+            recipients = message.recipients()
+            if not recipients:
+                continue
+            rows.append((message.from_email, '\n'.join(recipients),
+                         message.encoding,
+                         sqlite3.Binary(message.message().as_string()),
+                         now, now))
+        if rows:
+            self._transaction(lambda connection: connection.executemany(
+                """INSERT INTO messages (from_email, recipients, encoding,
+                   data, queued, next_attempt) VALUES (?, ?, ?, ?, ?, ?)""",
+                rows))
+        return len(rows)
+
+    def _claim(self, connection, limit, lease):
+        now = time.time()
+        rows = connection.execute(
+            """SELECT id, from_email, recipients, encoding, data, queued,
+               attempts FROM messages
+               WHERE dead = 0 AND next_attempt <= ? AND claimed_until <= ?
+               ORDER BY next_attempt, id LIMIT ?""",
+            (now, now, limit)).fetchall()
+        connection.executemany(
+            'UPDATE messages SET claimed_until = ? WHERE id = ?',
+            [(now + lease, row[0]) for row in rows])
+        return [QueuedMessage(pk, from_email, recipients.split('\n'),
+                              encoding, str(data), queued, attempts)
+                for pk, from_email, recipients, encoding, data, queued,
+                    attempts in rows]
+
+    def claim(self, limit=None, lease=None):
+        """Returns the messages due, oldest first, which no other worker
+        will get for lease seconds.
+        """
+        return self._transaction(self._claim,
+                                 limit or settings.EMAIL_QUEUE_BATCH_SIZE,
+                                 lease or settings.EMAIL_QUEUE_LEASE)
+
+    def done(self, messages):
+        """Removes messages sent."""
+        self._transaction(lambda connection: connection.executemany(
+            'DELETE FROM messages WHERE id = ?',
+            [(message.pk, ) for message in messages]))
+
+    def retry_delay(self, attempts):
+        """Returns the seconds to wait after a number of failed attempts."""
+        return min(settings.EMAIL_QUEUE_RETRY_DELAY * 2 ** (attempts - 1),
+                   settings.EMAIL_QUEUE_MAX_RETRY_DELAY)
+
+    def failed(self, message, error):
+        """Schedules a message to be tried again, or sets it aside if it
+        failed too many times. Returns whether it will be tried again.
+        """
+        attempts = message.attempts + 1
+        dead = attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS
+        self._transaction(lambda connection: connection.execute(
+            """UPDATE messages SET attempts = ?, next_attempt = ?,
+               claimed_until = 0, last_error = ?, dead = ? WHERE id = ?""",
+            (attempts, time.time() + self.retry_delay(attempts),
+             unicode(error), int(dead), message.pk)))
+        return not dead
+
+    def stats(self):
+        """Returns the number of messages queued, due, waiting to be tried
+        again and dead, and how long ago the oldest one was queued.
+        """
+        now = time.time()
+        row = self._connection().execute(
+            """SELECT count(*),
+                      sum(CASE WHEN next_attempt <= ? THEN 1 ELSE 0 END),
+                      sum(CASE WHEN attempts > 0 THEN 1 ELSE 0 END),
+                      min(queued)
+               FROM messages WHERE dead = 0""", (now, )).fetchone()
+        dead = self._connection().execute(
+            'SELECT count(*) FROM messages WHERE dead = 1').fetchone()[0]
+        return {
+            'queued': row[0],
+            'due': row[1] or 0,
+            'retrying': row[2] or 0,
+            'dead': dead,
+            'oldest_age': row[3] is not None and now - row[3] or 0.0,
+        }
+
+
+_default_queue = None
+
+
+def get_queue():
+    """Returns the queue at settings.EMAIL_QUEUE_PATH."""
+    global _default_queue
+    if _default_queue is None:
+        _default_queue = MailQueue()
+    return _default_queue
+
+
+class Worker(object):
+    """Sends the messages of a queue, keeping count of how it goes.
+
+    The messages claimed at once are shared among settings.EMAIL_QUEUE_WORKERS
+    threads, each with its own connection of settings.EMAIL_QUEUE_BACKEND,
+    if it is a parallel one. A connection given is used by a single thread.
+    """
+
+    def __init__(self, queue=None, connection=None, workers=None):
+        self.queue = queue or get_queue()
+        self.connection = connection
+        self.workers = workers or settings.EMAIL_QUEUE_WORKERS
+        self.sent = 0
+        self.retried = 0
+        self.died = 0
+        # Seconds from queueing to delivery of the messages sent.
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def _connections(self, count):
+        """Returns the connections to send count messages with."""
+        from syrinx.core.mail import get_connection
+        if self.connection is not None:
+            return [self.connection]
+        connections = [get_connection(settings.EMAIL_QUEUE_BACKEND)]
+        if getattr(connections[0], 'parallel', False):
+            connections.extend(get_connection(settings.EMAIL_QUEUE_BACKEND)
+                               for i in xrange(min(self.workers, count) - 1))
+        return connections
+
+    def _failed(self, message, error):
+        if self.queue.failed(message, error):
+            self.retried += 1
+        else:
+            self.died += 1
+        logger.warning('Could not send message %d to %s: %s', message.pk,
+                       ', '.join(message.to), error)
+
+    def _send(self, connection, messages, result):
+        """Sends messages over a connection, adding the (message, time
+        sent) pairs to result['sent'] and the (message, error) ones of the
+        messages which failed to result['failed'].
+        """
+        try:
+            connection.open()
+        except Exception, e:
+            result['failed'].extend((message, e) for message in messages)
+            return
+        try:
+            for message in messages:
+                try:
+                    connection.send_messages([message])
+                except Exception, e:
+                    result['failed'].append((message, e))
+                    continue
+                result['sent'].append((message, time.time()))
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                # The messages were sent all the same.
+                logger.exception('Could not close the connection')
+
+    def deliver(self):
+        """Sends a batch of the messages due. Returns how many there were.
+        """
+        messages = self.queue.claim()
+        if not messages:
+            return 0
+        connections = self._connections(len(messages))
+        results = [{'sent': [], 'failed': []} for connection in connections]
+        shares = [messages[index::len(connections)]
+                  for index in xrange(len(connections))]
+        if len(connections) == 1:
+            self._send(connections[0], messages, results[0])
+        else:
+            threads = [threading.Thread(target=self._send,
+                                        args=(connection, share, result))
+                       for connection, share, result in
+                       zip(connections, shares, results)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        sent = []
+        try:
+            for result in results:
+                for message, error in result['failed']:
+                    self._failed(message, error)
+                for message, delivered in result['sent']:
+                    sent.append(message)
+                    latency = delivered - message.queued
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+        finally:
+            # Removed even if recording the failures failed: they were sent.
+            self.queue.done(sent)
+        self.sent += len(sent)
+        return len(messages)
+
+    def stats(self):
+        stats = self.queue.stats()
+        stats.update({
+            'sent': self.sent,
+            'retried': self.retried,
+            'died': self.died,
+            'avg_latency': self.sent and self.total_latency / self.sent or 0.0,
+            'max_latency': self.max_latency,
+        })
+        return stats
+
+    def run(self, once=False):
+        """Sends messages as they are due. With once, stops when there are
+        none left.
+        """
+        while True:
+            try:
+                count = self.deliver()
+            except Exception:
+                logger.exception('Could not deliver queued mail')
+                count = 0
+            if count:
+                logger.info('Sent %(sent)d, %(queued)d queued, '
+                            '%(retrying)d retrying, %(dead)d dead, '
+                            'latency %(avg_latency).1fs avg '
+                            '%(max_latency).1fs max', self.stats())
+            elif once:
+                return
+            else:
+                time.sleep(settings.EMAIL_QUEUE_POLL_INTERVAL)
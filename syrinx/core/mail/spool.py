@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+An append-only spool of email messages, kept in segment files.
+
+Used by the file based email backend when settings.EMAIL_FILE_SPOOL is set.
+Each message is written as a record: a header with the length of the
+record, its CRC-32 and the time it was written, followed by the envelope
+and the rendered message. Writes are buffered and flushed after each batch.
+
+A segment is closed and a new one started once it reaches
+settings.EMAIL_FILE_SEGMENT_SIZE bytes, or when it is older than
+settings.EMAIL_FILE_SEGMENT_AGE seconds. Next to each segment, an index
+keeps the offset, length and time of its records, so read_spool() finds
+the messages written since a given time without reading what came before.
+"""
+
+from syrinx import settings
+from syrinx.core.mail.message import RenderedMessage
+
+import atexit
+import datetime
+import itertools
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Length of the record, its CRC-32 and the time it was written.
+HEADER = struct.Struct('>IId')
+# Offset, length and time of a record.
+INDEX_ENTRY = struct.Struct('>QId')
+
+SEGMENT_EXTENSION = '.seg'
+INDEX_EXTENSION = '.idx'
+
+
+class SpooledMessage(RenderedMessage):
+    """A message read from a spool, as it was written.
+    """
+
+    def __init__(self, from_email, to, encoding, data, created):
+        super(SpooledMessage, self).__init__(from_email, to, encoding, data)
+        self.created = created
+
+
+def _encode(message):
+    """Returns the record of an EmailMessage."""
+    recipients = u'\n'.join(message.recipients())
+    # The message itself goes last, so it is the only field which may
+    # contain NUL characters.
+    return '\0'.join((
+        (message.from_email or u'').encode('utf-8'),
+        recipients.encode('utf-8'),
+        message.encoding or '',
+        message.message().as_string()))
+
+
+def _decode(record, created):
+    from_email, recipients, encoding, data = record.split('\0', 3)
+    return SpooledMessage(from_email.decode('utf-8'),
+                          recipients.decode('utf-8').split(u'\n'),
+                          encoding or None, data, created)
+
+
+class SpoolWriter(object):
+    """Appends messages to the segments of a spool directory.
+
+    Writers of different processes may share a directory: each writes to
+    segments of its own.
+    """
+
+    def __init__(self, path, segment_size, segment_age, buffer_size):
+        self.path = path
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._segment = None
+        self._index = None
+        self._size = 0
+        self._opened = 0
+
+    def _open_segment(self):
+        now = time.time()
+        name = '%s-%d-%04d' % (
+            datetime.datetime.fromtimestamp(now).strftime('%Y%m%d-%H%M%S'),
+            os.getpid(), self._sequence.next())
+        base = os.path.join(self.path, name)
+        self._segment = open(base + SEGMENT_EXTENSION, 'ab', self.buffer_size)
+        self._index = open(base + INDEX_EXTENSION, 'ab', self.buffer_size)
+        self._size = 0
+        self._opened = now
+
+    def _close_segment(self):
+        segment, index = self._segment, self._index
+        self._segment = self._index = None
+        if segment is not None:
+            try:
+                segment.close()
+            finally:
+                index.close()
+
+    def _needs_rotation(self, now):
+        return (self._segment is None or
+                self._size >= self.segment_size or
+                now - self._opened >= self.segment_age)
+
+    def _flush(self, records, entries):
+        # The records first: the index never points past them.
+        self._segment.write(''.join(records))
+        self._segment.flush()
+        self._index.write(''.join(entries))
+        self._index.flush()
+
+    def write(self, email_messages):
+        """Appends EmailMessage objects, returning how many were written.
+
+        The whole batch is encoded first: a message which fails to encode
+        leaves the spool as it was.
+        """
+        encoded = [_encode(message) for message in email_messages]
+        self._lock.acquire()
+        try:
+            records = []
+            entries = []
+            for record in encoded:
+                now = time.time()
+                if self._needs_rotation(now):
+                    if records:
+                        self._flush(records, entries)
+                        records, entries = [], []
+                    self._close_segment()
+                    self._open_segment()
+                length = HEADER.size + len(record)
+                records.append(HEADER.pack(
+                    len(record), zlib.crc32(record) & 0xffffffff, now))
+                records.append(record)
+                entries.append(INDEX_ENTRY.pack(self._size, length, now))
+                self._size += length
+            if records:
+                self._flush(records, entries)
+        finally:
+            self._lock.release()
+        return len(email_messages)
+
+    def close(self):
+        """Closes the current segment, the next write starts another."""
+        self._lock.acquire()
+        try:
+            self._close_segment()
+        finally:
+            self._lock.release()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path):
+    """Returns the writer of the spool at path, shared by the backends of
+    the process.
+    """
+    _writers_lock.acquire()
+    try:
+        if path not in _writers:
+            _writers[path] = SpoolWriter(path,
+                settings.EMAIL_FILE_SEGMENT_SIZE,
+                settings.EMAIL_FILE_SEGMENT_AGE,
+                settings.EMAIL_FILE_BUFFER_SIZE)
+        return _writers[path]
+    finally:
+        _writers_lock.release()
+
+
+def close_writers():
+    """Closes the segments of every writer."""
+    _writers_lock.acquire()
+    try:
+        writers = _writers.values()
+    finally:
+        _writers_lock.release()
+    for writer in writers:
+        writer.close()
+
+atexit.register(close_writers)
+
+
+def get_segments(path):
+    """Returns the paths of the segments of a spool, oldest first."""
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.endswith(SEGMENT_EXTENSION)]
+
+
+def _index_path(segment):
+    return segment[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION
+
+
+def _index_entry(index, number):
+    index.seek(number * INDEX_ENTRY.size)
+    return INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+
+
+def _find_offset(segment, since):
+    """Returns the offset of the first record of segment written at since
+    or later, searching its index.
+    """
+    try:
+        index = open(_index_path(segment), 'rb')
+    except IOError:
+        return 0
+    try:
+        low = 0
+        high = os.fstat(index.fileno()).st_size // INDEX_ENTRY.size
+        if not high:
+            return 0
+        if _index_entry(index, high - 1)[2] < since:
+            # Records not indexed yet, if any, are read from there.
+            offset, length, created = _index_entry(index, high - 1)
+            return offset + length
+        while low < high:
+            middle = (low + high) // 2
+            if _index_entry(index, middle)[2] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return _index_entry(index, low)[0]
+    finally:
+        index.close()
+
+
+def read_segment(segment, since=None):
+    """Yields the messages of a segment written at since or later, all of
+    them by default. A record cut short or corrupted ends the segment.
+    """
+    offset = 0
+    if since is not None:
+        offset = _find_offset(segment, since)
+    stream = open(segment, 'rb')
+    try:
+        stream.seek(offset)
+        while True:
+            header = stream.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc, created = HEADER.unpack(header)
+            record = stream.read(length)
+            if (len(record) < length or
+                zlib.crc32(record) & 0xffffffff != crc):
+                return
+            if since is None or created >= since:
+                yield _decode(record, created)
+    finally:
+        stream.close()
+
+
+def read_spool(path=None, since=None):
+    """Yields the messages of a spool written at since or later, all of
+    them by default, segment by segment.
+    """
+    path = path or settings.EMAIL_FILE_PATH
+    for segment in get_segments(path):
+        for message in read_segment(segment, since):
+            yield message
+
+
+def count_messages(path=None):
+    """Returns the number of messages of a spool, as per its indexes."""
+    path = path or settings.EMAIL_FILE_PATH
+    total = 0
+    for segment in get_segments(path):
+        try:
+            total += os.path.getsize(_index_path(segment)) // INDEX_ENTRY.size
+        except OSError:
+            pass
+    return total
@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+from syrinx import settings
+from syrinx.core import mail
+from syrinx.core.mail.backends import filebased, smtp
+from syrinx.core.mail.backends.base import BaseEmailBackend
+from syrinx.core.mail import message as mail_message, spool
+from syrinx.core.mail.bulk import group_datatuple, render_once, send_bulk
+from syrinx.core.mail.digest import (DigestScheduler, DigestStore, Event,
+    render_digest)
+from syrinx.core.mail.message import EmailMessage, EmailMultiAlternatives
+from syrinx.core.mail.queue import MailQueue, Worker
+
+import asyncore
+import email
+import os
+import shutil
+import smtpd
+import tempfile
+import threading
+import time
+
+import unittest2 as unittest
+
+
+class SMTPServer(smtpd.SMTPServer):
+    """A local email server, counting its connections and keeping the
+    messages it receives.
+    """
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.connections = 0
+        self.messages = []
+        self._running = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _serve(self):
+        while self._running:
+            asyncore.loop(timeout=0.01, count=1)
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self.close()
+
+
+class SettingsTestCase(unittest.TestCase):
+    """A test case which may change settings for the length of a test."""
+
+    def setUp(self):
+        self._settings = {}
+
+    def tearDown(self):
+        for name, value in self._settings.iteritems():
+            if value is self:
+                delattr(settings, name)
+            else:
+                setattr(settings, name, value)
+
+    def set(self, **values):
+        for name, value in values.iteritems():
+            if name not in self._settings:
+                # Unset settings are marked by the test itself.
+                self._settings[name] = getattr(settings, name, self)
+            setattr(settings, name, value)
+
+
+def make_messages(count):
+    return [EmailMessage(subject='Test %d' % number, body='Hello',
+                         from_email='syrinx@example.com',
+                         to=['user%d@example.com' % number])
+            for number in range(count)]
+
+
+class SMTPBackendTests(SettingsTestCase):
+
+    def setUp(self):
+        SettingsTestCase.setUp(self)
+        self.server = SMTPServer()
+        self.set(EMAIL_POOL_MAX_MESSAGES=2, EMAIL_HOST_USER='',
+                 EMAIL_HOST_PASSWORD='')
+
+    def tearDown(self):
+        smtp.close_pools()
+        self.server.stop()
+        SettingsTestCase.tearDown(self)
+
+    def get_backend(self):
+        return smtp.EmailBackend(host='127.0.0.1', port=self.server.port,
+                                 username='', password='', use_tls=False)
+
+    def test_recycling(self):
+        backend = self.get_backend()
+        self.assertEquals(backend.send_messages(make_messages(5)), 5)
+        self.assertEquals(len(self.server.messages), 5)
+        # A connection per EMAIL_POOL_MAX_MESSAGES messages.
+        self.assertEquals(self.server.connections, 3)
+        self.assertEquals(backend.pool._idle[0].sent, 1)
+
+    def test_reuse(self):
+        backend = self.get_backend()
+        backend.send_messages(make_messages(1))
+        # Another backend, the same pool and the same connection.
+        self.get_backend().send_messages(make_messages(1))
+        self.assertEquals(len(self.server.messages), 2)
+        self.assertEquals(self.server.connections, 1)
+
+    def test_open(self):
+        backend = self.get_backend()
+        self.assertTrue(backend.open())
+        self.assertFalse(backend.open())
+        backend.send_messages(make_messages(3))
+        # Still open, on the connection which replaced the first one.
+        self.assertEquals(backend._pooled.sent, 1)
+        backend.close()
+        self.assertEquals(backend.connection, None)
+        self.assertEquals(len(backend.pool._idle), 1)
+        self.assertEquals(self.server.connections, 2)
+
+    def test_pool_timeout(self):
+        self.set(EMAIL_POOL_SIZE=1, EMAIL_POOL_TIMEOUT=0.05)
+        backend = self.get_backend()
+        backend.open()
+        # The only connection is held: waiting for it would never end.
+        self.assertRaises(smtp.PoolTimeout,
+                          self.get_backend().send_messages, make_messages(1))
+        backend.close()
+        self.assertEquals(self.get_backend().send_messages(make_messages(1)),
+                          1)
+
+
+class RecordingConnection(object):
+    """An email backend keeping what it sends, failing for the recipients
+    in fail.
+    """
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.sent = []
+
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+    def send_messages(self, email_messages):
+        for message in email_messages:
+            if self.fail.intersection(message.recipients()):
+                raise IOError('Refused')
+            self.sent.append(message)
+        return len(email_messages)
+
+
+class CountingBackend(BaseEmailBackend):
+    """An email backend keeping the messages each of its instances sends,
+    and the threads sending them.
+    """
+
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        super(CountingBackend, self).__init__(*args, **kwargs)
+        self.sent = []
+        self.threads = set()
+        self.instances.append(self)
+
+    def send_messages(self, email_messages):
+        self.sent.extend(email_messages)
+        self.threads.add(threading.currentThread())
+        return len(email_messages)
+
+
+class ParallelBackend(CountingBackend):
+
+    parallel = True
+
+
+class MailQueueTests(SettingsTestCase):
+
+    def setUp(self):
+        SettingsTestCase.setUp(self)
+        self.set(EMAIL_QUEUE_BATCH_SIZE=100, EMAIL_QUEUE_LEASE=300,
+                 EMAIL_QUEUE_MAX_ATTEMPTS=2, EMAIL_QUEUE_RETRY_DELAY=60,
+                 EMAIL_QUEUE_MAX_RETRY_DELAY=90)
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.queue = MailQueue(self.path)
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+        SettingsTestCase.tearDown(self)
+
+    def test_claim(self):
+        self.assertEquals(self.queue.put(make_messages(3)), 3)
+        claimed = self.queue.claim(limit=2)
+        self.assertEquals([message.to for message in claimed],
+                          [['user0@example.com'], ['user1@example.com']])
+        # Leased: another worker only gets the one left.
+        self.assertEquals(len(self.queue.claim()), 1)
+        self.assertEquals(self.queue.claim(), [])
+        self.queue.done(claimed)
+        self.assertEquals(self.queue.stats()['queued'], 1)
+
+    def test_lease_expired(self):
+        self.queue.put(make_messages(1))
+        self.assertEquals(len(self.queue.claim(lease=0.01)), 1)
+        time.sleep(0.02)
+        # The worker which claimed it did not finish in time.
+        self.assertEquals(len(self.queue.claim()), 1)
+
+    def test_retry_and_dead(self):
+        self.queue.put(make_messages(1))
+        message, = self.queue.claim()
+        self.assertTrue(self.queue.failed(message, 'Refused'))
+        self.assertEquals(self.queue.claim(), [])
+        stats = self.queue.stats()
+        self.assertEquals((stats['retrying'], stats['due']), (1, 0))
+        # Due again once the retry delay is over.
+        connection = self.queue._connection()
+        connection.execute('UPDATE messages SET next_attempt = 0')
+        message, = self.queue.claim()
+        self.assertEquals(message.attempts, 1)
+        self.assertFalse(self.queue.failed(message, 'Refused'))
+        connection.execute('UPDATE messages SET next_attempt = 0')
+        self.assertEquals(self.queue.claim(), [])
+        self.assertEquals(self.queue.stats()['dead'], 1)
+
+    def test_retry_delay(self):
+        self.assertEquals([self.queue.retry_delay(attempts)
+                           for attempts in (1, 2, 3)], [60, 90, 90])
+
+    def test_worker(self):
+        self.queue.put(make_messages(3))
+        connection = RecordingConnection(fail=['user1@example.com'])
+        worker = Worker(self.queue, connection)
+        self.assertEquals(worker.deliver(), 3)
+        self.assertEquals([message.to for message in connection.sent],
+                          [['user0@example.com'], ['user2@example.com']])
+        stats = worker.stats()
+        self.assertEquals((stats['sent'], stats['retried'], stats['queued']),
+                          (2, 1, 1))
+
+    def test_parallel_worker(self):
+        CountingBackend.instances[:] = []
+        self.set(EMAIL_QUEUE_BACKEND='syrinx.core.mail.tests.ParallelBackend')
+        self.queue.put(make_messages(7))
+        worker = Worker(self.queue, workers=3)
+        self.assertEquals(worker.deliver(), 7)
+        # A connection per thread, sharing the messages.
+        connections = CountingBackend.instances
+        self.assertEquals([len(connection.sent) for connection in connections],
+                          [3, 2, 2])
+        self.assertEquals(len(set(thread for connection in connections
+                                  for thread in connection.threads)), 3)
+        self.assertEquals(worker.stats()['queued'], 0)
+
+    def test_serial_worker(self):
+        CountingBackend.instances[:] = []
+        self.set(EMAIL_QUEUE_BACKEND='syrinx.core.mail.tests.CountingBackend')
+        self.queue.put(make_messages(3))
+        self.assertEquals(Worker(self.queue, workers=3).deliver(), 3)
+        connection, = CountingBackend.instances
+        self.assertEquals(len(connection.sent), 3)
+
+
+class BulkTests(SettingsTestCase):
+
+    LOCMEM = 'syrinx.core.mail.backends.locmem.EmailBackend'
+
+    def setUp(self):
+        SettingsTestCase.setUp(self)
+        self.set(EMAIL_BULK_BATCH_SIZE=2, EMAIL_BULK_WORKERS=3)
+        mail.outbox = []
+
+    def test_render_once(self):
+        message = EmailMessage(subject='News', body='Hello',
+                               from_email='syrinx@example.com',
+                               to=['nobody@example.com'])
+        recipients = ['foo@example.com', 'bar@example.com']
+        rendered = [email.message_from_string(copy.as_string())
+                    for copy in render_once(message, recipients)]
+        self.assertEquals([copy['To'] for copy in rendered], recipients)
+        self.assertNotEquals(rendered[0]['Message-ID'],
+                             rendered[1]['Message-ID'])
+        for copy in rendered:
+            self.assertEquals(copy['Subject'], 'News')
+            self.assertEquals(len(copy.get_all('To')), 1)
+            self.assertTrue(copy.get_payload().startswith('Hello'))
+
+    def test_group_datatuple(self):
+        messages = group_datatuple([
+            ('News', 'Hello', 'syrinx@example.com', ['foo@example.com']),
+            ('Other', 'Hello', 'syrinx@example.com', 'bar@example.com'),
+            ('News', 'Hello', 'syrinx@example.com', ['baz@example.com']),
+        ])
+        subjects = [(message.to, email.message_from_string(
+            message.as_string())['Subject']) for message in messages]
+        self.assertEquals(subjects, [(['foo@example.com'], 'News'),
+                                     (['baz@example.com'], 'News'),
+                                     (['bar@example.com'], 'Other')])
+
+    def test_send_bulk(self):
+        messages = make_messages(7)
+        self.assertEquals(send_bulk(messages, backend=self.LOCMEM), 7)
+        self.assertEquals(sorted(mail.outbox), sorted(messages))
+
+    def test_send_bulk_inline(self):
+        CountingBackend.instances[:] = []
+        messages = make_messages(7)
+        self.assertEquals(send_bulk(messages,
+            backend='syrinx.core.mail.tests.CountingBackend'), 7)
+        # Not a parallel backend: a single connection, the calling thread.
+        connection, = CountingBackend.instances
+        self.assertEquals(connection.threads, set([threading.currentThread()]))
+        self.assertEquals(send_bulk(messages,
+            backend='syrinx.core.mail.tests.ParallelBackend'), 7)
+        self.assertEquals(len(CountingBackend.instances), 4)
+
+    def test_send_bulk_failure(self):
+        messages = make_messages(4)
+        self.assertRaises(IOError, send_bulk, messages, workers=1,
+            backend='syrinx.core.mail.tests.FailingBackend')
+        self.assertEquals(send_bulk(messages, workers=1, fail_silently=True,
+            backend='syrinx.core.mail.tests.FailingBackend'), 0)
+
+
+class FailingBackend(object):
+    """An email backend which cannot send anything."""
+
+    def __init__(self, fail_silently=False):
+        self.fail_silently = fail_silently
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_messages(self, email_messages):
+        if not self.fail_silently:
+            raise IOError('Refused')
+        return 0
+
+
+class MessageTests(SettingsTestCase):
+
+    def setUp(self):
+        SettingsTestCase.setUp(self)
+        mail_message.clear_caches()
+
+    def make_message(self, to, **kwargs):
+        return EmailMessage(subject='News', body='Hello',
+                            from_email='syrinx@example.com', to=[to],
+                            **kwargs)
+
+    def test_skeleton_copies(self):
+        first = self.make_message('foo@example.com').message()
+        second = self.make_message('bar@example.com',
+                                   cc=['baz@example.com']).message()
+        self.assertEquals(len(mail_message._skeletons), 1)
+        # Headers set on one copy do not leak into the other.
+        self.assertEquals(first.get_all('To'), ['foo@example.com'])
+        self.assertEquals(first['Cc'], None)
+        self.assertEquals(second.get_all('To'), ['bar@example.com'])
+        self.assertEquals(second['Cc'], 'baz@example.com')
+        self.assertNotEquals(first['Message-ID'], second['Message-ID'])
+        skeleton = mail_message._skeletons.values()[0]
+        self.assertEquals(skeleton['To'], None)
+        self.assertEquals(skeleton['Message-ID'], None)
+
+    def test_skeleton_headers(self):
+        self.make_message('foo@example.com',
+                          headers={'Reply-To': 'a@example.com'}).message()
+        msg = self.make_message('foo@example.com',
+            headers={'Reply-To': 'b@example.com',
+                     'Message-ID': '<fixed@example.com>'}).message()
+        self.assertEquals(len(mail_message._skeletons), 2)
+        self.assertEquals(msg['Reply-To'], 'b@example.com')
+        self.assertEquals(msg.get_all('Message-ID'), ['<fixed@example.com>'])
+
+    def test_not_cached(self):
+        msg = EmailMultiAlternatives(subject='News', body='Hello',
+                                     to=['foo@example.com'])
+        msg.attach_alternative('<p>Hello</p>', 'text/html')
+        msg.message()
+        self.assertEquals(mail_message._skeletons, {})
+
+    def test_cache_size(self):
+        self.set(EMAIL_SKELETON_CACHE_SIZE=2)
+        for subject in ('One', 'Two', 'Three'):
+            EmailMessage(subject=subject, to=['foo@example.com']).message()
+        self.assertEquals(len(mail_message._skeletons), 1)
+
+
+class DigestTests(SettingsTestCase):
+
+    def setUp(self):
+        SettingsTestCase.setUp(self)
+        self.set(NOTIFICATION_DIGEST_WINDOW=0,
+                 NOTIFICATION_DIGEST_BATCH_SIZE=10,
+                 NOTIFICATION_DIGEST_MAX_ITEMS=3)
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.store = DigestStore(self.path)
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+        SettingsTestCase.tearDown(self)
+
+    def test_due(self):
+        self.store.add('foo@example.com', 'follow', 'bar follows you')
+        self.store.add('baz@example.com', 'follow', 'bar follows you')
+        self.store.add('foo@example.com', 'follow', 'baz follows you')
+        # Not due until the oldest event is window seconds old.
+        self.assertEquals(self.store.due(60, 10), {})
+        due = self.store.due(0, 1)
+        self.assertEquals(due.keys(), ['foo@example.com'])
+        self.assertEquals([event.text for event in due['foo@example.com']],
+                          ['bar follows you', 'baz follows you'])
+        self.store.remove(due['foo@example.com'])
+        self.assertEquals(self.store.stats()['events'], 1)
+
+    def test_render(self):
+        events = [Event(number, 'foo@example.com', kind, text, 0)
+                  for number, (kind, text) in enumerate([
+                      ('follow', 'bar follows you'),
+                      ('private_notice', 'Hello'),
+                      ('follow', 'baz follows you'),
+                      ('private_notice', 'Hallo'),
+                      ('follow', 'qux follows you')])]
+        # Grouped by kind, in the order each kind first came, up to
+        # NOTIFICATION_DIGEST_MAX_ITEMS events.
+        self.assertEquals(render_digest(events).splitlines(), [
+            'You have 5 new notifications.', '',
+            'New followers:', '  - bar follows you', '  - baz follows you',
+            '  - qux follows you', '',
+            'And 2 more.'])
+        self.assertEquals(render_digest(events, 4).splitlines()[6:], [
+            '', 'New private notices:', '  - Hello', '', 'And 1 more.'])
+
+    def test_scheduler(self):
+        for number in range(3):
+            self.store.add('foo@example.com', 'follow', 'user%d' % number)
+        self.store.add('bar@example.com', 'follow', 'user0')
+        connection = RecordingConnection()
+        scheduler = DigestScheduler(self.store, connection)
+        self.assertEquals(scheduler.send_due(), 2)
+        self.assertEquals(sorted(message.to for message in connection.sent),
+                          [['bar@example.com'], ['foo@example.com']])
+        self.assertEquals(scheduler.send_due(), 0)
+        stats = scheduler.stats()
+        self.assertEquals((stats['events'], stats['sent_events'],
+                           stats['digests']), (0, 4, 2))
+
+    def test_scheduler_failure(self):
+        self.store.add('foo@example.com', 'follow', 'user0')
+        connection = RecordingConnection(fail=['foo@example.com'])
+        self.assertRaises(IOError,
+                          DigestScheduler(self.store, connection).send_due)
+        # Kept for the next digest.
+        self.assertEquals(self.store.stats()['events'], 1)
+
+
+class SpoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        writer = spool._writers.pop(self.path, None)
+        if writer is not None:
+            writer.close()
+        shutil.rmtree(self.path)
+
+    def get_writer(self, segment_size=1024 * 1024):
+        return spool.SpoolWriter(self.path, segment_size, 3600, 4096)
+
+    def read(self, since=None):
+        return [message.to[0] for message in spool.read_spool(self.path,
+                                                               since)]
+
+    def test_round_trip(self):
+        writer = self.get_writer()
+        self.assertEquals(writer.write(make_messages(3)), 3)
+        writer.close()
+        messages = list(spool.read_spool(self.path))
+        self.assertEquals([message.to for message in messages],
+            [['user%d@example.com' % number] for number in range(3)])
+        self.assertEquals(messages[0].from_email, 'syrinx@example.com')
+        self.assertTrue('Subject: Test 0' in messages[0].as_string())
+        self.assertEquals(spool.count_messages(self.path), 3)
+
+    def test_rotation(self):
+        writer = self.get_writer(segment_size=1)
+        writer.write(make_messages(3))
+        writer.close()
+        self.assertEquals(len(spool.get_segments(self.path)), 3)
+        self.assertEquals(self.read(), ['user%d@example.com' % number
+                                        for number in range(3)])
+
+    def write_apart(self, writer):
+        """Writes two batches of messages, returning a time between them."""
+        writer.write(make_messages(2))
+        time.sleep(0.01)
+        since = time.time()
+        time.sleep(0.01)
+        writer.write(make_messages(3)[2:])
+        writer.close()
+        return since
+
+    def test_since(self):
+        since = self.write_apart(self.get_writer())
+        segment, = spool.get_segments(self.path)
+        # Found in the index, the records before are not read.
+        self.assertTrue(spool._find_offset(segment, since) > 0)
+        self.assertEquals(self.read(since), ['user2@example.com'])
+        self.assertEquals(len(self.read()), 3)
+
+    def test_unindexed_tail(self):
+        since = self.write_apart(self.get_writer())
+        segment, = spool.get_segments(self.path)
+        # The index of the last record was not written.
+        index = open(spool._index_path(segment), 'r+b')
+        index.truncate(2 * spool.INDEX_ENTRY.size)
+        index.close()
+        self.assertEquals(self.read(since), ['user2@example.com'])
+
+    def test_failed_batch(self):
+        writer = self.get_writer()
+        writer.write(make_messages(1))
+        bad = EmailMessage(subject='Bad\nsubject', body='Hello',
+                           from_email='syrinx@example.com',
+                           to=['bad@example.com'])
+        self.assertRaises(mail.BadHeaderError, writer.write,
+                          make_messages(2)[1:] + [bad])
+        time.sleep(0.01)
+        since = time.time()
+        time.sleep(0.01)
+        writer.write(make_messages(3)[2:])
+        writer.close()
+        # Nothing of the failed batch was written, the index is still right.
+        self.assertEquals(self.read(), ['user0@example.com',
+                                        'user2@example.com'])
+        self.assertEquals(self.read(since), ['user2@example.com'])
+
+    def test_corrupted(self):
+        writer = self.get_writer()
+        writer.write(make_messages(3))
+        writer.close()
+        segment, = spool.get_segments(self.path)
+        index = open(spool._index_path(segment), 'rb')
+        offset, length, created = spool._index_entry(index, 1)
+        index.close()
+        stream = open(segment, 'r+b')
+        stream.seek(offset + length - 1)
+        byte = stream.read(1)
+        stream.seek(offset + length - 1)
+        stream.write(chr(ord(byte) ^ 0xff))
+        stream.close()
+        # The CRC does not match: the segment ends before the record.
+        self.assertEquals(self.read(), ['user0@example.com'])
+
+    def test_torn(self):
+        writer = self.get_writer()
+        writer.write(make_messages(2))
+        writer.close()
+        segment, = spool.get_segments(self.path)
+        stream = open(segment, 'r+b')
+        stream.truncate(os.path.getsize(segment) - 1)
+        stream.close()
+        self.assertEquals(self.read(), ['user0@example.com'])
+
+    def test_backend(self):
+        backend = filebased.EmailBackend(file_path=self.path, spool=True)
+        self.assertFalse(backend.open())
+        self.assertEquals(backend.send_messages(make_messages(2)), 2)
+        spool.get_writer(self.path).close()
+        self.assertEquals(self.read(), ['user0@example.com',
+                                        'user1@example.com'])
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Password hashing, run in a bounded pool of threads.
+
+Hashing a password is slow on purpose. Running it in a few dedicated
+threads bounds how much of the process a burst of logins or registrations
+takes. When too many are already waiting, PoolBusy is raised and the
+request can be turned down instead of stalling the others.
+
+The pool is sized by settings.PASSWORD_WORKERS and
+settings.PASSWORD_QUEUE_SIZE, and each hash is waited for at most
+settings.PASSWORD_TIMEOUT seconds before JobTimeout is raised.
+
+Passwords are hashed following settings.PASSWORD_HASH_METHOD, with a work
+factor of settings.PASSWORD_WORK_FACTOR, or the default of the method. On
+startup, calibrate() sets the work factor to what a hash taking
+settings.PASSWORD_HASH_TIME seconds needs, in the pool, but not below
+settings.PASSWORD_WORK_FACTOR, or the minimum of the method if it is not
+set. Hashes weaker than that are replaced on the next successful login,
+see verify().
+"""
+
+from syrinx import settings
+from syrinx.core.workers import JobTimeout, PoolBusy, WorkerPool
+from syrinx.utils.security import HashingPolicy
+
+import threading
+
+pool = WorkerPool(settings.PASSWORD_WORKERS, settings.PASSWORD_QUEUE_SIZE,
+                  name='passwords')
+
+policy = HashingPolicy(settings.PASSWORD_HASH_METHOD,
+                       settings.PASSWORD_WORK_FACTOR)
+
+_calibration = None
+_calibration_lock = threading.Lock()
+
+
+def _calibrate(target):
+    minimum = (settings.PASSWORD_WORK_FACTOR or
+               policy.MINIMUM_WORK_FACTORS[policy.method])
+    return policy.calibrate(target, minimum=minimum)
+
+
+def calibrate():
+    """Starts calibrating the work factor of the policy in the pool, the
+    first time only, unless settings.PASSWORD_HASH_TIME is None. Returns
+    the Job doing it, or None.
+    """
+    global _calibration
+    _calibration_lock.acquire()
+    try:
+        if _calibration is None and settings.PASSWORD_HASH_TIME:
+            _calibration = pool.submit(_calibrate,
+                                       settings.PASSWORD_HASH_TIME)
+        return _calibration
+    finally:
+        _calibration_lock.release()
+
+
+def run(func, *args, **kwargs):
+    """Runs func in the password pool and returns its result."""
+    kwargs['timeout'] = settings.PASSWORD_TIMEOUT
+    return pool.run(func, *args, **kwargs)
+
+
+def hash_password(password):
+    return run(policy.hash, password)
+
+
+def check_password(pwhash, password):
+    return run(policy.check, pwhash, password)
+
+
+def verify(pwhash, password):
+    """Checks a password against its hash. Returns a (valid, new_hash)
+    tuple, new_hash being a hash to store instead if the one given is
+    weaker than the policy, or None.
+    """
+    return run(policy.verify_and_update, pwhash, password)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+from syrinx import settings
+from syrinx.core import passwords
+from syrinx.core.workers import JobTimeout, PoolBusy, WorkerPool
+from syrinx.utils.security import HashingPolicy
+
+import threading
+
+import unittest2 as unittest
+
+
+class WorkerPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(1, 1, name='test')
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def block(self):
+        """Keeps the worker of the pool busy until the test ends."""
+        started = threading.Event()
+
+        def blocked():
+            started.set()
+            self.release.wait()
+        job = self.pool.submit(blocked)
+        started.wait(5)
+        return job
+
+    def test_run(self):
+        self.assertEquals(self.pool.run(lambda a, b: a + b, 1, b=2), 3)
+        self.assertRaises(ZeroDivisionError, self.pool.run, lambda: 1 / 0)
+        stats = self.pool.stats()
+        self.assertEquals(stats['submitted'], 2)
+        self.assertEquals(stats['completed'], 1)
+        self.assertEquals(stats['failed'], 1)
+
+    def test_busy(self):
+        self.block()
+        # The only worker is busy: one job may wait, not two.
+        waiting = self.pool.submit(lambda: 'done')
+        self.assertRaises(PoolBusy, self.pool.submit, lambda: None)
+        self.assertEquals(self.pool.stats()['rejected'], 1)
+        self.release.set()
+        self.assertEquals(waiting.result(5), 'done')
+
+    def test_timeout(self):
+        job = self.block()
+        self.assertRaises(JobTimeout, job.result, 0.01)
+        self.release.set()
+        self.assertEquals(job.result(5), None)
+
+
+class HashingPolicyTests(unittest.TestCase):
+
+    def test_check(self):
+        for method, work_factor in (('bcrypt', 4), ('pbkdf2:sha256', 1000),
+                                    ('pbkdf2:sha1', 1000)):
+            policy = HashingPolicy(method, work_factor)
+            pwhash = policy.hash(u'passwd')
+            self.assertEquals(policy.identify(pwhash), (method, work_factor))
+            self.assertTrue(policy.check(pwhash, 'passwd'))
+            self.assertFalse(policy.check(pwhash, 'wrong'))
+
+    def test_malformed(self):
+        policy = HashingPolicy('pbkdf2:sha256', 1000)
+        for pwhash, method in (('$2a$', 'bcrypt'), ('$2a$xx$abc', 'bcrypt'),
+                               ('pbkdf2:sha256$salt$hash', 'pbkdf2:sha256'),
+                               ('pbkdf2:sha256:x$salt$hash', 'pbkdf2:sha256'),
+                               ('pbkdf2:sha256:0$salt$hash', 'pbkdf2:sha256')):
+            self.assertEquals(policy.identify(pwhash), (method, None))
+            self.assertFalse(policy.check(pwhash, 'passwd'))
+            self.assertTrue(policy.needs_rehash(pwhash))
+        # Well formed work factors, but not hashes.
+        self.assertFalse(policy.check('$2a$04$short', 'passwd'))
+        self.assertFalse(policy.check('pbkdf2:sha256:1000', 'passwd'))
+
+    def test_needs_rehash(self):
+        weak = HashingPolicy('pbkdf2:sha256', 1000)
+        strong = HashingPolicy('pbkdf2:sha256', 2000)
+        other = HashingPolicy('bcrypt', 4)
+        pwhash = weak.hash('passwd')
+        self.assertFalse(weak.needs_rehash(pwhash))
+        self.assertTrue(strong.needs_rehash(pwhash))
+        self.assertTrue(other.needs_rehash(pwhash))
+        self.assertFalse(strong.needs_rehash(strong.hash('passwd')))
+
+    def test_verify_and_update(self):
+        weak = HashingPolicy('pbkdf2:sha1', 1000)
+        strong = HashingPolicy('bcrypt', 4)
+        pwhash = weak.hash('passwd')
+        self.assertEquals(strong.verify_and_update(pwhash, 'wrong'),
+                          (False, None))
+        valid, new_hash = strong.verify_and_update(pwhash, 'passwd')
+        self.assertTrue(valid)
+        self.assertEquals(strong.identify(new_hash), ('bcrypt', 4))
+        self.assertEquals(strong.verify_and_update(new_hash, 'passwd'),
+                          (True, None))
+
+    def test_calibrate(self):
+        policy = HashingPolicy('pbkdf2:sha256')
+        lowest, highest = policy.WORK_FACTOR_RANGES['pbkdf2:sha256']
+        work_factor = policy.calibrate(0.001)
+        self.assertEquals(policy.work_factor, work_factor)
+        self.assertTrue(lowest <= work_factor <= highest)
+
+
+class PasswordsTests(unittest.TestCase):
+
+    def setUp(self):
+        # Let the calibration started on import finish first.
+        if passwords._calibration is not None:
+            passwords._calibration.result()
+        self.hash_time = settings.PASSWORD_HASH_TIME
+        self.work_factor = settings.PASSWORD_WORK_FACTOR
+        self.policy_work_factor = passwords.policy.work_factor
+        self.calibration = passwords._calibration
+        passwords._calibration = None
+
+    def tearDown(self):
+        settings.PASSWORD_HASH_TIME = self.hash_time
+        settings.PASSWORD_WORK_FACTOR = self.work_factor
+        passwords.policy.work_factor = self.policy_work_factor
+        passwords._calibration = self.calibration
+
+    def test_calibrate_once(self):
+        calibrations = []
+
+        def calibrate(target, minimum=None):
+            calibrations.append((target, threading.current_thread().name))
+            return 10
+        passwords.policy.calibrate = calibrate
+        try:
+            settings.PASSWORD_HASH_TIME = 0.01
+            job = passwords.calibrate()
+            self.assertTrue(passwords.calibrate() is job)
+            self.assertEquals(job.result(5), 10)
+        finally:
+            del passwords.policy.calibrate
+        self.assertEquals(len(calibrations), 1)
+        target, thread = calibrations[0]
+        self.assertEquals(target, 0.01)
+        self.assertTrue(thread.startswith('passwords'))
+
+    def test_calibrate_disabled(self):
+        settings.PASSWORD_HASH_TIME = None
+        self.assertTrue(passwords.calibrate() is None)
+
+    def test_calibrate_minimum(self):
+        settings.PASSWORD_HASH_TIME = 0.001
+        settings.PASSWORD_WORK_FACTOR = None
+        minimum = passwords.policy.MINIMUM_WORK_FACTORS[
+            passwords.policy.method]
+        self.assertEquals(passwords.calibrate().result(5), minimum)
+        self.assertEquals(passwords.policy.work_factor, minimum)
+
+    def test_calibrate_never_below_setting(self):
+        settings.PASSWORD_HASH_TIME = 0.001
+        settings.PASSWORD_WORK_FACTOR = 11
+        passwords.calibrate().result(5)
+        self.assertEquals(passwords.policy.work_factor, 11)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded pools of worker threads, for slow work that must not take over the
+threads serving requests, such as hashing passwords.
+
+A pool runs at most `size` jobs at once and keeps at most `max_queue`
+waiting: past that, new jobs are refused with PoolBusy instead of piling up
+behind the ones already queued.
+"""
+
+from Queue import Queue
+import sys
+import threading
+import time
+
+
+class PoolBusy(Exception):
+    """The queue of a worker pool is full."""
+    pass
+
+
+class JobTimeout(Exception):
+    """A job did not finish in time."""
+    pass
+
+
+class Job(object):
+    """A call to be run by a worker pool.
+    """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.submitted = time.time()
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self):
+        try:
+            self._result = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def result(self, timeout=None):
+        """Waits for the job to finish and returns what it returned, or
+        raises what it raised.
+        """
+        self._done.wait(timeout)
+        if not self._done.isSet():
+            raise JobTimeout('Job not finished after %s seconds' % timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class WorkerPool(object):
+    """A fixed number of threads running the jobs submitted, in order.
+
+    Threads are started on the first job.
+    """
+
+    def __init__(self, size, max_queue, name='workers'):
+        self.size = size
+        self.max_queue = max_queue
+        self.name = name
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._started = 0
+        # Jobs submitted and not started yet.
+        self._waiting = 0
+        self._max_waiting = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._run_time = 0.0
+        self._max_run_time = 0.0
+
+    def _start(self):
+        while len(self._threads) < self.size:
+            thread = threading.Thread(target=self._work, name='%s-%d' % (
+                self.name, len(self._threads)))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            started = time.time()
+            self._lock.acquire()
+            try:
+                self._waiting -= 1
+                self._started += 1
+                waited = started - job.submitted
+                self._wait_time += waited
+                self._max_wait_time = max(self._max_wait_time, waited)
+            finally:
+                self._lock.release()
+            job.run()
+            elapsed = time.time() - started
+            self._lock.acquire()
+            try:
+                if job._exc_info is None:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                self._run_time += elapsed
+                self._max_run_time = max(self._max_run_time, elapsed)
+            finally:
+                self._lock.release()
+
+    def submit(self, func, *args, **kwargs):
+        """Queues a call to func, returning its Job. Raises PoolBusy when
+        max_queue jobs are already waiting.
+        """
+        job = Job(func, args, kwargs)
+        self._lock.acquire()
+        try:
+            if self._waiting >= self.max_queue:
+                self._rejected += 1
+                raise PoolBusy('%s: %d jobs waiting' % (self.name,
+                                                        self._waiting))
+            self._submitted += 1
+            self._waiting += 1
+            self._max_waiting = max(self._max_waiting, self._waiting)
+            if len(self._threads) < self.size:
+                self._start()
+        finally:
+            self._lock.release()
+        self._queue.put(job)
+        return job
+
+    def run(self, func, *args, **kwargs):
+        """Runs func in the pool and waits for its result. The number of
+        seconds to wait for may be given as timeout.
+        """
+        timeout = kwargs.pop('timeout', None)
+        return self.submit(func, *args, **kwargs).result(timeout)
+
+    def stats(self):
+        """Returns the counters of the pool since it was created or the last
+        reset_stats(); times are in seconds.
+        """
+        self._lock.acquire()
+        try:
+            finished = self._completed + self._failed
+            return {
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'completed': self._completed,
+                'failed': self._failed,
+                'waiting': self._waiting,
+                'max_waiting': self._max_waiting,
+                'avg_wait_time': (self._started and
+                                  self._wait_time / self._started or 0.0),
+                'max_wait_time': self._max_wait_time,
+                'avg_run_time': (finished and
+                                 self._run_time / finished or 0.0),
+                'max_run_time': self._max_run_time,
+            }
+        finally:
+            self._lock.release()
+
+    def reset_stats(self):
+        self._lock.acquire()
+        try:
+            waiting = self._waiting
+            self._reset_stats()
+            self._waiting = waiting
+        finally:
+            self._lock.release()
@@ -1,15 +1,214 @@
 # -*- coding: utf-8 -*-
 from syrinx import app
+from syrinx.core.cache import cache, get_cache
+from syrinx.core.mail.digest import notify
+from syrinx.core.workers import JobTimeout, PoolBusy
 from syrinx.interface.www.forms import FollowForm
-from syrinx.models import db, User, Message, Follower
-from syrinx.utils.security import check_password_hash
+from syrinx.models.backends.sqlalchemy.models import (db, User, Message,
+    Follower, FollowVersion, TimelineEntry, user_ids)
+from syrinx.models.graph import FollowerGraph
 
+from datetime import datetime
 from flask import (Module, request, session, url_for, redirect,
     render_template, abort, g, flash)
+from gettext import gettext as _
+from hashlib import md5
+from werkzeug.http import is_resource_modified, quote_etag
+import logging
 import time
 
 # app = Module(__name__, 'views')
 
+DIRECTORY_KEY = 'directory:%d'
+FOLLOW_CHANGED_KEY = 'follow_changed:%s'
+PUBLIC_TIMELINE_KEY = 'public_timeline'
+USER_KEY = 'user:%s'
+
+# Shown when the password pool turns a login or a registration down.
+BUSY_ERROR = 'Too many people are logging in right now, try again shortly'
+
+logger = logging.getLogger('syrinx.interface.www.views')
+
+# Snapshots of the local users, by username.
+user_cache = get_cache(app.config['USER_CACHE_BACKEND'])
+
+# Who follows whom, by user id, see get_graph().
+follower_graph = FollowerGraph()
+
+
+def get_cursor():
+    """Returns the (max_id, since_id) pagination cursor of the request."""
+    return (request.args.get('max_id', type=int),
+            request.args.get('since_id', type=int))
+
+
+def get_messages(query):
+    """Runs a timeline query and returns its messages as dicts."""
+    messages = Message.load_authors(list(query), g.authors)
+    return [message.as_dict() for message in messages]
+
+
+def get_public_timeline():
+    """Returns the first page of the public timeline.
+
+    It is cached until add_message() invalidates it or it expires.
+    """
+    messages = cache.get(PUBLIC_TIMELINE_KEY)
+    if messages is None:
+        messages = get_messages(Message.paginate())
+        cache.set(PUBLIC_TIMELINE_KEY, messages)
+    return messages
+
+
+def render_timeline(messages, **context):
+    """Renders a page of messages along with the link to the older ones."""
+    older = None
+    if len(messages) >= app.config['PER_PAGE']:
+        older = url_for(request.endpoint, max_id=messages[-1]['id'],
+                        **request.view_args)
+    return render_template('timeline.html', messages=messages, older=older,
+                           **context)
+
+
+def get_directory(after=None, limit=None):
+    """Returns a page of the user directory as a list of dicts.
+
+    The first page is cached, so showing it does not cost a query per
+    request.
+    """
+    limit = limit or app.config['DIRECTORY_PER_PAGE']
+    key = DIRECTORY_KEY % limit
+    if after is None:
+        users = cache.get(key)
+        if users is not None:
+            return users
+    users = [{'id': user.id, 'username': user.username, 'email': user.email}
+             for user in User.directory(after=after, limit=limit)]
+    if after is None:
+        cache.set(key, users, app.config['DIRECTORY_CACHE_TIMEOUT'])
+    return users
+
+
+def get_who_to_follow(limit):
+    """Returns up to limit users of the first page of the directory, leaving
+    out the current user and the users already followed.
+    """
+    users = get_directory()
+    if g.user:
+        not_followed = set(get_graph(g.user.id).not_followed(
+            g.user.id, sorted(user['id'] for user in users)))
+        users = [user for user in users
+                 if user['id'] in not_followed and user['id'] != g.user.id]
+    return users[:limit]
+
+
+def get_graph(*users):
+    """Returns the follower graph, with the follows of the given users up to
+    date: those loaded the first time, and whenever they changed since, in
+    any process.
+
+    Checking costs a single query by primary key: the version of the
+    follows of each user is stored along with them, see FollowVersion.
+    """
+    graph = follower_graph
+    versions = FollowVersion.get_many(users)
+    stale = [user for user, version in versions.iteritems()
+             if graph.versions.get(user) != version]
+    if stale:
+        Follower.load_follows(graph, stale)
+        for user in stale:
+            graph.versions[user] = versions[user]
+    return graph
+
+
+def update_graph(who, whom, versions, follow=True):
+    """Applies a follow, or an unfollow, committed along with the given
+    versions of the follows of who and whom, to the graph.
+    """
+    graph = follower_graph
+    if follow:
+        graph.follow(who, whom)
+    else:
+        graph.unfollow(who, whom)
+    for user in set((who, whom)):
+        if graph.versions.get(user) == versions[user] - 1:
+            graph.versions[user] = versions[user]
+        # Otherwise someone else changed them too: loaded again on next use.
+
+
+def get_follow_changed(username):
+    """Returns when the given user last followed or unfollowed someone.
+
+    It is kept in the cache only; if it is not there it is assumed to be now,
+    so pages depending on it are rendered again.
+    """
+    key = FOLLOW_CHANGED_KEY % username
+    changed = cache.get(key)
+    if changed is None:
+        changed = datetime.now().replace(microsecond=0)
+        cache.add(key, changed, 0)
+    return changed
+
+
+def set_follow_changed(username):
+    """Records that the given user followed or unfollowed someone."""
+    cache.set(FOLLOW_CHANGED_KEY % username,
+              datetime.now().replace(microsecond=0), 0)
+
+
+def conditional(render, version, *dates):
+    """Answers a conditional GET of a page.
+
+    version is anything that changes whenever the page does (e.g. the id of
+    the newest message shown) and the page was last modified at the latest
+    of the given dates (None meaning unknown). If the client already has the
+    current version of the page a 304 Not Modified is answered, without
+    calling render() to build the page.
+    """
+    etag = md5(repr((version, g.user and g.user.username))).hexdigest()
+    last_modified = max([date for date in dates if date] or [None])
+    if last_modified:
+        # Dates are stored in local time, HTTP dates are in GMT and have no
+        # sub-second precision.
+        last_modified = datetime.utcfromtimestamp(
+            time.mktime(last_modified.timetuple()))
+    # Flashed messages are only shown once, a cached page would miss them.
+    if '_flashes' not in session and not is_resource_modified(
+            request.environ, quote_etag(etag), last_modified=last_modified):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(render())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Pages differ among users, shared caches must not store them.
+    response.headers['Vary'] = 'Cookie'
+    response.headers['Cache-Control'] = 'private'
+    return response
+
+
+def get_user(username):
+    """Returns a snapshot of the given local user, or None if there is no
+    such user. Snapshots are cached until they expire or invalidate_user() is
+    called.
+    """
+    key = USER_KEY % username
+    user = user_cache.get(key)
+    if user is None:
+        user = User.query.get((username, ''))
+        if user is None:
+            return None
+        user = user.snapshot()
+        user_cache.set(key, user)
+    return user
+
+
+def invalidate_user(username):
+    """Drops the cached snapshot of a user. Must be called whenever the
+    user's profile changes.
+    """
+    user_cache.delete(USER_KEY % username)
+
 
 @app.before_request
 def before_request():
@@ -17,8 +216,12 @@ def before_request():
     up the current user so that we know he's there.
     """
     g.user = None
+    # Users fetched during the request, by id.
+    g.authors = {}
     if 'username' in session:
-        g.user = User.query.get((session['username'], ''))
+        g.user = get_user(session['username'])
+        if g.user:
+            g.authors[g.user.id] = g.user
 
 
 @app.route('/')
@@ -29,54 +232,81 @@ def timeline():
     """
     if not g.user:
         return redirect(url_for('public_timeline'))
-    return render_template('timeline.html',
-        messages=Message.query.filter_by(author=session['username']),
-        users=User.query.all())
-
-    # ============================================================= #
-    #                                                               #
-    # return render_template('timeline.html', messages=query_db(''' #
-    #     select message.*, user.* from message, user               #
-    #     where message.author_id = user.user_id and (              #
-    #         user.user_id = ? or                                   #
-    #         user.user_id in (select whom_id from follower         #
-    #                                 where who_id = ?))            #
-    #     order by message.pub_date desc limit ?''',                #
-    #     [session['user_id'], session['user_id'], PER_PAGE]))      #
-    #                                                               #
-    # ============================================================= #
+    max_id, since_id = get_cursor()
+    latest_id, last_modified = TimelineEntry.latest(g.user.id)
+    follow_changed = get_follow_changed(g.user.username)
+
+    def render():
+        return render_timeline(get_messages(TimelineEntry.get_messages(
+            g.user.id, max_id=max_id, since_id=since_id)),
+            users=get_who_to_follow(app.config['WHO_TO_FOLLOW_SIZE']))
+    return conditional(render, (latest_id, follow_changed), last_modified,
+                       follow_changed)
 
 
 @app.route('/public')
 def public_timeline():
     """Displays the latest messages of all users."""
-    return render_template('timeline.html', messages=Message.query.all(),
-        users=User.query.all())
+    max_id, since_id = get_cursor()
+    messages = None
+    if max_id or since_id:
+        latest_id, last_modified = Message.latest()
+    else:
+        messages = get_public_timeline()
+        latest_id, last_modified = (None, None)
+        if messages:
+            latest_id = messages[0]['id']
+            last_modified = messages[0]['date_publish']
+
+    def render():
+        return render_timeline(messages or get_messages(Message.paginate(
+            max_id=max_id, since_id=since_id)),
+            users=get_who_to_follow(app.config['WHO_TO_FOLLOW_SIZE']))
+    return conditional(render, latest_id, last_modified)
+
+
+@app.route('/users')
+def directory():
+    """Lists the local users, a page at a time."""
+    after = request.args.get('after')
+    users = get_directory(after=after)
+    following = None
+    if len(users) >= app.config['DIRECTORY_PER_PAGE']:
+        following = url_for('directory', after=users[-1]['username'])
+    return render_template('directory.html', users=users, following=following)
 
 
 @app.route('/<username>')
 def user_timeline(username):
     """Display's a users tweets."""
     profile_user = User.query.get_or_404((username, ''))
+    profile_id = profile_user.id
+    graph = get_graph(*[user_id for user_id in
+                        (profile_id, g.user and g.user.id) if user_id])
     followed = False
+    followed_by = []
+    follow_changed = None
     if g.user:
-        followed = Follower.query.get((session['username'],
-            profile_user.username,)) is not None
-    return render_template('timeline.html',
-        messages=Message.query.filter_by(
-            author=profile_user.username).order_by(
-                'date_publish')[:app.config['PER_PAGE']],
-                # FIXME: Retrive PER_PAGE from a database-stored configuration.
-        followed=followed, profile_user=profile_user)
-        # ======================================================== #
-        #                                                          #
-        # select message.*, user.* from message, user where        #
-        # user.user_id = message.author_id and user.user_id = ?    #
-        # order by message.pub_date desc limit ?''',               #
-        # [profile_user['user_id'], PER_PAGE]), followed=followed, #
-        # profile_user=profile_user)                               #
-        #                                                          #
-        # ======================================================== #
+        followed = graph.is_following(g.user.id, profile_id)
+        followed_by = user_ids.keys(graph.followed_by_following(g.user.id,
+                                                                profile_id))
+        follow_changed = get_follow_changed(g.user.username)
+    followers_count = graph.count_followers(profile_id)
+    following_count = graph.count_following(profile_id)
+    max_id, since_id = get_cursor()
+    latest_id, last_modified = Message.latest(author=profile_id)
+
+    def render():
+        # FIXME: Retrive PER_PAGE from a database-stored configuration.
+        return render_timeline(get_messages(Message.paginate(
+            Message.query.filter_by(author=profile_id),
+            max_id=max_id, since_id=since_id)),
+            followed=followed, profile_user=profile_user,
+            followed_by=followed_by, followers_count=followers_count,
+            following_count=following_count)
+    return conditional(render, (latest_id, followed,
+                                graph.versions.get(profile_id)),
+                       last_modified, follow_changed)
 
 
 @app.route('/<username>/follow')
@@ -86,9 +316,22 @@ def follow_user(username):
         redirect(url_for('follow_remote', username=username))
     user = User.query.get_or_404((g.user.username, ''))
     whom = User.query.get_or_404((username, ''))
-    follower = Follower(who=user, whom=whom)
+    follower = Follower(who_id=user.id, whom_id=whom.id,
+                        date_follow=datetime.now())
     db.session.add(follower)
+    TimelineEntry.backfill(user.id, whom.id)
+    versions = FollowVersion.bump([user.id, whom.id])
     db.session.commit()
+    update_graph(user.id, whom.id, versions)
+    set_follow_changed(user.username)
+    if whom.email and whom.email_notification:
+        try:
+            notify(whom.email, 'follow',
+                   _('%s is now following you') % user.username)
+        except Exception:
+            # The follow is done, only the email is lost.
+            logger.exception('Could not notify %s of a new follower',
+                             whom.username)
     flash('You are now following "%s"' % username)
     return redirect(url_for('user_timeline', username=username))
 
@@ -105,6 +348,7 @@ def follow_remote(username):
         logging.debug('valid!')  # DEBUG
         username, server = form.account.split('@')
         remote_user = User(username=username, server=server)
+        user_ids.intern(remote_user.key)
         db.session.add(remote_user)
         db.session.commit()
         # FIXME: Mandarlo a confirmar a su servidor.
@@ -116,11 +360,14 @@ def unfollow_user(username):
     """Removes the current user as follower of the given user."""
     if not g.user:
         abort(401)
-    user = User.query.get_or_404((username, ''))
-    whom = user.username
-    follower = Follower.query.get((session['username'], whom,))
+    whom = User.query.get_or_404((username, '')).id
+    follower = Follower.query.get((g.user.id, whom))
     db.session.delete(follower)
+    TimelineEntry.purge(g.user.id, whom)
+    versions = FollowVersion.bump([g.user.id, whom])
     db.session.commit()
+    update_graph(g.user.id, whom, versions, follow=False)
+    set_follow_changed(session['username'])
     flash('You are no longer following "%s"' % username)
     return redirect(url_for('user_timeline', username=username))
 
@@ -131,10 +378,16 @@ def add_message():
     if 'username' not in session:
         abort(401)
     if request.form['text']:
-        message = Message(author=session['username'],
-            text=request.form['text'])
+        message = Message(author=g.user.id,
+            text=request.form['text'], date_publish=datetime.now())
         db.session.add(message)
+        # Flush to get the message id before fanning it out.
+        db.session.flush()
+        TimelineEntry.fan_out(message)
         db.session.commit()
+        # Rebuilt on next read: updating it in place would race with other
+        # processes posting at the same time.
+        cache.delete(PUBLIC_TIMELINE_KEY)
         flash('Your message was recorded')
     return redirect(url_for('timeline'))
 
@@ -149,12 +402,19 @@ def login():
         user = User.query.get((request.form['username'], ''))
         if user is None:
             error = 'Invalid username'
-        elif not check_password_hash(user._password, request.form['password']):
-            error = 'Invalid password'
         else:
-            flash('You were logged in')
-            session['username'] = user.username
-            return redirect(url_for('timeline'))
+            try:
+                valid = user.check_password(request.form['password'])
+            except (PoolBusy, JobTimeout):
+                return render_template('login.html', error=BUSY_ERROR), 503
+            if not valid:
+                error = 'Invalid password'
+            else:
+                # Stores the password hash if it was upgraded.
+                db.session.commit()
+                flash('You were logged in')
+                session['username'] = user.username
+                return redirect(url_for('timeline'))
     return render_template('login.html', error=error)
 
 
@@ -174,15 +434,23 @@ def register():
             error = 'You have to enter a password'
         elif request.form['password'] != request.form['password2']:
             error = 'The two passwords do not match'
-        elif not User.query.filter_by(username=request.form['username']):
+        elif User.query.filter_by(
+                username=request.form['username']).first() is not None:
             error = 'The username is already taken'
         else:
             user = User(
                 username=request.form['username'],
-                password=request.form['password'],
                 email=request.form['email'])
+            try:
+                user.set_password(request.form['password'])
+            except (PoolBusy, JobTimeout):
+                return render_template('register.html', error=BUSY_ERROR), 503
+            # Interned along with the user, see UserIds.
+            user_ids.intern(user.key)
             db.session.add(user)
             db.session.commit()
+            invalidate_user(user.username)
+            cache.delete(DIRECTORY_KEY % app.config['DIRECTORY_PER_PAGE'])
             flash('You were successfully registered and can login now')
             return redirect(url_for('login'))
     return render_template('register.html', error=error)
@@ -36,15 +36,21 @@ try:
     from hashlib import md5
 except ImportError:
     from md5 import new as md5
+import httplib
 import os
+import select
 import simplejson
+import socket
 import sys
 import tempfile
+import threading
 import time
 import calendar
 import urllib
 import urllib2
-from urlparse import urlparse, urlunparse
+import zlib
+from urlparse import urljoin, urlparse, urlunparse
+from StringIO import StringIO
 
 
 class Error(Exception):
@@ -53,7 +59,23 @@ class Error(Exception):
     pass
 
 
-class Status(object):
+class _Slotted(object):
+    """Pickles the slots of its subclasses, which pickle protocols 0 and 1
+    cannot do by themselves.
+    """
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__
+                    if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+
+class Status(_Slotted):
     """A class representing the Status structure used by the API.
 
     The Status structure exposes the following properties:
@@ -68,6 +90,9 @@ class Status(object):
 
     """
 
+    # Without a __dict__ per instance, large timelines take much less memory.
+    __slots__ = ('created_at', 'favorited', 'id', 'text', 'user', '_now')
+
     def __init__(self, created_at=None, favorited=None, id=None, text=None,
                  user=None, now=None):
         """An object to hold a status message.
@@ -242,7 +267,7 @@ class Status(object):
             text=data.get('text', None), user=user)
 
 
-class User(object):
+class User(_Slotted):
     """A class representing the User structure used by the twitter API.
 
     The User structure exposes the following properties:
@@ -256,6 +281,10 @@ class User(object):
         user.url
         user.status
     """
+
+    __slots__ = ('id', 'name', 'screen_name', 'location', 'description',
+                 'profile_image_url', 'url', 'status')
+
     def __init__(self, id=None, name=None, screen_name=None, location=None,
                  description=None, profile_image_url=None, url=None,
                  status=None):
@@ -352,7 +381,7 @@ class User(object):
             url=data.get('url', None), status=status)
 
 
-class DirectMessage(object):
+class DirectMessage(_Slotted):
     """A class representing the DirectMessage structure used by the twitter
     API.
 
@@ -368,6 +397,9 @@ class DirectMessage(object):
         direct_message.text
     """
 
+    __slots__ = ('id', 'created_at', 'sender_id', 'sender_screen_name',
+                 'recipient_id', 'recipient_screen_name', 'text')
+
     def __init__(self, id=None, created_at=None, sender_id=None,
                  sender_screen_name=None, recipient_id=None,
                  recipient_screen_name=None, text=None):
@@ -554,11 +586,16 @@ class API(object):
     """
 
     DEFAULT_CACHE_TIMEOUT = 60  # 1 minute
+    DEFAULT_POOL_SIZE = 4  # Idle connections kept per host.
+    DEFAULT_POOL_KEEPALIVE = 30  # Seconds an idle connection is kept.
+    DEFAULT_TIMEOUT = 30  # Seconds to wait for the server.
+    MAX_REDIRECTS = 5
 
     _API_REALM = 'Microblogging API'
 
     def __init__(self, username=None, password=None, use_ssl=True, domain=None,
-                 input_encoding=None, request_headers=None):
+                 input_encoding=None, request_headers=None, pool_size=None,
+                 pool_keepalive=None, timeout=None):
         """Instantiate a new microblogging.API object.
 
         Args:
@@ -570,6 +607,13 @@ class API(object):
                 The encoding used to encode input strings. [optional]
             request_header:
                 A dictionary of additional HTTP request headers. [optional]
+            pool_size:
+                The idle connections kept open per host, shared by every
+                instance. 0 opens a connection per request. [optional]
+            pool_keepalive:
+                The seconds an idle connection is kept open. [optional]
+            timeout:
+                The seconds to wait for the server. [optional]
 
         """
         self.use_ssl = use_ssl
@@ -577,6 +621,11 @@ class API(object):
         self.cache = _FileCache()
         self.urllib = urllib2
         self.cache_timeout = API.DEFAULT_CACHE_TIMEOUT
+        if pool_size is None:
+            pool_size = API.DEFAULT_POOL_SIZE
+        self.pool_size = pool_size
+        self.pool_keepalive = pool_keepalive or API.DEFAULT_POOL_KEEPALIVE
+        self.timeout = timeout or API.DEFAULT_TIMEOUT
         self._initialize_request_headers(request_headers)
         self._initialize_user_agent()
         self._initialize_default_parameters()
@@ -1222,16 +1271,12 @@ class API(object):
         # Add key/value parameters to the query string of the url.
         url = self._build_url(url, extra_params=extra_params)
 
-        # Get a url opener that can handle basic auth.
-        opener = self._get_opener(url, username=self._username,
-            password=self._password)
-
         encoded_post_data = self._encode_post_data(post_data)
 
         # Open and return the URL immediately if we're not going to cache.
         if encoded_post_data or no_cache or not self.cache or \
                 not self.cache_timeout:
-            url_data = opener.open(url, encoded_post_data).read()
+            url_data = self._open(url, encoded_post_data)
         else:
             # Unique keys are a combination of the url and the username.
             if self._username:
@@ -1245,7 +1290,7 @@ class API(object):
             # If the cached version is outdated then fetch and store another.
             now = time.time()
             if not last_cached or now >= last_cached + self.cache_timeout:
-                url_data = opener.open(url, encoded_post_data).read()
+                url_data = self._open(url, encoded_post_data)
                 self.cache.set(key, url_data)
             else:
                 url_data = self.cache.get(key)
@@ -1253,6 +1298,49 @@ class API(object):
         # Always return the latest version.
         return url_data
 
+    def _open(self, url, post_data=None):
+        """Requests a URL, through a pooled keep-alive connection unless
+        pooling is disabled or a proxy is configured for its scheme.
+
+        Returns:
+            A string containing the body of the response.
+        """
+        scheme = urlparse(url)[0]
+        if not self.pool_size or scheme in urllib.getproxies():
+            # Get a url opener that can handle basic auth.
+            opener = self._get_opener(url, username=self._username,
+                password=self._password)
+            return opener.open(url, post_data).read()
+
+        self._add_authorization_header(self._username, self._password)
+        headers = dict(self._request_headers)
+        headers['Accept-Encoding'] = 'gzip'
+        method = 'GET'
+        if post_data is not None:
+            method = 'POST'
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for redirect in range(API.MAX_REDIRECTS + 1):
+            (scheme, netloc, path, params, query, fragment) = urlparse(url)
+            selector = urlunparse(('', '', path or '/', params, query, ''))
+            pool = _get_connection_pool(scheme, netloc, self.pool_size,
+                self.pool_keepalive, self.timeout)
+            response, data = pool.request(method, selector, post_data,
+                                          headers)
+            location = response.getheader('location')
+            if response.status not in (301, 302, 303, 307) or not location:
+                break
+            # Like urllib2, redirects are followed with a GET.
+            url = urljoin(url, location)
+            method = 'GET'
+            post_data = None
+            headers.pop('Content-Type', None)
+        if response.getheader('content-encoding') == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        if response.status >= 300:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, StringIO(data))
+        return data
+
 
 class _FileCacheError(Exception):
     """Base exception class for FileCache related errors"""
@@ -1342,3 +1430,111 @@ class _FileCache(object):
 
     def _get_prefix(self, hashed_key):
         return os.path.sep.join(hashed_key[0:_FileCache.DEPTH])
+
+
+class _ConnectionPool(object):
+    """Keep-alive connections to a host, reused across requests.
+
+    Up to `size` idle connections are kept, each for `keepalive` seconds at
+    most. Connections the server closed meanwhile are discarded before
+    being reused.
+    """
+
+    def __init__(self, scheme, netloc, size, keepalive, timeout):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.size = size
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def _is_dropped(self, connection):
+        # An idle connection is readable only if the server closed it.
+        if connection.sock is None:
+            return True
+        try:
+            return bool(select.select([connection.sock], [], [], 0)[0])
+        except (select.error, socket.error):
+            return True
+
+    def _get(self):
+        """Returns an idle connection and True, or a new one and False."""
+        now = time.time()
+        while True:
+            self._lock.acquire()
+            try:
+                if not self._idle:
+                    return self._connect(), False
+                connection, last_used = self._idle.pop()
+            finally:
+                self._lock.release()
+            if (now - last_used <= self.keepalive and
+                not self._is_dropped(connection)):
+                return connection, True
+            connection.close()
+
+    def _put(self, connection):
+        self._lock.acquire()
+        try:
+            if len(self._idle) < self.size:
+                self._idle.append((connection, time.time()))
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+    def request(self, method, selector, body, headers):
+        """Sends a request, returning the response and its body.
+
+        GET requests failing on a reused connection, which the server may
+        have closed, are sent again on a new one.
+        """
+        while True:
+            connection, reused = self._get()
+            try:
+                connection.request(method, selector, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if reused and method == 'GET':
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._put(connection)
+            return response, data
+
+    def close(self):
+        """Closes the idle connections."""
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for connection, last_used in idle:
+            connection.close()
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def _get_connection_pool(scheme, netloc, size, keepalive, timeout):
+    """Returns the pool of connections to a host, shared by every API
+    instance using the same pool settings."""
+    key = (scheme, netloc, size, keepalive, timeout)
+    _connection_pools_lock.acquire()
+    try:
+        if key not in _connection_pools:
+            _connection_pools[key] = _ConnectionPool(*key)
+        return _connection_pools[key]
+    finally:
+        _connection_pools_lock.release()
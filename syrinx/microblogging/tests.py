@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from syrinx.microblogging import (API, DirectMessage, Status, User,
+    _ConnectionPool, _get_connection_pool)
+
+import BaseHTTPServer
+import SocketServer
+import cPickle
+import gzip
+import httplib
+import pickle
+import socket
+import threading
+import urllib2
+from StringIO import StringIO
+
+import unittest2 as unittest
+
+
+class PicklingTests(unittest.TestCase):
+
+    def test_protocols(self):
+        user = User(id=1, name=u'Alvaro Mouriño', screen_name='tuxie')
+        status = Status(id=2, text=u'Hello', user=user,
+                        created_at='Sat Jan 27 04:17:38 +0000 2007')
+        message = DirectMessage(id=3, sender_id=1, text=u'Hallo')
+        for module in (pickle, cPickle):
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                copies = module.loads(module.dumps((status, user, message),
+                                                   protocol))
+                self.assertEquals(copies[0], status)
+                self.assertEquals(copies[1], user)
+                self.assertEquals(copies[2].id, message.id)
+                self.assertEquals(copies[2].text, message.text)
+
+
+class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers with the path requested, keeping connections alive.
+
+    /drop closes the connection without answering unless it is the first
+    request on it, like a server closing an idle connection would.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+        self.served = 0
+
+    def respond(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.served += 1
+        if self.path == '/drop' and self.served > 1:
+            self.close_connection = 1
+        elif self.path == '/gzip':
+            buffer = StringIO()
+            stream = gzip.GzipFile(fileobj=buffer, mode='wb')
+            stream.write('compressed')
+            stream.close()
+            self.respond(200, buffer.getvalue(),
+                         [('Content-Encoding', 'gzip')])
+        elif self.path == '/redirect':
+            self.respond(302, '', [('Location', '/moved')])
+        elif self.path == '/missing':
+            self.respond(404, 'not found')
+        else:
+            self.respond(200, self.path)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == '/redirect':
+            self.respond(303, '', [('Location', '/moved')])
+        else:
+            self.do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class HTTPServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), HTTPHandler)
+        self.server.connections = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.netloc = '127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ConnectionPoolTests(HTTPServerTestCase):
+
+    def setUp(self):
+        super(ConnectionPoolTests, self).setUp()
+        self.pool = _ConnectionPool('http', self.netloc, 2, 30, 5)
+
+    def tearDown(self):
+        self.pool.close()
+        super(ConnectionPoolTests, self).tearDown()
+
+    def get(self, path):
+        response, data = self.pool.request('GET', path, None, {})
+        return data
+
+    def test_reuse(self):
+        self.assertEquals(self.get('/a'), '/a')
+        self.assertEquals(self.get('/b'), '/b')
+        self.assertEquals(self.server.connections, 1)
+
+    def test_keepalive(self):
+        self.get('/a')
+        self.pool.keepalive = -1
+        self.get('/b')
+        self.assertEquals(self.server.connections, 2)
+
+    def test_size(self):
+        first, reused = self.pool._get()
+        second, reused = self.pool._get()
+        third, reused = self.pool._get()
+        for connection in (first, second, third):
+            self.pool._put(connection)
+        self.assertEquals(len(self.pool._idle), 2)
+        self.assertEquals(third.sock, None)
+
+    def test_retry_dropped(self):
+        self.get('/a')
+        # The reused connection is dropped, the GET is sent again on a new
+        # one.
+        self.assertEquals(self.get('/drop'), '/drop')
+        self.assertEquals(self.server.connections, 2)
+
+    def test_no_retry_post(self):
+        self.get('/a')
+        self.assertRaises((httplib.HTTPException, socket.error),
+                          self.pool.request, 'POST', '/drop', 'a=1',
+                          {'Content-Length': '3'})
+        self.assertEquals(self.server.connections, 1)
+
+
+class OpenTests(HTTPServerTestCase):
+
+    def setUp(self):
+        super(OpenTests, self).setUp()
+        self.api = API(pool_size=2)
+
+    def tearDown(self):
+        _get_connection_pool('http', self.netloc, self.api.pool_size,
+            self.api.pool_keepalive, self.api.timeout).close()
+        super(OpenTests, self).tearDown()
+
+    def url(self, path):
+        return 'http://%s%s' % (self.netloc, path)
+
+    def test_gzip(self):
+        self.assertEquals(self.api._open(self.url('/gzip')), 'compressed')
+
+    def test_redirect(self):
+        self.assertEquals(self.api._open(self.url('/redirect')), '/moved')
+        self.assertEquals(self.api._open(self.url('/redirect'), 'a=1'),
+                          '/moved')
+
+    def test_error(self):
+        try:
+            self.api._open(self.url('/missing'))
+        except urllib2.HTTPError, error:
+            self.assertEquals(error.code, 404)
+            self.assertEquals(error.read(), 'not found')
+        else:
+            self.fail('HTTPError not raised')
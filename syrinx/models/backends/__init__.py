@@ -1,60 +1,298 @@
 # -*- coding: utf-8 -*-
-from syrinx import app
+from syrinx.models.backends import unitofwork
 from syrinx.models.backends.utils import get_backend
 
 
 class BackendAdapter(type):
-    """A metaclass to select at runtime whether to decorate the class or not.
+    """A metaclass to wrap the class with its backend decorator.
+
+    The backend itself is looked up on every call, so MODEL_BACKEND may be
+    set, or changed, once the models are imported.
     """
 
     def __new__(meta, cls, bases, dct):
-        # If a backend is defined wrap the object with a backend decorator.
-        if app.config.get('MODEL_BACKEND', None):
-            path_to_decorators = 'syrinx.models.backends.decorators'
-            decorator_name = ''.join((cls, 'Decorator'))
-            # Import the decorator.
-            wrapper = getattr(__import__(path_to_decorators, fromlist=['']),
-                              decorator_name)
-            # Apply backend-specific methods and properties.
-            for attr in dir(wrapper):
-                if not attr.startswith('__'):
-                    _attr = getattr(wrapper, attr)
-                    if hasattr(_attr, '__func__'):
-                        dct[attr] = _attr.__func__
-                    else:
-                        dct[attr] = _attr
+        path_to_decorators = 'syrinx.models.backends.decorators'
+        decorator_name = ''.join((cls, 'Decorator'))
+        # Import the decorator.
+        wrapper = getattr(__import__(path_to_decorators, fromlist=['']),
+                          decorator_name)
+        # Apply backend-specific methods and properties.
+        for attr in dir(wrapper):
+            if not attr.startswith('__'):
+                _attr = getattr(wrapper, attr)
+                if hasattr(_attr, '__func__'):
+                    dct[attr] = _attr.__func__
+                else:
+                    dct[attr] = _attr
+        # Instances are looked up by pk on construction.
+        dct['__new__'] = wrapper.__new__
+        if '__slots__' in dct:
+            # Slotted classes need room for their collections.
+            dct['__slots__'] = tuple(dct['__slots__']) + tuple(
+                getattr(wrapper, attr).attr for attr in dir(wrapper)
+                if isinstance(getattr(wrapper, attr), BackendCollection))
         # Return the object.
         return type.__new__(meta, cls, bases, dct)
 
+    def __call__(cls, *args, **kwargs):
+        if kwargs.get('pk') and cls.__new__ is not object.__new__:
+            # An existing instance is returned by __new__, it must not be
+            # initialized again.
+            return cls.__new__(cls, *args, **kwargs)
+        return type.__call__(cls, *args, **kwargs)
+
+
+class BackendCollection(object):
+    """A descriptor that gives each model instance its own backend-stored
+    collection, created on first access.
+
+    Assigning an iterable to the attribute adds its items to the collection
+    in a single batch.
+    """
+
+    def __init__(self, name, collection_class):
+        self.name = name
+        self.collection_class = collection_class
+        self.attr = '_%s_collection' % name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # Stored in a slot or in the instance __dict__, whichever it has.
+        try:
+            return getattr(instance, self.attr)
+        except AttributeError:
+            collection = self.collection_class(instance, self.name)
+            setattr(instance, self.attr, collection)
+            return collection
+
+    def __set__(self, instance, value):
+        collection = self.collection_class(instance, self.name)
+        setattr(instance, self.attr, collection)
+        if value:
+            collection.add_all(value)
+
 
 class BackendDict(dict):
-    """A collection of objects.
+    """A collection of objects, by key.
+
+    Items are fetched from the backend lazily, a page at a time when
+    iterating, and kept once fetched, so each of them is read at most once.
+    The dict itself holds the items fetched so far.
     """
 
-    def __contains__(self, key, backend=None):
-        return get_backend(backend).contains(self, key)
+    page_size = 100
+
+    def __init__(self, owner, name, backend=None):
+        dict.__init__(self)
+        self.owner = owner
+        self.name = name
+        self.backend = backend
+        self._count = None
+        self._complete = False
+
+    def _get_backend(self):
+        # Reads and writes see the changes of the current unit of work.
+        unitofwork.flush_pending()
+        return get_backend(self.owner, self.backend)
+
+    def _load(self):
+        """Fetches every item not fetched yet, a page at a time."""
+        if self._complete:
+            return
+        backend = self._get_backend()
+        offset = 0
+        while True:
+            page = backend.get_page(self, offset, self.page_size)
+            for key, value in page:
+                dict.__setitem__(self, key, value)
+            offset += len(page)
+            if len(page) < self.page_size:
+                break
+        self._count = dict.__len__(self)
+        self._complete = True
+
+    def reset(self):
+        """Forgets the items fetched so far."""
+        dict.clear(self)
+        self._count = None
+        self._complete = False
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        if self._complete:
+            return False
+        return self._get_backend().contains(self, key)
+
+    def __delitem__(self, key):
+        self._get_backend().delitem(self, key)
+        if dict.__contains__(self, key):
+            dict.__delitem__(self, key)
+            if self._count is not None:
+                self._count -= 1
+        else:
+            self._count = None
+
+    def __getitem__(self, key):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        if self._complete:
+            raise KeyError(key)
+        value = self._get_backend().getitem(self, key)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self._get_backend().len(self)
+        return self._count
 
-    def __delitem__(self, key, backend=None):
-        return get_backend(backend).delitem(self, key)
+    def __setitem__(self, key, value):
+        self._get_backend().setitem(self, key, value)
+        if not dict.__contains__(self, key):
+            if self._complete:
+                self._count += 1
+            else:
+                # It may or may not be a new key.
+                self._count = None
+        dict.__setitem__(self, key, value)
 
-    def __getitem__(self, key, backend=None):
-        return get_backend(backend).getitem(self, key)
+    def update(self, *args, **kwargs):
+        """Adds many items with a single call to the backend."""
+        items = dict(*args, **kwargs)
+        self.add_all(items)
 
-    def __len__(self, backend=None):
-        return get_backend(backend).len(self)
+    def add_all(self, items):
+        items = dict(items)
+        if not items:
+            return
+        self._get_backend().update(self, items)
+        dict.update(self, items)
+        self._count = None
+        self._complete = False
 
-    def __setitem__(self, key, value, backend=None):
-        return get_backend(backend).setitem(self, key, value)
+    def __iter__(self):
+        self._load()
+        return dict.__iter__(self)
+
+    def iterkeys(self):
+        return iter(self)
+
+    def keys(self):
+        self._load()
+        return dict.keys(self)
+
+    def values(self):
+        self._load()
+        return dict.values(self)
+
+    def items(self):
+        self._load()
+        return dict.items(self)
+
+    def itervalues(self):
+        self._load()
+        return dict.itervalues(self)
+
+    def iteritems(self):
+        self._load()
+        return dict.iteritems(self)
 
 
 class BackendList(list):
     """A list of objects.
+
+    Items are fetched from the backend lazily, a page at a time, and pages
+    are kept once fetched.
     """
 
-    items = []
+    page_size = 100
+
+    def __init__(self, owner, name, backend=None):
+        list.__init__(self)
+        self.owner = owner
+        self.name = name
+        self.backend = backend
+        self._count = None
+        self._pages = {}
+
+    def _get_backend(self):
+        # Reads and writes see the changes of the current unit of work.
+        unitofwork.flush_pending()
+        return get_backend(self.owner, self.backend)
+
+    def _get_page(self, number):
+        try:
+            return self._pages[number]
+        except KeyError:
+            page = self._get_backend().get_page(self,
+                number * self.page_size, self.page_size)
+            self._pages[number] = page
+            return page
+
+    def reset(self):
+        """Forgets the items fetched so far."""
+        self._count = None
+        self._pages.clear()
+
+    def append(self, item):
+        self._get_backend().append(self, item)
+        self.reset()
+
+    def extend(self, items):
+        """Adds many items with a single call to the backend."""
+        self.add_all(items)
+
+    def add_all(self, items):
+        items = list(items)
+        if not items:
+            return
+        self._get_backend().extend(self, items)
+        self.reset()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0:
+            raise IndexError('list index out of range')
+        page = self._get_page(index // self.page_size)
+        try:
+            return page[index % self.page_size]
+        except IndexError:
+            raise IndexError('list index out of range')
+
+    def __getslice__(self, i, j):
+        return self[max(0, i):max(0, j):]
+
+    def __iter__(self):
+        number = 0
+        while True:
+            page = self._get_page(number)
+            for item in page:
+                yield item
+            if len(page) < self.page_size:
+                break
+            number += 1
+
+    def __contains__(self, item):
+        for member in self:
+            if member == item:
+                return True
+        return False
 
-    def append(self, item, backend=None):
-        return get_backend(backend).append(self, item)
+    def __len__(self):
+        if self._count is None:
+            self._count = self._get_backend().len(self)
+        return self._count
 
-    def __len__(self, backend=None):
-        return get_backend(backend).len(self)
+    def __nonzero__(self):
+        return len(self) > 0
@@ -1,10 +1,39 @@
 # -*- coding: utf-8 -*-
 
 
+from syrinx.models.backends.unitofwork import UnitOfWork
+
+
 class BaseModelBackend(object):
     """Base model backend.
     """
 
+    def session(self):
+        """Returns a unit of work, to be used as a context manager. Saves and
+        deletes within it are written together, by flush(), at its end.
+        """
+        return UnitOfWork()
+
+    def flush(self, saved, deleted):
+        """Writes the changes collected by a unit of work. They may include
+        instances of any of the models served by the backend's module.
+
+        Backends able to write in batches should override this, save_many()
+        or delete_many().
+        """
+        if saved:
+            self.save_many(saved)
+        if deleted:
+            self.delete_many(deleted)
+
+    def save_many(self, instances):
+        for instance in instances:
+            self.save(instance)
+
+    def delete_many(self, instances):
+        for instance in instances:
+            self.delete(instance)
+
     def get(self, cls, pk):
         raise NotImplementedError
 
@@ -41,6 +70,25 @@ class BaseModelBackend(object):
     def len(self, instance):
         raise NotImplementedError
 
+    def get_page(self, instance, offset, limit):
+        """Returns up to limit items of a collection, starting at offset.
+        Items of a BackendDict are returned as (key, value) pairs.
+        """
+        raise NotImplementedError
+
+    def update(self, instance, items):
+        """Adds the items of a dict to a BackendDict."""
+        for key, value in items.items():
+            self.setitem(instance, key, value)
+
+    def append(self, instance, item):
+        raise NotImplementedError
+
+    def extend(self, instance, items):
+        """Adds many items to a BackendList."""
+        for item in items:
+            self.append(instance, item)
+
     def post_notice(self, instance, notice):
         raise NotImplementedError
 
@@ -45,6 +45,16 @@ class ModelBackend(BaseModelBackend):
         print instance
         return 0
 
+    def get_page(self, instance, offset, limit):
+        print instance, offset, limit
+        return []
+
+    def update(self, instance, items):
+        print instance
+
+    def extend(self, instance, items):
+        print instance
+
     def post_notice(self, instance, notice):
         print instance
 
@@ -10,6 +10,8 @@ functionality.
 Read more about this pattern: http://sourcemaking.com/design_patterns/decorator
 """
 
+from syrinx.models.backends import (BackendCollection, BackendDict,
+    BackendList, identity, unitofwork)
 from syrinx.models.backends.utils import get_backend
 
 
@@ -20,15 +22,37 @@ class DecoratorBase(object):
     def __new__(cls, *args, **kwargs):
         pk = kwargs.get('pk')
         if pk:
-            return get_backend().get(pk)
+            # Instances already loaded in this scope are reused.
+            self = identity.get(cls, pk)
+            if self is None:
+                self = get_backend(cls, kwargs.get('backend')).get(cls, pk)
+                if self is not None:
+                    identity.add(cls, pk, self)
+            return self
         self = object.__new__(cls)
         return self
 
     def save(self, backend=None):
-        return get_backend(self, backend).save(self)
+        backend = get_backend(self, backend)
+        unit = unitofwork.current()
+        if unit is not None:
+            # Written when the unit of work ends.
+            return unit.register_save(backend, self)
+        result = backend.save(self)
+        pk = getattr(self, 'pk', None)
+        if pk:
+            identity.add(self.__class__, pk, self)
+        return result
 
     def delete(self, backend=None):
-        return get_backend(self, backend).delete(self)
+        pk = getattr(self, 'pk', None)
+        if pk:
+            identity.remove(self.__class__, pk)
+        backend = get_backend(self, backend)
+        unit = unitofwork.current()
+        if unit is not None:
+            return unit.register_delete(backend, self)
+        return backend.delete(self)
 
 
 class RemoteUserDecorator(DecoratorBase):
@@ -40,23 +64,51 @@ class LocalUserDecorator(DecoratorBase):
     """A local user backend mixin.
     """
 
-    def add_list(self, instance, ulist, backend=None):
-        return get_backend(self, backend).add_list(instance, ulist)
-
-    def add_to_list(self, instance, who, ulist, backend=None):
-        return get_backend(self, backend).add_to_list(instance, who, ulist)
-
-    def follow(self, instance, who, backend=None):
-        return get_backend(self, backend).follow(instance, who)
-
-    def get_followers(self, instance, backend=None):
-        return get_backend(self, backend).get_followers(instance)
-
-    def post_notice(self, instance, notice, backend=None):
-        return get_backend(self, backend).post_notice(instance, notice)
-
-    def send_private_notice(self, instance, notice, backend=None):
-        return get_backend(self, backend).send_private_notice(instance, notice)
+    followers = BackendCollection('followers', BackendDict)
+    following = BackendCollection('following', BackendDict)
+    lists = BackendCollection('lists', BackendList)
+    notices = BackendCollection('notices', BackendList)
+    private_notices = BackendCollection('private_notices', BackendList)
+
+    # Operations are not deferred by units of work, the changes collected
+    # before them are written first. The collections changed are reset, to
+    # be fetched again on next use.
+
+    def add_list(self, ulist, backend=None):
+        unitofwork.flush_pending()
+        result = get_backend(self, backend).add_list(self, ulist)
+        self.lists.reset()
+        return result
+
+    def add_to_list(self, ulist, user, backend=None):
+        unitofwork.flush_pending()
+        result = get_backend(self, backend).add_to_list(self, ulist, user)
+        ulist.members.reset()
+        return result
+
+    def follow(self, user, ulist=None, backend=None):
+        unitofwork.flush_pending()
+        result = get_backend(self, backend).follow(self, user, ulist)
+        self.following.reset()
+        if ulist is not None:
+            ulist.members.reset()
+        return result
+
+    def get_followers(self, pk=None, backend=None):
+        unitofwork.flush_pending()
+        return get_backend(self, backend).get_followers(self, pk)
+
+    def post_notice(self, notice, backend=None):
+        unitofwork.flush_pending()
+        result = get_backend(self, backend).post_notice(self, notice)
+        self.notices.reset()
+        return result
+
+    def send_private_notice(self, notice, backend=None):
+        unitofwork.flush_pending()
+        result = get_backend(self, backend).send_private_notice(self, notice)
+        self.private_notices.reset()
+        return result
 
 
 class UserConfigDecorator(DecoratorBase):
@@ -76,7 +128,7 @@ class TwitterUserDecorator(DecoratorBase):
 
 class UserListDecorator(DecoratorBase):
 
-    pass
+    members = BackendCollection('members', BackendDict)
 
 
 class NoticeDecorator(DecoratorBase):
@@ -42,6 +42,15 @@ class ModelBackend(BaseModelBackend):
     def len(self, instance):
         return 0
 
+    def get_page(self, instance, offset, limit):
+        return []
+
+    def update(self, instance, items):
+        pass
+
+    def extend(self, instance, items):
+        pass
+
     def post_notice(self, instance, notice):
         pass
 
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+An identity map for the domain models: within a scope each (class, pk) is
+loaded from the backend at most once, and always maps to the same object.
+
+Each request is a scope. Elsewhere (workers, commands, scripts) one is
+opened with scope(), a unit of work opens one too:
+
+    with identity.scope():
+        user = LocalUser(pk=pk)
+
+Outside of a scope nothing is kept, so instances are always read from the
+backend.
+
+Read more about this pattern: http://martinfowler.com/eaaCatalog/identityMap.html
+"""
+
+from syrinx import app
+
+import threading
+
+_local = threading.local()
+
+
+def _get_map():
+    """Returns the map of the current scope, None outside of one."""
+    return getattr(_local, 'instances', None)
+
+
+def get(cls, pk):
+    """Returns the instance of cls with the given pk, or None if it has not
+    been loaded yet.
+    """
+    instances = _get_map()
+    if instances is None:
+        return None
+    return instances.get((cls, pk))
+
+
+def add(cls, pk, instance):
+    instances = _get_map()
+    if instances is not None:
+        instances[(cls, pk)] = instance
+
+
+def remove(cls, pk):
+    instances = _get_map()
+    if instances is not None:
+        instances.pop((cls, pk), None)
+
+
+def clear():
+    """Forgets every instance loaded in the current scope."""
+    instances = _get_map()
+    if instances is not None:
+        instances.clear()
+
+
+class scope(object):
+    """Keeps the instances loaded by the current thread while the block
+    runs. Nested scopes share the outermost one.
+    """
+
+    def __enter__(self):
+        self.outermost = _get_map() is None
+        if self.outermost:
+            _local.instances = {}
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.outermost:
+            _local.instances = None
+        return False
+
+
+@app.before_request
+def _begin_request():
+    # A new map even if the previous request failed before ending its own.
+    _local.instances = {}
+
+
+@app.after_request
+def _end_request(response):
+    _local.instances = None
+    return response
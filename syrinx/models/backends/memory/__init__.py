@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+An in-memory model backend, for tests and single-node deployments.
+
+Instances are kept as they are, by primary key. The collections are indexed
+by owner: membership is checked in O(1) and items are kept sorted, so a page
+is a slice. Keeping them sorted costs O(n) per insertion, as insort shifts
+the items after the new one.
+"""
+
+from syrinx.models.backends.base import BaseModelBackend
+
+from bisect import bisect_left, insort
+import itertools
+import threading
+
+
+class SortedIndex(object):
+    """The keys of each owner, sorted, along with a set of them.
+    """
+
+    def __init__(self):
+        self._sorted = {}
+        self._sets = {}
+
+    def add(self, owner, key):
+        keys = self._sets.setdefault(owner, set())
+        if key in keys:
+            return False
+        keys.add(key)
+        insort(self._sorted.setdefault(owner, []), key)
+        return True
+
+    def remove(self, owner, key):
+        keys = self._sets.get(owner)
+        if not keys or key not in keys:
+            return False
+        keys.remove(key)
+        ordered = self._sorted[owner]
+        del ordered[bisect_left(ordered, key)]
+        return True
+
+    def contains(self, owner, key):
+        return key in self._sets.get(owner, ())
+
+    def count(self, owner):
+        return len(self._sets.get(owner, ()))
+
+    def page(self, owner, offset, limit):
+        return self._sorted.get(owner, [])[offset:offset + limit]
+
+    def keys(self, owner):
+        return list(self._sorted.get(owner, []))
+
+    def drop(self, owner):
+        """Forgets the keys of owner, returning them."""
+        self._sets.pop(owner, None)
+        return self._sorted.pop(owner, [])
+
+
+class Store(object):
+    """What the memory backends share.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self._ids = itertools.count(1)
+        # Instances, by pk, and the pks of users, by key.
+        self.objects = {}
+        self.users = {}
+        # The key each user was stored with, by pk.
+        self.keys = {}
+        # Collections of users, by the pk of their owner.
+        self.followers = SortedIndex()
+        self.following = SortedIndex()
+        self.members = SortedIndex()
+        # The lists of each user, the other way round.
+        self.listed = SortedIndex()
+        # Collections of owned objects: sorted by pk, but notices, which are
+        # sorted by (date_publish, pk).
+        self.lists = SortedIndex()
+        self.notices = SortedIndex()
+        self.private_notices = SortedIndex()
+        # The collection, owner and index key of each owned object, by pk.
+        self.owners = {}
+
+    def next_id(self):
+        return self._ids.next()
+
+
+default_store = Store()
+
+
+def clear():
+    """Forgets everything stored."""
+    default_store.lock.acquire()
+    try:
+        default_store.clear()
+    finally:
+        default_store.lock.release()
+
+
+def locked(method):
+    def wrapper(self, *args, **kwargs):
+        self.store.lock.acquire()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.store.lock.release()
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+# Attributes holding other models, saved along with the instance.
+REFERENCES = ('user_config', 'admin_user', 'twitter_user', 'repeats',
+              'recipient')
+
+# Collections of users.
+MEMBERSHIPS = ('followers', 'following', 'members')
+
+# Collections of owned objects.
+OWNED = ('lists', 'notices', 'private_notices')
+
+
+class ModelBackend(BaseModelBackend):
+    """In-memory model backend.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or default_store
+
+    def _sort_key(self, name, instance):
+        if name == 'notices':
+            return (instance.date_publish, instance.pk)
+        return instance.pk
+
+    def _save(self, instance):
+        for attribute in REFERENCES:
+            value = getattr(instance, attribute, None)
+            if value is not None and not getattr(value, 'pk', None):
+                self._save(value)
+        if not getattr(instance, 'pk', None):
+            instance.pk = self.store.next_id()
+        self.store.objects[instance.pk] = instance
+        if hasattr(instance, 'get_key'):
+            key = instance.get_key()
+            old_key = self.store.keys.get(instance.pk)
+            if old_key != key:
+                self.store.users.pop(old_key, None)
+                self.store.users[key] = instance.pk
+                self.store.keys[instance.pk] = key
+
+    def _save_new(self, instance):
+        if not getattr(instance, 'pk', None):
+            self._save(instance)
+
+    @locked
+    def get(self, cls, pk):
+        instance = self.store.objects.get(pk)
+        if isinstance(instance, cls):
+            return instance
+        return None
+
+    @locked
+    def save(self, instance):
+        self._save(instance)
+
+    @locked
+    def save_many(self, instances):
+        for instance in instances:
+            self._save(instance)
+
+    @locked
+    def delete(self, instance):
+        self._delete(instance)
+
+    @locked
+    def delete_many(self, instances):
+        for instance in instances:
+            self._delete(instance)
+
+    def _delete(self, instance):
+        pk = getattr(instance, 'pk', None)
+        if not pk or self.store.objects.pop(pk, None) is None:
+            return
+        store = self.store
+        key = store.keys.pop(pk, None)
+        if key is not None:
+            store.users.pop(key, None)
+            for follower in store.followers.drop(pk):
+                store.following.remove(follower, pk)
+            for followed in store.following.drop(pk):
+                store.followers.remove(followed, pk)
+            for ulist in store.listed.drop(pk):
+                store.members.remove(ulist, pk)
+            # What the user owns goes with them.
+            for name in OWNED:
+                index = getattr(store, name)
+                for sort_key in index.keys(pk):
+                    if name == 'notices':
+                        sort_key = sort_key[1]
+                    self._delete(store.objects[sort_key])
+                index.drop(pk)
+        for member in store.members.drop(pk):
+            store.listed.remove(member, pk)
+        if pk in store.owners:
+            name, owner, sort_key = store.owners.pop(pk)
+            getattr(store, name).remove(owner, sort_key)
+        instance.pk = None
+
+    # Collections of users.
+
+    def _add_members(self, name, owner, users):
+        self._save_new(owner)
+        for user in users:
+            self._save_new(user)
+            self._add_member(name, owner.pk, user.pk)
+
+    def _add_member(self, name, owner, member):
+        if name == 'members':
+            self.store.members.add(owner, member)
+            self.store.listed.add(member, owner)
+        elif name == 'following':
+            self.store.following.add(owner, member)
+            self.store.followers.add(member, owner)
+        else:
+            self.store.followers.add(owner, member)
+            self.store.following.add(member, owner)
+
+    def _remove_member(self, name, owner, member):
+        if name == 'members':
+            self.store.listed.remove(member, owner)
+            return self.store.members.remove(owner, member)
+        elif name == 'following':
+            self.store.followers.remove(member, owner)
+            return self.store.following.remove(owner, member)
+        self.store.following.remove(member, owner)
+        return self.store.followers.remove(owner, member)
+
+    def _user(self, pk):
+        return self.store.objects[pk]
+
+    @locked
+    def contains(self, instance, key):
+        pk = getattr(instance.owner, 'pk', None)
+        return pk is not None and getattr(self.store, instance.name).contains(
+            pk, self.store.users.get(key))
+
+    @locked
+    def getitem(self, instance, key):
+        if not self.contains(instance, key):
+            raise KeyError(key)
+        return self._user(self.store.users[key])
+
+    @locked
+    def setitem(self, instance, key, value):
+        self._add_members(instance.name, instance.owner, [value])
+
+    @locked
+    def update(self, instance, items):
+        self._add_members(instance.name, instance.owner, items.values())
+
+    @locked
+    def delitem(self, instance, key):
+        pk = getattr(instance.owner, 'pk', None)
+        member = self.store.users.get(key)
+        if (pk is None or member is None or
+            not self._remove_member(instance.name, pk, member)):
+            raise KeyError(key)
+
+    # Collections of owned objects.
+
+    def _add_owned(self, name, owner, items):
+        self._save_new(owner)
+        index = getattr(self.store, name)
+        for item in items:
+            self._save(item)
+            if item.pk in self.store.owners:
+                # Moved from another owner.
+                old_name, old_owner, sort_key = self.store.owners[item.pk]
+                getattr(self.store, old_name).remove(old_owner, sort_key)
+            sort_key = self._sort_key(name, item)
+            index.add(owner.pk, sort_key)
+            self.store.owners[item.pk] = (name, owner.pk, sort_key)
+
+    @locked
+    def append(self, instance, item):
+        self._add_owned(instance.name, instance.owner, [item])
+
+    @locked
+    def extend(self, instance, items):
+        self._add_owned(instance.name, instance.owner, items)
+
+    # Any collection.
+
+    @locked
+    def len(self, instance):
+        pk = getattr(instance.owner, 'pk', None)
+        if pk is None:
+            return 0
+        return getattr(self.store, instance.name).count(pk)
+
+    @locked
+    def get_page(self, instance, offset, limit):
+        pk = getattr(instance.owner, 'pk', None)
+        if pk is None:
+            return []
+        page = getattr(self.store, instance.name).page(pk, offset, limit)
+        if instance.name in MEMBERSHIPS:
+            return [(self.store.keys[member], self._user(member))
+                    for member in page]
+        if instance.name == 'notices':
+            page = [notice for date_publish, notice in page]
+        return [self.store.objects[item] for item in page]
+
+    # Domain operations.
+
+    @locked
+    def get_followers(self, instance, pk=None):
+        followers = self.store.followers.keys(getattr(instance, 'pk', None))
+        if pk is not None:
+            followers = pk in followers and [pk] or []
+        return [self._user(follower) for follower in followers]
+
+    @locked
+    def follow(self, instance, user, ulist=None):
+        self._add_members('following', instance, [user])
+        if ulist is not None:
+            self._add_members('members', ulist, [user])
+
+    @locked
+    def add_list(self, instance, ulist):
+        self._add_owned('lists', instance, [ulist])
+
+    @locked
+    def add_to_list(self, instance, ulist, user):
+        self._add_members('members', ulist, [user])
+
+    @locked
+    def add_member(self, instance, item):
+        self._add_members('members', instance, [item])
+
+    @locked
+    def post_notice(self, instance, notice):
+        self._add_owned('notices', instance, [notice])
+
+    @locked
+    def send_private_notice(self, instance, notice):
+        self._add_owned('private_notices', instance, [notice])
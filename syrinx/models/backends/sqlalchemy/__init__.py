@@ -1,19 +1,559 @@
 # -*- coding: utf-8 -*-
+from syrinx.models.backends import identity
 from syrinx.models.backends.base import BaseModelBackend
+from syrinx.models.backends.sqlalchemy.models import db
+from syrinx.models.backends.sqlalchemy.tables import (accounts, admin_users,
+    list_members, notices, private_notices, sequences, subscriptions,
+    twitter_users, user_configs, user_lists)
+
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+
+
+class Mapping(object):
+    """How the instances of a model are stored.
+
+    columns are stored in the attributes of the same name, unless attributes
+    says otherwise. references are (column, attribute, model name) triples
+    for the attributes holding other models, which are stored by primary key;
+    a model name of None stands for a local or remote user. Users are stored
+    together, kind tells them apart.
+    """
+
+    def __init__(self, table, columns, references=(), attributes=None,
+                 kind=None):
+        self.table = table
+        self.columns = columns
+        self.references = references
+        self.attributes = attributes or {}
+        self.kind = kind
+
+    def attribute(self, column):
+        return self.attributes.get(column, column)
+
+
+USER_COLUMNS = ('username', 'server', 'location', 'profile_uri', 'created')
+
+MAPPINGS = {
+    'RemoteUser': Mapping(accounts, USER_COLUMNS + ('name', ), kind='remote'),
+    'LocalUser': Mapping(accounts, USER_COLUMNS + ('password', 'first_name',
+        'last_name', 'bio', 'status', 'email', 'web', 'date_joined'),
+        references=(('user_config_id', 'user_config', 'UserConfig'),
+                    ('admin_user_id', 'admin_user', 'AdminUser'),
+                    ('twitter_user_id', 'twitter_user', 'TwitterUser')),
+        # The password is stored already hashed.
+        attributes={'password': '_password'}, kind='local'),
+    'UserConfig': Mapping(user_configs, ('protected', 'email_notification')),
+    'AdminUser': Mapping(admin_users, ('is_root', )),
+    'TwitterUser': Mapping(twitter_users, ('username', 'password')),
+    'UserList': Mapping(user_lists, ('name', 'muted', 'created')),
+    'Notice': Mapping(notices, ('content', 'date_publish'),
+        references=(('repeats_id', 'repeats', 'Notice'), )),
+    'PrivateNotice': Mapping(private_notices, ('content', 'read'),
+        references=(('recipient_id', 'recipient', None), )),
+}
+
+# The model of each kind of user.
+KINDS = {
+    'local': 'LocalUser',
+    'remote': 'RemoteUser',
+}
+
+# Collections of users, stored as rows linking the owner of the collection
+# to its members: (table, owner column, member column).
+MEMBERSHIPS = {
+    'followers': (subscriptions, 'followed_id', 'follower_id'),
+    'following': (subscriptions, 'follower_id', 'followed_id'),
+    'members': (list_members, 'list_id', 'member_id'),
+}
+
+# Collections of objects owned by a user: (model name, owner column).
+OWNED = {
+    'lists': ('UserList', 'owner_id'),
+    'notices': ('Notice', 'author_id'),
+    'private_notices': ('PrivateNotice', 'sender_id'),
+}
+
+# Rows that must go away with the row they refer to: (table, column). What
+# a user owns goes with them, like private notices sent to them.
+DEPENDENTS = {
+    'accounts': ((subscriptions, 'follower_id'),
+                 (subscriptions, 'followed_id'),
+                 (list_members, 'member_id'),
+                 (user_lists, 'owner_id'),
+                 (notices, 'author_id'),
+                 (private_notices, 'sender_id'),
+                 (private_notices, 'recipient_id')),
+    'user_lists': ((list_members, 'list_id'), ),
+}
+
+# Rows a row refers to which go away with it: (column, table).
+OWNED_ROWS = {
+    'accounts': (('user_config_id', user_configs),
+                 ('admin_user_id', admin_users),
+                 ('twitter_user_id', twitter_users)),
+}
+
+# References emptied when the row they refer to goes away: (table, column).
+NULLIFIED = {
+    'notices': ((notices, 'repeats_id'), ),
+}
 
 
 class ModelBackend(BaseModelBackend):
     """SQLAlchemy's model backend.
+
+    Writes are batched: the rows of each model are inserted or updated with a
+    single executemany(), primary keys are reserved in blocks so new rows
+    need not be read back, and the statements run over and over are compiled
+    once per backend. Every call writing to the database is a transaction.
     """
 
+    def __init__(self):
+        self._engine = None
+        self._statements = {}
+
+    # Statements.
+
+    def _compile(self, key, build, column_keys=None):
+        """Returns the statement made by build, compiled the first time."""
+        engine = db.engine
+        if engine is not self._engine:
+            self._statements.clear()
+            self._engine = engine
+        try:
+            return self._statements[key]
+        except KeyError:
+            statement = build().compile(bind=engine, column_keys=column_keys)
+            self._statements[key] = statement
+            return statement
+
+    def _execute(self, statement, params=None):
+        """Executes a statement, many times if params is a list."""
+        return db.session.connection().execute(statement, params or {})
+
+    def _commit(self, write, *args):
+        """Calls write, committing its changes unless it raises."""
+        try:
+            result = write(*args)
+        except Exception:
+            db.session.rollback()
+            raise
+        db.session.commit()
+        return result
+
+    def _allocate(self, table, count):
+        """Reserves count primary keys for the rows of table."""
+        params = {'name': table.name, 'count': count}
+        statement = self._compile(('allocate', ), lambda: sequences.update(
+            sequences.c.name == db.bindparam('name'),
+            values={sequences.c.next_id:
+                    sequences.c.next_id + db.bindparam('count')}))
+        if self._execute(statement, params).rowcount:
+            statement = self._compile(('next_id', ), lambda: db.select(
+                [sequences.c.next_id],
+                sequences.c.name == db.bindparam('name')))
+            next_id = self._execute(statement, params).scalar()
+        else:
+            # Sequences are created with the tables, by db.create_all(); a
+            # table which still has none starts after any row already there.
+            last_id = self._execute(
+                db.select([db.func.max(table.c.id)])).scalar() or 0
+            next_id = last_id + 1 + count
+            try:
+                self._execute(sequences.insert(),
+                              {'name': table.name, 'next_id': next_id})
+            except IntegrityError:
+                # Another process created it first: reserve from there.
+                return self._allocate(table, count)
+        return range(next_id - count, next_id)
+
+    # Models.
+
+    def _model(self, name):
+        from syrinx import models
+        return getattr(models, name)
+
+    def _mapping(self, model):
+        if not isinstance(model, type):
+            model = model.__class__
+        try:
+            return MAPPINGS[model.__name__]
+        except KeyError:
+            raise TypeError('%s instances are not stored by this backend' %
+                            model.__name__)
+
+    def _by_model(self, instances):
+        """Groups instances by model, keeping their order."""
+        groups = []
+        by_model = {}
+        for instance in instances:
+            model = instance.__class__
+            if model not in by_model:
+                by_model[model] = []
+                groups.append((model, by_model[model]))
+            by_model[model].append(instance)
+        return groups
+
+    def _row(self, mapping, instance):
+        """Returns the values stored for an instance."""
+        row = {'id': instance.pk}
+        for column in mapping.columns:
+            row[column] = getattr(instance, mapping.attribute(column), None)
+        for column, attribute, model in mapping.references:
+            value = getattr(instance, attribute, None)
+            row[column] = value is not None and value.pk or None
+        if mapping.kind:
+            row['kind'] = mapping.kind
+            row['key'] = instance.get_key()
+        return row
+
+    def _load(self, model, row):
+        """Returns the instance stored in a row, reusing the loaded one."""
+        instance = identity.get(model, row['id'])
+        if instance is not None:
+            return instance
+        mapping = self._mapping(model)
+        # Stored instances are not initialized again.
+        instance = object.__new__(model)
+        instance.pk = row['id']
+        for column in mapping.columns:
+            setattr(instance, mapping.attribute(column), row[column])
+        identity.add(model, instance.pk, instance)
+        for column, attribute, name in mapping.references:
+            value = None
+            if row[column] is not None:
+                if name is None:
+                    value = self._get_user(row[column])
+                else:
+                    model = self._model(name)
+                    value = (identity.get(model, row[column]) or
+                             self.get(model, row[column]))
+            setattr(instance, attribute, value)
+        return instance
+
+    def _load_user(self, row):
+        return self._load(self._model(KINDS[row['kind']]), row)
+
+    def _get_user(self, pk):
+        statement = self._compile(('get', 'accounts'), lambda: (
+            accounts.select(accounts.c.id == db.bindparam('_id'))))
+        row = self._execute(statement, {'_id': pk}).fetchone()
+        return row is not None and self._load_user(row) or None
+
     def get(self, cls, pk):
-        raise NotImplementedError
+        mapping = self._mapping(cls)
+        table = mapping.table
+        statement = self._compile(('get', table.name), lambda: (
+            table.select(table.c.id == db.bindparam('_id'))))
+        row = self._execute(statement, {'_id': pk}).fetchone()
+        if row is None or (mapping.kind and row['kind'] != mapping.kind):
+            return None
+        return self._load(cls, row)
+
+    # Writes.
+
+    def flush(self, saved, deleted):
+        self._commit(self._flush, saved, deleted)
+
+    def _flush(self, saved, deleted):
+        self._save(saved)
+        self._delete(deleted)
 
     def save(self, instance):
-        raise NotImplementedError
+        self._commit(self._save, [instance])
+
+    def save_many(self, instances):
+        self._commit(self._save, instances)
+
+    def _save(self, instances):
+        """Inserts the new instances and updates the others, with a
+        statement per model.
+        """
+        for model, group in self._by_model(instances):
+            mapping = self._mapping(model)
+            self._save_references(mapping, group)
+            new = [i for i in group if not getattr(i, 'pk', None)]
+            stored = [i for i in group if getattr(i, 'pk', None)]
+            if new:
+                self._insert(mapping, new)
+            if stored:
+                self._update(mapping, stored)
+
+    def _save_new(self, instances):
+        self._save([i for i in instances if not getattr(i, 'pk', None)])
+
+    def _save_references(self, mapping, instances):
+        """Saves the new instances referenced by instances, whose keys are
+        needed to store them.
+        """
+        referenced = []
+        for instance in instances:
+            for column, attribute, model in mapping.references:
+                value = getattr(instance, attribute, None)
+                if value is not None:
+                    referenced.append(value)
+        self._save_new(referenced)
+
+    def _insert(self, mapping, instances, values=None):
+        """Inserts the rows of instances, adding values to each of them."""
+        table = mapping.table
+        rows = []
+        for pk, instance in zip(self._allocate(table, len(instances)),
+                                instances):
+            instance.pk = pk
+            # Every column is given a value, so a single statement serves
+            # for every row.
+            row = dict.fromkeys(table.c.keys())
+            row.update(self._row(mapping, instance))
+            row.update(values or {})
+            rows.append(row)
+        statement = self._compile(('insert', table.name), table.insert)
+        self._execute(statement, rows)
+        for instance in instances:
+            identity.add(instance.__class__, instance.pk, instance)
+
+    def _update(self, mapping, instances, values=None):
+        """Updates the rows of instances, or only the given values."""
+        table = mapping.table
+        rows = []
+        for instance in instances:
+            if values is None:
+                row = self._row(mapping, instance)
+                del row['id']
+            else:
+                row = dict(values)
+            row['_id'] = instance.pk
+            rows.append(row)
+        column_keys = sorted(key for key in rows[0] if key != '_id')
+        statement = self._compile(
+            ('update', table.name, tuple(column_keys)),
+            lambda: table.update(table.c.id == db.bindparam('_id')),
+            column_keys=column_keys)
+        self._execute(statement, rows)
 
     def delete(self, instance):
-        raise NotImplementedError
+        self._commit(self._delete, [instance])
+
+    def delete_many(self, instances):
+        self._commit(self._delete, instances)
+
+    def _delete(self, instances):
+        for model, group in self._by_model(instances):
+            group = [i for i in group if getattr(i, 'pk', None)]
+            if not group:
+                continue
+            table = self._mapping(model).table
+            self._delete_rows(table, [instance.pk for instance in group])
+            for instance in group:
+                identity.remove(model, instance.pk)
+                instance.pk = None
+
+    def _delete_rows(self, table, pks):
+        """Deletes rows by primary key, with the rows depending on them."""
+        params = [{'_id': pk} for pk in pks]
+        for dependent, column in DEPENDENTS.get(table.name, ()):
+            if 'id' in dependent.c:
+                # Rows with dependents of their own.
+                ids = [row[0] for row in self._execute(db.select(
+                    [dependent.c.id], dependent.c[column].in_(pks)))]
+                if ids:
+                    self._delete_rows(dependent, ids)
+                continue
+            statement = self._compile(
+                ('delete', dependent.name, column), lambda: (
+                    dependent.delete(
+                        dependent.c[column] == db.bindparam('_id'))))
+            self._execute(statement, params)
+        for dependent, column in NULLIFIED.get(table.name, ()):
+            statement = self._compile(
+                ('nullify', dependent.name, column), lambda: (
+                    dependent.update(
+                        dependent.c[column] == db.bindparam('_id'),
+                        values={dependent.c[column]: None})))
+            self._execute(statement, params)
+        owned = OWNED_ROWS.get(table.name, ())
+        if owned:
+            rows = self._execute(db.select(
+                [table.c[column] for column, referred in owned],
+                table.c.id.in_(pks))).fetchall()
+        statement = self._compile(('delete', table.name), lambda: (
+            table.delete(table.c.id == db.bindparam('_id'))))
+        self._execute(statement, params)
+        for index, (column, referred) in enumerate(owned):
+            ids = [row[index] for row in rows if row[index] is not None]
+            if ids:
+                self._delete_rows(referred, ids)
+
+    # Collections of users.
+
+    def _members(self, name):
+        """Returns the select of the members of a collection of users."""
+        table, owner_column, member_column = MEMBERSHIPS[name]
+        return db.select([accounts], db.and_(
+            accounts.c.id == table.c[member_column],
+            table.c[owner_column] == db.bindparam('owner')))
+
+    def _add_members(self, name, owner, users):
+        """Adds users to a collection, with a single statement."""
+        table, owner_column, member_column = MEMBERSHIPS[name]
+        users = list(users)
+        if not users:
+            return
+        self._save_new([owner] + users)
+        pks = set(user.pk for user in users)
+        existing = self._execute(db.select([table.c[member_column]], db.and_(
+            table.c[owner_column] == owner.pk,
+            table.c[member_column].in_(pks))))
+        pks.difference_update(row[0] for row in existing)
+        if not pks:
+            return
+        rows = [{owner_column: owner.pk, member_column: pk}
+                for pk in sorted(pks)]
+        if table is subscriptions:
+            now = datetime.now()
+            for row in rows:
+                row['date_follow'] = now
+        statement = self._compile(('insert', table.name), table.insert)
+        self._execute(statement, rows)
+
+    def contains(self, instance, key):
+        if not getattr(instance.owner, 'pk', None):
+            return False
+        statement = self._compile(('contains', instance.name), lambda: (
+            self._members(instance.name).where(
+                accounts.c.key == db.bindparam('key'))))
+        return self._execute(statement, {
+            'owner': instance.owner.pk, 'key': key}).fetchone() is not None
+
+    def getitem(self, instance, key):
+        row = None
+        if getattr(instance.owner, 'pk', None):
+            statement = self._compile(('getitem', instance.name), lambda: (
+                self._members(instance.name).where(
+                    accounts.c.key == db.bindparam('key'))))
+            row = self._execute(statement, {
+                'owner': instance.owner.pk, 'key': key}).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._load_user(row)
+
+    def setitem(self, instance, key, value):
+        self._commit(self._add_members, instance.name, instance.owner,
+                     [value])
+
+    def update(self, instance, items):
+        self._commit(self._add_members, instance.name, instance.owner,
+                     items.values())
+
+    def delitem(self, instance, key):
+        self._commit(self._delitem, instance, key)
+
+    def _delitem(self, instance, key):
+        table, owner_column, member_column = MEMBERSHIPS[instance.name]
+        deleted = 0
+        if getattr(instance.owner, 'pk', None):
+            statement = self._compile(('delitem', instance.name), lambda: (
+                table.delete(db.and_(
+                    table.c[owner_column] == db.bindparam('owner'),
+                    table.c[member_column] == db.select(
+                        [accounts.c.id],
+                        accounts.c.key == db.bindparam('key')).as_scalar()))))
+            deleted = self._execute(statement, {
+                'owner': instance.owner.pk, 'key': key}).rowcount
+        if not deleted:
+            raise KeyError(key)
+
+    # Collections of owned objects.
+
+    def _add_owned(self, name, owner, items):
+        """Adds objects to a collection, with a single statement."""
+        model_name, owner_column = OWNED[name]
+        mapping = MAPPINGS[model_name]
+        self._save_new([owner])
+        self._save_references(mapping, items)
+        values = {owner_column: owner.pk}
+        new = [i for i in items if not getattr(i, 'pk', None)]
+        stored = [i for i in items if getattr(i, 'pk', None)]
+        if new:
+            self._insert(mapping, new, values)
+        if stored:
+            self._update(mapping, stored, values)
+
+    def _items(self, instance):
+        model_name, owner_column = OWNED[instance.name]
+        table = MAPPINGS[model_name].table
+        return db.select([table], table.c[owner_column] ==
+                         db.bindparam('owner')).order_by(table.c.id)
+
+    def append(self, instance, item):
+        self._commit(self._add_owned, instance.name, instance.owner, [item])
+
+    def extend(self, instance, items):
+        self._commit(self._add_owned, instance.name, instance.owner, items)
+
+    # Any collection.
+
+    def len(self, instance):
+        if not getattr(instance.owner, 'pk', None):
+            return 0
+        if instance.name in MEMBERSHIPS:
+            table, owner_column, member_column = MEMBERSHIPS[instance.name]
+        else:
+            model_name, owner_column = OWNED[instance.name]
+            table = MAPPINGS[model_name].table
+        statement = self._compile(('len', instance.name), lambda: db.select(
+            [db.func.count()], table.c[owner_column] == db.bindparam('owner')))
+        return self._execute(statement, {'owner': instance.owner.pk}).scalar()
+
+    def get_page(self, instance, offset, limit):
+        if not getattr(instance.owner, 'pk', None):
+            return []
+        params = {'owner': instance.owner.pk}
+        # Not compiled once, the limit and offset are part of the statement.
+        if instance.name in MEMBERSHIPS:
+            statement = self._members(instance.name).order_by(
+                accounts.c.id).limit(limit).offset(offset)
+            return [(row['key'], self._load_user(row))
+                    for row in self._execute(statement, params)]
+        model = self._model(OWNED[instance.name][0])
+        statement = self._items(instance).limit(limit).offset(offset)
+        return [self._load(model, row)
+                for row in self._execute(statement, params)]
+
+    # Domain operations.
+
+    def get_followers(self, instance, pk=None):
+        if not getattr(instance, 'pk', None):
+            return []
+        statement = self._members('followers')
+        if pk is not None:
+            statement = statement.where(accounts.c.id == pk)
+        return [self._load_user(row) for row in self._execute(
+            statement.order_by(accounts.c.id), {'owner': instance.pk})]
+
+    def follow(self, instance, user, ulist=None):
+        self._commit(self._follow, instance, user, ulist)
+
+    def _follow(self, instance, user, ulist):
+        self._add_members('following', instance, [user])
+        if ulist is not None:
+            self._add_members('members', ulist, [user])
+
+    def add_list(self, instance, ulist):
+        self._commit(self._add_owned, 'lists', instance, [ulist])
+
+    def add_to_list(self, instance, ulist, user):
+        self.add_member(ulist, user)
+
+    def add_member(self, instance, item):
+        self._commit(self._add_members, 'members', instance, [item])
+
+    def post_notice(self, instance, notice):
+        self._commit(self._add_owned, 'notices', instance, [notice])
+
+    def send_private_notice(self, instance, notice):
+        self._commit(self._add_owned, 'private_notices', instance, [notice])
 
 
 class UserBackend(ModelBackend):
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Schema changes of the SQLAlchemy models that db.create_all() cannot make on
+existing tables. Back up the database before running them.
+"""
+
+from syrinx.models.backends.sqlalchemy.models import (db, Follower, Message,
+    TimelineEntry, User, user_key, user_keys)
+
+# The columns that used to refer to users by username, by table.
+USER_COLUMNS = (
+    (Follower.__table__, ('who_id', 'whom_id')),
+    (Message.__table__, ('author', )),
+    (TimelineEntry.__table__, ('owner', )),
+)
+
+
+def _reflect(connection, table):
+    if not connection.dialect.has_table(connection, table.name):
+        return None
+    return db.Table(table.name, db.MetaData(), autoload=True,
+                    autoload_with=connection)
+
+
+def _holds_usernames(connection, stored, columns):
+    """Tells whether the rows of a table still refer to users by username:
+    whether its columns are strings or hold them.
+    """
+    for column in columns:
+        if isinstance(stored.c[column].type, db.String):
+            return True
+        value = connection.execute(db.select([stored.c[column]],
+            stored.c[column] != None).limit(1)).scalar()
+        if isinstance(value, basestring):
+            return True
+    return False
+
+
+def _insert_from(connection, table, select):
+    # SQLAlchemy 0.6 cannot build an INSERT ... SELECT.
+    connection.execute('INSERT INTO %s (%s) %s' % (table.name,
+        ', '.join(column.name for column in table.columns),
+        select.compile(bind=connection)))
+
+
+def _copy(connection, table, stored, columns):
+    """Copies the rows of a table to a table of their own, with the
+    usernames of the given columns replaced by user ids. Returns the copy.
+
+    Rows referring to no user keep referring to none.
+    """
+    copy = db.Table(table.name + '_new', db.MetaData(), *[
+        db.Column(column.name, column.type, nullable=column.nullable)
+        for column in table.columns])
+    copy.create(bind=connection)
+    selected = []
+    source = stored
+    for column in table.columns:
+        if column.name in columns:
+            keys = user_keys.alias('%s_key' % column.name)
+            source = source.outerjoin(keys,
+                                      keys.c.key == stored.c[column.name])
+            selected.append(keys.c.id)
+        else:
+            selected.append(stored.c[column.name])
+    _insert_from(connection, copy, db.select(selected, from_obj=[source]))
+    return copy
+
+
+def _advance_sequence(connection, table):
+    """Moves the sequence of the key of a table past the rows copied into
+    it, which inserting keys explicitly does not do on PostgreSQL.
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    for column in table.primary_key.columns:
+        if (len(table.primary_key.columns) == 1 and column.autoincrement and
+            isinstance(column.type, db.Integer)):
+            connection.execute(
+                "SELECT setval(pg_get_serial_sequence('%(table)s', "
+                "'%(column)s'), COALESCE(MAX(%(column)s), 1), "
+                "MAX(%(column)s) IS NOT NULL) FROM %(table)s" % {
+                    'table': table.name, 'column': column.name})
+
+
+def _migrate(connection, pending):
+    """Rebuilds tables as defined by their models, with the usernames of the
+    given columns replaced by user ids.
+
+    The rows are copied to tables of their own, and back once the tables
+    are created again, so only portable statements are used. Tables are
+    dropped before the ones they refer to and created after them.
+    """
+    order = db.metadata.sorted_tables
+    pending = sorted(pending, key=lambda item: order.index(item[0]))
+    copies = [_copy(connection, table, stored, columns)
+              for table, stored, columns in pending]
+    # Dropping a table drops its indexes, created again with it.
+    for table, stored, columns in reversed(pending):
+        stored.drop(bind=connection)
+    for (table, stored, columns), copy in zip(pending, copies):
+        table.create(bind=connection)
+        _insert_from(connection, table, copy.select())
+        _advance_sequence(connection, table)
+        copy.drop(bind=connection)
+
+
+def _referring(connection, pending):
+    """Adds the stored tables referring to the pending ones, which have to
+    be rebuilt along with them, as they are, to drop those.
+    """
+    names = set(table.name for table, stored, columns in pending)
+    for table in db.metadata.sorted_tables:
+        if table.name in names:
+            continue
+        if [key for key in table.foreign_keys
+            if key.column.table.name in names]:
+            stored = _reflect(connection, table)
+            if stored is not None:
+                pending.append((table, stored, ()))
+                names.add(table.name)
+    return pending
+
+
+def intern_user_ids():
+    """Moves the tables referring to users by username to user ids,
+    interning every user and every username found. Returns the names of the
+    tables moved.
+    """
+    db.create_all()
+    connection = db.engine.connect()
+    try:
+        pending = []
+        for table, columns in USER_COLUMNS:
+            stored = _reflect(connection, table)
+            if stored is not None and _holds_usernames(connection, stored,
+                                                       columns):
+                pending.append((table, stored, columns))
+        if not pending:
+            return []
+        moved = [table.name for table, stored, columns in pending]
+        users = User.__table__
+        keys = set(user_key(username, server) for username, server in
+            connection.execute(db.select([users.c.username, users.c.server])))
+        for table, stored, columns in pending:
+            for column in columns:
+                keys.update(unicode(value) for value, in connection.execute(
+                    db.select([stored.c[column]]).distinct())
+                    if value is not None)
+        interned = set(key for key, in connection.execute(
+            db.select([user_keys.c.key])))
+        new_keys = keys.difference(interned)
+        if new_keys:
+            connection.execute(user_keys.insert(),
+                               [{'key': key} for key in new_keys])
+        transaction = connection.begin()
+        try:
+            _migrate(connection, _referring(connection, pending))
+            transaction.commit()
+        except Exception:
+            transaction.rollback()
+            raise
+        return moved
+    finally:
+        connection.close()
+
+
+def add_user_columns():
+    """Adds the columns of the users table missing from the database, set
+    to their defaults. Returns their names.
+    """
+    users = User.__table__
+    connection = db.engine.connect()
+    try:
+        stored = _reflect(connection, users)
+        if stored is None:
+            users.create(bind=connection)
+            return []
+        missing = [column for column in users.columns
+                   if column.name not in stored.c]
+        transaction = connection.begin()
+        try:
+            for column in missing:
+                # ADD COLUMN is standard SQL, SQLAlchemy 0.6 cannot build it.
+                connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    users.name, column.name,
+                    column.type.compile(dialect=connection.dialect)))
+                if column.default is not None:
+                    connection.execute(users.update().values(
+                        {column.name: column.default.arg}))
+            transaction.commit()
+        except Exception:
+            transaction.rollback()
+            raise
+        return [column.name for column in missing]
+    finally:
+        connection.close()
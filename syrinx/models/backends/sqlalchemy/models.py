@@ -1,11 +1,124 @@
 # -*- coding: utf-8 -*-
 from syrinx import app
+from syrinx.core import passwords
 
 from flaskext.sqlalchemy import SQLAlchemy
 from hashlib import sha512, md5
+import threading
 
 db = SQLAlchemy(app)
 
+user_keys = db.Table('user_keys', db.metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('key', db.String(129), nullable=False, unique=True))
+
+
+def user_key(username, server=None):
+    """Returns the key of a user: the username of local users and
+    username@server for remote ones.
+    """
+    if server:
+        return u'%s@%s' % (username, server)
+    return username
+
+
+def split_user_key(key):
+    """Returns the (username, server) pair of a user key."""
+    username, sep, server = key.partition('@')
+    return username, server
+
+
+class UserIds(object):
+    """Interns user keys as compact integer ids, which is how users are
+    referred to by other tables and by the in-memory indexes.
+
+    Ids are stored in the user_keys table and never change, so once read
+    they are cached for good. A key is interned with intern(), in the
+    session which creates the user, so reading ids never writes.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _cache(self, rows):
+        self._lock.acquire()
+        try:
+            for id, key in rows:
+                self._ids[key] = id
+                self._keys[id] = key
+        finally:
+            self._lock.release()
+
+    def _load(self, column, values):
+        values = list(values)
+        rows = []
+        # In chunks, databases limit the number of parameters.
+        for start in xrange(0, len(values), 500):
+            rows.extend(db.session.execute(db.select(
+                [user_keys.c.id, user_keys.c.key],
+                column.in_(values[start:start + 500]))))
+        self._cache(rows)
+
+    def intern(self, key):
+        """Returns the id of a user key, inserting it in the current
+        session if it is new. The session must be committed for the id to
+        be kept.
+        """
+        # Not from the cache: the transaction which interned it may have
+        # been rolled back since.
+        id = db.session.execute(db.select([user_keys.c.id],
+            user_keys.c.key == key)).scalar()
+        if id is None:
+            id = db.session.execute(user_keys.insert(),
+                                    {'key': key}).inserted_primary_key[0]
+            db.session.execute(FollowVersion.__table__.insert(),
+                               {'user_id': id, 'value': 0})
+        self._cache([(id, key)])
+        return id
+
+    def get(self, key):
+        """Returns the id of a user key, see intern()."""
+        try:
+            return self._ids[key]
+        except KeyError:
+            return self.get_many([key])[key]
+
+    def get_many(self, keys):
+        """Returns a key to id dict of the given user keys. Raises KeyError
+        for a key which was never interned.
+        """
+        missing = set(keys).difference(self._ids)
+        if missing:
+            self._load(user_keys.c.key, missing)
+        return dict((key, self._ids[key]) for key in keys)
+
+    def key(self, id):
+        """Returns the user key of an id."""
+        try:
+            return self._keys[id]
+        except KeyError:
+            return self.keys([id])[0]
+
+    def keys(self, ids):
+        """Returns the user keys of the given ids, in the same order."""
+        missing = set(ids).difference(self._keys)
+        if missing:
+            self._load(user_keys.c.id, missing)
+        return [self._keys[id] for id in ids]
+
+    def clear(self):
+        """Forgets the ids read, for instance when switching databases."""
+        self._lock.acquire()
+        try:
+            self._ids.clear()
+            self._keys.clear()
+        finally:
+            self._lock.release()
+
+user_ids = UserIds()
+
 
 class User(db.Model):
     """A user.
@@ -31,13 +144,16 @@ class User(db.Model):
     profile_uri = db.Column(db.String(64), nullable=True)
     is_root = db.Column(db.Boolean, default=False)
     date_joined = db.Column(db.DateTime, nullable=True)
+    # Whether to email the user about new followers.
+    email_notification = db.Column(db.Boolean, default=True)
 
     db.PrimaryKeyConstraint('username', 'server')
     db.UniqueConstraint('username', 'server', name='user_id')
 
     def __init__(self, username, server='', password=None, name='', email='',
                  location='', web='', profile_uri='', is_root=False,
-                 date_joined=None, *args, **kwargs):
+                 date_joined=None, email_notification=True, *args,
+                 **kwargs):
         # [a-zA-z0-9_\-]
         self.username = username
         self.server = server
@@ -49,6 +165,70 @@ class User(db.Model):
         self.profile_uri = profile_uri  # URI del perfil del usuario remoto.
         self.is_root = is_root
         self.date_joined = date_joined
+        self.email_notification = email_notification
+
+    @property
+    def key(self):
+        return user_key(self.username, self.server)
+
+    @property
+    def id(self):
+        """The integer id of the user, see UserIds."""
+        return user_ids.get(self.key)
+
+    def set_password(self, password):
+        """Stores the hash of a password. Hashing runs in the password pool,
+        see syrinx.core.passwords.
+        """
+        self.password = passwords.hash_password(password)
+
+    def check_password(self, password):
+        """Checks a password, upgrading its hash if the hashing policy has
+        changed since it was stored, see syrinx.core.passwords.
+        """
+        if not self.password:
+            return False
+        valid, new_hash = passwords.verify(self.password, password)
+        if new_hash:
+            self.password = new_hash
+        return valid
+
+    def snapshot(self):
+        """Returns a read-only copy of the user, see UserSnapshot."""
+        return UserSnapshot(self)
+
+    @classmethod
+    def directory(cls, after=None, limit=None):
+        """Returns a page of local users sorted by username, starting after
+        the given username.
+        """
+        query = cls.query.filter(cls.server == '')
+        if after:
+            query = query.filter(cls.username > after)
+        return query.order_by(cls.username).limit(
+            limit or app.config['DIRECTORY_PER_PAGE'])
+
+    def __unicode__(self):
+        if self.server:
+            return u'%s@%s' % (self.username, self.server)
+        return self.username
+
+    __str__ = __unicode__
+
+
+class UserSnapshot(object):
+    """A read-only copy of a user's profile.
+
+    It is detached from the database session, so it can be cached and shared
+    across requests.
+    """
+
+    fields = ('id', 'username', 'server', 'first_name', 'last_name', 'email',
+              'location', 'web', 'profile_uri', 'is_root', 'date_joined')
+
+    def __init__(self, user):
+        for field in self.fields:
+            setattr(self, field, getattr(user, field))
 
     def __unicode__(self):
         if self.server:
@@ -64,31 +244,88 @@ class Follower(db.Model):
 
     __tablename__ = 'followers'
 
-    # id = db.Column(db.Integer, primary_key=True)
-    who_id = db.Column(db.String, db.ForeignKey('users.username'),
-        primary_key=True)
-    whom_id = db.Column(db.String, db.ForeignKey('users.username'),
+    # Users are referred to by id, see UserIds.
+    who_id = db.Column(db.Integer, db.ForeignKey('user_keys.id'),
         primary_key=True)
+    whom_id = db.Column(db.Integer, db.ForeignKey('user_keys.id'),
+        primary_key=True, index=True)
     date_follow = db.Column(db.DateTime)
 
-    who = db.relationship(User, backref=db.backref('followers'),
-        primaryjoin='users.c.username==followers.c.who_id',
-        order_by=date_follow)
-    whom = db.relationship(User, backref=db.backref('following'),
-        primaryjoin='users.c.username==followers.c.whom_id',
-        order_by=date_follow)
-
-    def __init__(self, who, whom, date_follow, *args, **kwargs):
-        self.who = who
-        self.whom = whom
+    def __init__(self, who_id, whom_id, date_follow, *args, **kwargs):
+        self.who_id = who_id
+        self.whom_id = whom_id
         self.date_follow = date_follow
 
+    @classmethod
+    def load_follows(cls, graph, users):
+        """Loads whom the given users follow and their followers into a
+        FollowerGraph, with a single query.
+        """
+        users = set(users)
+        following = dict((user, []) for user in users)
+        followers = dict((user, []) for user in users)
+        for who, whom in db.session.query(cls.who_id, cls.whom_id).filter(
+                db.or_(cls.who_id.in_(users), cls.whom_id.in_(users))):
+            if who in users:
+                following[who].append(whom)
+            if whom in users:
+                followers[whom].append(who)
+        for user in users:
+            graph.replace(user, following[user], followers[user])
+
     def __unicode__(self):
-        return unicode(self.who)
+        return user_ids.key(self.who_id)
 
     __str__ = __unicode__
 
 
+class FollowVersion(db.Model):
+    """The version of the follows of each user, whom they follow and who
+    follows them. It is bumped in the transaction which changes them, so a
+    copy of the follows of a user is up to date as long as its version is
+    the stored one.
+    """
+
+    __tablename__ = 'follow_versions'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user_keys.id'),
+        primary_key=True)
+    value = db.Column(db.Integer, nullable=False)
+
+    @classmethod
+    def get_many(cls, users):
+        """Returns a user id to version dict of the given users, 0 for the
+        users who never had a follow.
+        """
+        versions = dict.fromkeys(users, 0)
+        versions.update(db.session.query(cls.user_id, cls.value).filter(
+            cls.user_id.in_(versions)))
+        return versions
+
+    @classmethod
+    def bump(cls, users):
+        """Increments the versions of the given users in the current
+        transaction, returning them as get_many() does.
+        """
+        users = set(users)
+        for user in users:
+            if not cls.query.filter_by(user_id=user).update(
+                    {cls.value: cls.value + 1}, synchronize_session=False):
+                # Interned before versions were kept.
+                db.session.execute(cls.__table__.insert(),
+                                   {'user_id': user, 'value': 1})
+        return cls.get_many(users)
+
+
+def _create_follow_versions(event, table, bind):
+    # Those of the users interned before the table existed.
+    bind.execute('INSERT INTO %s (user_id, value) SELECT id, 0 FROM %s' % (
+        table.name, user_keys.name))
+
+FollowVersion.__table__.append_ddl_listener('after-create',
+                                            _create_follow_versions)
+
+
 class Message(db.Model):
     """A message.
     """
@@ -96,20 +333,219 @@ class Message(db.Model):
     __tablename__ = 'messages'
 
     id = db.Column(db.Integer, primary_key=True)
-    author = db.Column(db.Integer, db.ForeignKey('users.username'))
+    author = db.Column(db.Integer, db.ForeignKey('user_keys.id'))
     text = db.Column(db.UnicodeText)
     date_publish = db.Column(db.DateTime)
 
+    @property
+    def user(self):
+        """The author of the message. Use load_authors() to fetch the authors
+        of many messages at once instead of one query per message.
+        """
+        if getattr(self, '_user', None) is None:
+            self._user = User.query.get(split_user_key(
+                user_ids.key(self.author)))
+        return self._user
+
     @property
     def email(self):
-        return User.query.get((self.author, '')).email
+        return self.user.email
+
+    @classmethod
+    def load_authors(cls, messages, authors=None):
+        """Fetches the authors of the given messages with a single query.
+
+        authors is an optional user id to User map (e.g. scoped to the
+        current request) that is looked up first and updated with the users
+        fetched.
+        """
+        if authors is None:
+            authors = {}
+        missing = list(set(message.author for message in messages) -
+                       set(authors))
+        if missing:
+            usernames = user_ids.keys(missing)
+            for user in User.query.filter(db.and_(
+                    User.username.in_(usernames), User.server == '')):
+                authors[user.id] = user
+        for message in messages:
+            message._user = authors.get(message.author)
+        return messages
 
     def __init__(self, author, text, date_publish, *args, **kwargs):
         self.author = author
         self.text = text
         self.date_publish = date_publish
 
+    def as_dict(self):
+        """A plain representation of the message, as needed to render it.
+        Unlike the message itself, it can be cached.
+        """
+        return {
+            'id': self.id,
+            'author': user_ids.key(self.author),
+            'author_id': self.author,
+            'email': self.email,
+            'text': self.text,
+            'date_publish': self.date_publish,
+        }
+
+    @classmethod
+    def paginate(cls, query=None, max_id=None, since_id=None, limit=None):
+        """Returns a page of messages, newest first.
+
+        Pages are addressed by cursor instead of offset: max_id returns
+        messages older than the given message and since_id messages newer
+        than it (both exclusive). The cursor is resolved with a subquery over
+        (date_publish, id), so deep pages cost the same as the first one.
+        """
+        query = query or cls.query
+        if max_id:
+            anchor = cls._date_published(max_id)
+            query = query.filter(db.or_(cls.date_publish < anchor,
+                db.and_(cls.date_publish == anchor, cls.id < max_id)))
+        if since_id:
+            anchor = cls._date_published(since_id)
+            query = query.filter(db.or_(cls.date_publish > anchor,
+                db.and_(cls.date_publish == anchor, cls.id > since_id)))
+        return query.order_by(cls.date_publish.desc(), cls.id.desc()).limit(
+            limit or app.config['PER_PAGE'])
+
+    @classmethod
+    def latest(cls, author=None):
+        """Returns the (id, date_publish) pair of the newest message, or of
+        the newest message of author, if given. Cheap enough to be used as a
+        version token of a timeline before querying it.
+        """
+        query = db.session.query(cls.id, cls.date_publish)
+        if author:
+            query = query.filter(cls.author == author)
+        return query.order_by(cls.date_publish.desc(),
+                              cls.id.desc()).first() or (None, None)
+
+    @classmethod
+    def _date_published(cls, message_id):
+        """A subquery for the publication date of the given message."""
+        # Aliased so it is not correlated with the query being paginated.
+        messages = cls.__table__.alias()
+        return db.select([messages.c.date_publish],
+            messages.c.id == message_id).as_scalar()
+
     def __unicode__(self):
         return unicode(self.text)
 
     __str__ = __unicode__
+
+# Back the keyset pagination of the user and public timelines.
+db.Index('messages_author_date_publish_id', Message.__table__.c.author,
+    Message.__table__.c.date_publish, Message.__table__.c.id)
+db.Index('messages_date_publish_id', Message.__table__.c.date_publish,
+    Message.__table__.c.id)
+
+
+class TimelineEntry(db.Model):
+    """An entry of a user's materialized home timeline.
+
+    Messages are pushed into the timeline of their author and of each of the
+    author's followers when they are published (fan-out-on-write), so reading
+    a home timeline is a single bounded range read over this table instead of
+    a join over followers sorted on every page load.
+    """
+
+    __tablename__ = 'timelines'
+
+    owner = db.Column(db.Integer, db.ForeignKey('user_keys.id'),
+        primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('messages.id'),
+        primary_key=True)
+
+    message = db.relationship(Message)
+
+    def __init__(self, owner, message_id, *args, **kwargs):
+        self.owner = owner
+        self.message_id = message_id
+
+    @classmethod
+    def fan_out(cls, message):
+        """Pushes a published message into the timeline of its author and
+        followers, capping each of them to TIMELINE_SIZE entries.
+        """
+        owners = set([message.author])
+        # A user following themselves is already in there.
+        owners.update(row.who_id for row in db.session.query(
+            Follower.who_id).filter(Follower.whom_id == message.author))
+        owners = list(owners)
+        db.session.execute(cls.__table__.insert(), [
+            {'owner': owner, 'message_id': message.id} for owner in owners])
+        cls.trim(owners)
+
+    @classmethod
+    def backfill(cls, owner, author):
+        """Copies the latest messages of author into owner's timeline. Used
+        when owner starts following author. Messages already there, as
+        those of a user following themselves, are left alone.
+        """
+        table = cls.__table__
+        present = db.select([table.c.message_id], table.c.owner == owner)
+        rows = db.session.query(Message.id).filter(db.and_(
+            Message.author == author, ~Message.id.in_(present))).order_by(
+                Message.id.desc()).limit(app.config['TIMELINE_SIZE'])
+        entries = [{'owner': owner, 'message_id': row.id} for row in rows]
+        if entries:
+            db.session.execute(cls.__table__.insert(), entries)
+            cls.trim([owner])
+
+    @classmethod
+    def purge(cls, owner, author):
+        """Removes the messages of author from owner's timeline. Used when
+        owner stops following author. The messages of owner stay in their
+        own timeline.
+        """
+        if owner == author:
+            return
+        table = cls.__table__
+        authored = db.select([Message.id], Message.author == author)
+        db.session.execute(table.delete(db.and_(table.c.owner == owner,
+            table.c.message_id.in_(authored))))
+
+    @classmethod
+    def trim(cls, owners, size=None):
+        """Drops everything but the newest size entries of each timeline."""
+        size = size or app.config['TIMELINE_SIZE']
+        table = cls.__table__
+        newest = table.alias()
+        # The id of the oldest entry that falls out of the window, if any.
+        cutoff = db.select([newest.c.message_id],
+            newest.c.owner == table.c.owner).order_by(
+                newest.c.message_id.desc()).limit(1).offset(size).as_scalar()
+        db.session.execute(table.delete(db.and_(table.c.owner.in_(owners),
+            table.c.message_id <= cutoff)))
+
+    @classmethod
+    def get_messages(cls, owner, max_id=None, since_id=None, limit=None):
+        """Returns a page of owner's timeline, newest first. max_id and
+        since_id work as in Message.paginate().
+        """
+        query = Message.query.join((cls, cls.message_id == Message.id)).filter(
+            cls.owner == owner)
+        if max_id:
+            query = query.filter(cls.message_id < max_id)
+        if since_id:
+            query = query.filter(cls.message_id > since_id)
+        return query.order_by(cls.message_id.desc()).limit(
+            limit or app.config['PER_PAGE'])
+
+    @classmethod
+    def latest(cls, owner):
+        """Returns the (id, date_publish) pair of the newest message in
+        owner's timeline, see Message.latest().
+        """
+        return db.session.query(Message.id, Message.date_publish).join(
+            (cls, cls.message_id == Message.id)).filter(
+                cls.owner == owner).order_by(
+                    cls.message_id.desc()).first() or (None, None)
+
+    def __unicode__(self):
+        return u'%s: %s' % (user_ids.key(self.owner), self.message_id)
+
+    __str__ = __unicode__
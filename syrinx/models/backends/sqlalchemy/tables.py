@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Tables of the domain models stored by the SQLAlchemy model backend.
+
+They share the metadata of the application's models, so db.create_all()
+creates them too.
+"""
+
+from syrinx.models.backends.sqlalchemy.models import db
+
+from sqlalchemy.exc import IntegrityError
+
+# Local and remote users, distinguished by kind. Both can be followed and
+# added to lists, so they share their primary keys.
+accounts = db.Table('accounts', db.metadata,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('kind', db.String(8), nullable=False),
+    # username@server, the key of users in collections.
+    db.Column('key', db.String(129), nullable=False, unique=True),
+    db.Column('username', db.String(64), nullable=False),
+    db.Column('server', db.String(64), nullable=True),
+    db.Column('name', db.String(64), nullable=True),
+    db.Column('location', db.String(64), nullable=True),
+    db.Column('profile_uri', db.String(64), nullable=True),
+    db.Column('created', db.DateTime, nullable=True),
+    db.Column('password', db.String(128), nullable=True),
+    db.Column('first_name', db.String(64), nullable=True),
+    db.Column('last_name', db.String(64), nullable=True),
+    db.Column('bio', db.String(160), nullable=True),
+    db.Column('status', db.String(140), nullable=True),
+    db.Column('email', db.String(64), nullable=True),
+    db.Column('web', db.String(64), nullable=True),
+    db.Column('date_joined', db.DateTime, nullable=True),
+    db.Column('user_config_id', db.Integer,
+              db.ForeignKey('user_configs.id'), nullable=True),
+    db.Column('admin_user_id', db.Integer,
+              db.ForeignKey('admin_users.id'), nullable=True),
+    db.Column('twitter_user_id', db.Integer,
+              db.ForeignKey('twitter_users.id'), nullable=True))
+
+user_configs = db.Table('user_configs', db.metadata,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('protected', db.Boolean, default=False),
+    db.Column('email_notification', db.Boolean, default=True))
+
+admin_users = db.Table('admin_users', db.metadata,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('is_root', db.Boolean, default=False))
+
+twitter_users = db.Table('twitter_users', db.metadata,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('username', db.String(64), nullable=False),
+    db.Column('password', db.String(128), nullable=True))
+
+user_lists = db.Table('user_lists', db.metadata,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('owner_id', db.Integer, db.ForeignKey('accounts.id'),
+              nullable=True, index=True),
+    db.Column('name', db.String(64), nullable=False),
+    db.Column('muted', db.Boolean, default=False),
+    db.Column('created', db.DateTime, nullable=True))
+
+list_members = db.Table('list_members', db.metadata,
+    db.Column('list_id', db.Integer, db.ForeignKey('user_lists.id'),
+              primary_key=True),
+    db.Column('member_id', db.Integer, db.ForeignKey('accounts.id'),
+              primary_key=True))
+
+subscriptions = db.Table('subscriptions', db.metadata,
+    db.Column('follower_id', db.Integer, db.ForeignKey('accounts.id'),
+              primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey('accounts.id'),
+              primary_key=True, index=True),
+    db.Column('date_follow', db.DateTime, nullable=True))
+
+notices = db.Table('notices', db.metadata,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('author_id', db.Integer, db.ForeignKey('accounts.id'),
+              nullable=True, index=True),
+    db.Column('content', db.String(140), nullable=True),
+    db.Column('repeats_id', db.Integer, db.ForeignKey('notices.id'),
+              nullable=True),
+    db.Column('date_publish', db.DateTime, nullable=True))
+
+private_notices = db.Table('private_notices', db.metadata,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('sender_id', db.Integer, db.ForeignKey('accounts.id'),
+              nullable=True, index=True),
+    db.Column('recipient_id', db.Integer, db.ForeignKey('accounts.id'),
+              nullable=True, index=True),
+    db.Column('content', db.String(140), nullable=True),
+    db.Column('read', db.Boolean, default=False))
+
+# The next primary key of each table. Keys are reserved in blocks, so rows
+# inserted in bulk know their keys without reading them back.
+sequences = db.Table('sequences', db.metadata,
+    db.Column('name', db.String(32), primary_key=True),
+    db.Column('next_id', db.Integer, nullable=False))
+
+# The tables whose keys are reserved from sequences.
+KEYED_TABLES = (accounts, user_configs, admin_users, twitter_users,
+                user_lists, notices, private_notices)
+
+
+def _create_sequences(event, metadata, bind, **kwargs):
+    """Adds the sequence of every keyed table which has none yet, starting
+    after any row already there. Runs on every db.create_all(), so a
+    database created before a table had its sequence gets one then.
+    """
+    names = set(row[0] for row in bind.execute(
+        db.select([sequences.c.name])))
+    for table in KEYED_TABLES:
+        if table.name in names:
+            continue
+        last_id = bind.execute(db.select([db.func.max(table.c.id)])).scalar()
+        try:
+            bind.execute(sequences.insert(),
+                         {'name': table.name, 'next_id': (last_id or 0) + 1})
+        except IntegrityError:
+            # Another process created it first.
+            pass
+
+db.metadata.append_ddl_listener('after-create', _create_sequences)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+A unit of work for the domain models: saves and deletes issued while it is
+active are collected and written at the end, in batches, instead of reaching
+the backend one by one.
+
+    with get_backend(user).session():
+        config.save()
+        admin.save()
+        user.save()
+
+Read more about this pattern: http://martinfowler.com/eaaCatalog/unitOfWork.html
+"""
+
+from syrinx.models.backends import identity
+
+import threading
+
+_local = threading.local()
+
+
+def current():
+    """Returns the unit of work active in the current thread, if any."""
+    stack = getattr(_local, 'stack', None)
+    return stack and stack[-1] or None
+
+
+def flush_pending():
+    """Writes the changes collected by the current unit of work, if any, so
+    that the operation about to reach the backend sees them.
+    """
+    unit = current()
+    if unit is not None:
+        unit.flush()
+
+
+class UnitOfWork(object):
+    """Collects the changes to write to the backends.
+
+    Units of work can be nested; the inner ones join the outermost, which is
+    the only one writing. If the block raises the changes are discarded.
+    Operations other than saves and deletes (follow(), post_notice()...)
+    are not collected: the changes collected before them are written first.
+    The last save or delete of an instance is the one written.
+    The outermost one also opens an identity scope, see identity.scope().
+    """
+
+    def __init__(self):
+        # Backend and instance pairs, in the order they were registered.
+        self.saved = []
+        self.deleted = []
+
+    def register_save(self, backend, instance):
+        # Saved again after being deleted, it is not deleted.
+        self.deleted = [(b, i) for b, i in self.deleted if i is not instance]
+        if not self._contains(self.saved, instance):
+            self.saved.append((backend, instance))
+
+    def register_delete(self, backend, instance):
+        # There is no point in saving what is going to be deleted.
+        self.saved = [(b, i) for b, i in self.saved if i is not instance]
+        if not self._contains(self.deleted, instance):
+            self.deleted.append((backend, instance))
+
+    def _contains(self, changes, instance):
+        for backend, registered in changes:
+            if registered is instance:
+                return True
+        return False
+
+    def flush(self):
+        """Writes the collected changes. The backends of a module share their
+        storage, so they are written together in a single batch.
+        """
+        saved, self.saved = self.saved, []
+        deleted, self.deleted = self.deleted, []
+        # [backend, saved instances, deleted instances] per module.
+        batches = []
+        by_module = {}
+        for index, changes in ((1, saved), (2, deleted)):
+            for backend, instance in changes:
+                module = backend.__class__.__module__
+                if module not in by_module:
+                    by_module[module] = [backend, [], []]
+                    batches.append(by_module[module])
+                by_module[module][index].append(instance)
+        for backend, saved_instances, deleted_instances in batches:
+            backend.flush(saved_instances, deleted_instances)
+        for backend, instance in saved:
+            pk = getattr(instance, 'pk', None)
+            if pk:
+                identity.add(instance.__class__, pk, instance)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if not stack:
+            self._scope = identity.scope()
+            self._scope.__enter__()
+        stack.append(stack and stack[0] or self)
+        return stack[-1]
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = _local.stack
+        unit = stack.pop()
+        if stack:
+            # Nested, the outermost unit of work writes.
+            return False
+        try:
+            if exc_type is None:
+                unit.flush()
+        finally:
+            unit._scope.__exit__(exc_type, exc_value, traceback)
+        return False
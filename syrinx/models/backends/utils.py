@@ -3,23 +3,106 @@ from syrinx import app
 from syrinx.core.exceptions import ImproperlyConfigured
 from syrinx.utils import importlib
 
+import threading
 
-def get_backend(instance, backend=None, *args, **kwargs):
-    mod_name = backend or app.config['MODEL_BACKEND']
-    klass_name = instance.__class__.__name__ + 'Backend'
-    if backend:
-        if callable(backend):
-            return backend
+# Backend classes, by (backend path, class name). Resolving them means
+# importing modules, which is too slow to do on every call.
+_classes = {}
+_classes_lock = threading.Lock()
+
+# Backend instances are reused, but never shared among threads.
+_local = threading.local()
+
+
+def load_backend_class(path, klass_name):
+    """Imports and returns a backend class.
+
+    path is either the dotted path to a backend module or to a backend class.
+    A backend module provides a klass_name class (e.g. 'LocalUserBackend')
+    or a generic ModelBackend class.
+    """
     try:
-        mod = importlib.import_module(mod_name)
+        mod = importlib.import_module(path)
     except ImportError, e:
+        if '.' not in path:
+            raise ImproperlyConfigured(
+                'Error importing model backend module %s: "%s"' % (path, e))
+        # Maybe it is the path to a class.
+        mod_name, attr = path.rsplit('.', 1)
+        try:
+            mod = importlib.import_module(mod_name)
+        except ImportError:
+            raise ImproperlyConfigured(
+                'Error importing model backend module %s: "%s"' % (path, e))
+        try:
+            return getattr(mod, attr)
+        except AttributeError:
+            raise ImproperlyConfigured(
+                'Module "%s" does not define a "%s" class' % (
+                    mod_name, attr))
+    klass = getattr(mod, klass_name, None) or getattr(mod, 'ModelBackend',
+                                                      None)
+    if klass is None:
         raise ImproperlyConfigured(
-            'Error importing model backend module %s: "%s"' % (mod_name, e))
+            'Module "%s" does not define a "%s" class' % (
+                path, klass_name))
+    return klass
+
+
+def get_backend_class(path, klass_name):
+    """Returns a backend class, resolving it only the first time."""
+    key = (path, klass_name)
     try:
-        klass = getattr(mod, klass_name)
+        return _classes[key]
+    except KeyError:
+        pass
+    klass = load_backend_class(path, klass_name)
+    _classes_lock.acquire()
+    try:
+        _classes[key] = klass
+    finally:
+        _classes_lock.release()
+    return klass
+
+
+def get_backend(instance, backend=None, *args, **kwargs):
+    """Returns the backend for a model instance (or class).
+
+    backend defaults to the MODEL_BACKEND setting and may be the path to a
+    backend module or class, or a backend object, which is returned as is.
+    Backends are instantiated once per thread and configuration; passing
+    constructor arguments always builds a new one.
+    """
+    if backend is not None and not isinstance(backend, basestring):
+        return backend
+    path = backend or app.config.get('MODEL_BACKEND')
+    if not path:
+        raise ImproperlyConfigured('No model backend given and the '
+                                   'MODEL_BACKEND setting is not set')
+    if not isinstance(instance, type):
+        instance = instance.__class__
+    klass_name = instance.__name__ + 'Backend'
+    if args or kwargs:
+        return get_backend_class(path, klass_name)(*args, **kwargs)
+    key = (path, klass_name)
+    try:
+        backends = _local.backends
     except AttributeError:
-        raise ImproperlyConfigured(
-            'Module "%s" does not define a "%s" class' % (
-                mod_name, klass_name))
+        backends = _local.backends = {}
+    try:
+        return backends[key]
+    except KeyError:
+        backends[key] = get_backend_class(path, klass_name)()
+        return backends[key]
 
-    return klass(*args, **kwargs)
+
+def reset_backends():
+    """Forgets the resolved backend classes and the backend instances of the
+    current thread, so they are loaded again on next use.
+    """
+    _classes_lock.acquire()
+    try:
+        _classes.clear()
+    finally:
+        _classes_lock.release()
+    _local.__dict__.pop('backends', None)
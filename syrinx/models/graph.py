@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+An in-memory index of who follows whom.
+
+Users are integers. The followers and the followings of each user are kept
+as sorted arrays, so checking a follow is a binary search and intersecting
+or subtracting two of them takes a pass over one of them, instead of a join
+over the followers table.
+
+Arrays are never modified in place: a follow replaces them with a modified
+copy, so they can be read without locking.
+"""
+
+from array import array
+from bisect import bisect_left
+import threading
+
+# Past this size ratio the items of the smaller array are searched in the
+# larger one, instead of going through both.
+SEARCH_RATIO = 8
+
+EMPTY = array('l')
+
+
+def _contains(items, item):
+    index = bisect_left(items, item)
+    return index < len(items) and items[index] == item
+
+
+def intersection(a, b):
+    """Returns the items in both sorted sequences, sorted.
+
+    The items of the smaller one are searched in the larger one when it is
+    SEARCH_RATIO times larger; otherwise the larger one is scanned against
+    a set of the smaller one.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return []
+    if len(b) > SEARCH_RATIO * len(a):
+        return [item for item in a if _contains(b, item)]
+    present = set(a)
+    return [item for item in b if item in present]
+
+
+def difference(a, b):
+    """Returns the items of sorted sequence a not in b, sorted."""
+    if not a or not b:
+        return list(a)
+    if len(b) > SEARCH_RATIO * len(a):
+        return [item for item in a if not _contains(b, item)]
+    absent = set(b)
+    return [item for item in a if item not in absent]
+
+
+class FollowerGraph(object):
+    """Who follows whom.
+
+    versions is left for the owner of the graph to tell, user by user,
+    whether the follows of each are up to date with those stored elsewhere.
+    """
+
+    def __init__(self):
+        self._followers = {}
+        self._following = {}
+        self._lock = threading.Lock()
+        self.versions = {}
+
+    def load(self, follows):
+        """Replaces the graph with the given (who, whom) pairs."""
+        followers = {}
+        following = {}
+        for who, whom in follows:
+            following.setdefault(who, set()).add(whom)
+            followers.setdefault(whom, set()).add(who)
+        self._lock.acquire()
+        try:
+            self._following = dict((user, array('l', sorted(users)))
+                                   for user, users in following.iteritems())
+            self._followers = dict((user, array('l', sorted(users)))
+                                   for user, users in followers.iteritems())
+        finally:
+            self._lock.release()
+
+    def replace(self, user, following, followers):
+        """Replaces whom user follows and the followers of user."""
+        following = array('l', sorted(following))
+        followers = array('l', sorted(followers))
+        self._lock.acquire()
+        try:
+            self._following[user] = following
+            self._followers[user] = followers
+        finally:
+            self._lock.release()
+
+    def _add(self, adjacency, user, other):
+        users = adjacency.get(user, EMPTY)
+        index = bisect_left(users, other)
+        if index < len(users) and users[index] == other:
+            return
+        users = array('l', users)
+        users.insert(index, other)
+        adjacency[user] = users
+
+    def _remove(self, adjacency, user, other):
+        users = adjacency.get(user, EMPTY)
+        index = bisect_left(users, other)
+        if index == len(users) or users[index] != other:
+            return
+        users = array('l', users)
+        del users[index]
+        adjacency[user] = users
+
+    def follow(self, who, whom):
+        self._lock.acquire()
+        try:
+            self._add(self._following, who, whom)
+            self._add(self._followers, whom, who)
+        finally:
+            self._lock.release()
+
+    def unfollow(self, who, whom):
+        self._lock.acquire()
+        try:
+            self._remove(self._following, who, whom)
+            self._remove(self._followers, whom, who)
+        finally:
+            self._lock.release()
+
+    def is_following(self, who, whom):
+        return _contains(self._following.get(who, EMPTY), whom)
+
+    def followers(self, user):
+        """Returns the followers of user as a sorted array, which must not be
+        modified.
+        """
+        return self._followers.get(user, EMPTY)
+
+    def following(self, user):
+        """Returns whom user follows as a sorted array, which must not be
+        modified.
+        """
+        return self._following.get(user, EMPTY)
+
+    def count_followers(self, user):
+        return len(self._followers.get(user, EMPTY))
+
+    def count_following(self, user):
+        return len(self._following.get(user, EMPTY))
+
+    def mutual(self, user):
+        """Returns the users following user back."""
+        return intersection(self.following(user), self.followers(user))
+
+    def followed_by_following(self, viewer, user):
+        """Returns the users viewer follows who follow user."""
+        return intersection(self.following(viewer), self.followers(user))
+
+    def not_followed(self, viewer, users):
+        """Returns the users of a sorted sequence that viewer does not
+        follow.
+        """
+        return difference(users, self.following(viewer))
@@ -1,16 +1,23 @@
 # -*- coding: utf-8 -*-
 from syrinx import app
+from syrinx.core import passwords
 from syrinx.models.backends import BackendAdapter
 
 from datetime import datetime
 from flaskext.sqlalchemy import SQLAlchemy
-import bcrypt
 
 
 class User(object):
     """A user.
+
+    Users, local users and notices are kept by the thousand, so they are
+    given __slots__ instead of a __dict__ each. pk is assigned by the model
+    backends.
     """
 
+    __slots__ = ('pk', 'username', 'server', 'location', 'profile_uri',
+                 'created')
+
     def __init__(self, username=None, server=None, location=None,
                  profile_uri=None, created=None, *args, **kwargs):
         self.username = username
@@ -37,6 +44,7 @@ class RemoteUser(User):
     """
 
     __metaclass__ = BackendAdapter
+    __slots__ = ('name', )
 
     # Cuando quiero seguir un usuario en otro servidor, se me pregunta
     # usuario@servidor de mi cuenta, el servicio lo registra y lo guarda en una
@@ -52,6 +60,9 @@ class LocalUser(User):
     """
 
     __metaclass__ = BackendAdapter
+    __slots__ = ('_password', 'first_name', 'last_name', 'bio', 'status',
+                 'email', 'web', 'date_joined', 'user_config', 'admin_user',
+                 'twitter_user')
 
     lists = []
     followers = {}
@@ -101,10 +112,17 @@ class LocalUser(User):
     @password.setter
     def password(self, value):
         if value:
-            self._password = bcrypt.hashpwd(value, bcrypt.gensalt())
+            self._password = passwords.hash_password(value)
 
     def check_password(self, password):
-        return self._password = bcrypt.hashpwd(value, bcrypt.gensalt())
+        """Checks a password, upgrading its hash if the hashing policy has
+        changed since it was stored. The user has to be saved then.
+        """
+        valid, new_hash = passwords.verify(getattr(self, '_password', None),
+                                           password)
+        if new_hash:
+            self._password = new_hash
+        return valid
 
 
 class UserConfig(object):
@@ -182,6 +200,7 @@ class Notice(object):
     """
 
     __metaclass__ = BackendAdapter
+    __slots__ = ('pk', 'content', 'repeats', 'date_publish')
 
     def __init__(self, content=None, repeats=None,
                  date_publish=None, *args, **kwargs):
@@ -2,6 +2,13 @@
 from syrinx import app
 from syrinx.models import (AdminUser, LocalUser, Notice, PrivateNotice,
     RemoteUser, TwitterUser, User, UserConfig, UserList)
+from syrinx.models.backends import BackendDict, BackendList, identity, memory
+from syrinx.models.backends.base import BaseModelBackend
+from syrinx.models.backends.sqlalchemy.models import db
+from syrinx.models.backends.sqlalchemy.tables import KEYED_TABLES, sequences
+from syrinx.models.graph import FollowerGraph, difference, intersection
+
+from datetime import datetime, timedelta
 
 import unittest2 as unittest
 
@@ -10,11 +17,26 @@ class ModelTestsBase:
     """Testing models.
     """
 
+    def setUp(self):
+        # Collections are read through the configured backend.
+        self.model_backend = app.config.get('MODEL_BACKEND')
+        app.config['MODEL_BACKEND'] = self.BACKEND
+
+    def tearDown(self):
+        app.config['MODEL_BACKEND'] = self.model_backend
+
     def get_backend(self):
         return self.BACKEND
 
+    def assertLength(self, collection, length):
+        """Checks the number of objects the backend keeps in a collection.
+        """
+        self.assertEquals(len(collection), length)
+
     def test_user(self):
-        tuxie = User(username='tuxie', location=u'Montevideo, UY')
+        # User is abstract, users are stored as local or remote users.
+        self.assertFalse(hasattr(User, 'save'))
+        tuxie = LocalUser(username='tuxie', location=u'Montevideo, UY')
         tuxie.save(backend=self.get_backend())
 
     def test_remote_user(self):
@@ -117,7 +139,7 @@ class ModelTestsBase:
         tuxie.post_notice(notice1, backend=self.get_backend())
         tuxie.post_notice(notice2, backend=self.get_backend())
         tuxie.post_notice(notice3, backend=self.get_backend())
-        self.assertEquals(len(tuxie.notices), 3)
+        self.assertLength(tuxie.notices, 3)
 
     def test_private_notice(self):
         tuxie = LocalUser(username='tuxie', password='passwd',
@@ -132,7 +154,7 @@ class ModelTestsBase:
         notice2 = PrivateNotice(content=u'Hallo', recipient=niko)
         tuxie.send_private_notice(notice1, backend=self.get_backend())
         tuxie.send_private_notice(notice2, backend=self.get_backend())
-        self.assertEquals(len(tuxie.private_notices), 2)
+        self.assertLength(tuxie.private_notices, 2)
 
 
 # class ConsoleBackendTests(ModelTestsBase, unittest.TestCase):
@@ -144,6 +166,352 @@ class DummyBackendTests(ModelTestsBase, unittest.TestCase):
 
     BACKEND = 'syrinx.models.backends.dummy.ModelBackend'
 
+    def assertLength(self, collection, length):
+        # The dummy backend keeps nothing.
+        self.assertEquals(len(collection), 0)
+
+
+class MemoryBackendTests(ModelTestsBase, unittest.TestCase):
+
+    BACKEND = 'syrinx.models.backends.memory.ModelBackend'
+
+    def setUp(self):
+        ModelTestsBase.setUp(self)
+        memory.clear()
+        identity.clear()
+
+    def test_followers(self):
+        tuxie = LocalUser(username='tuxie', password='passwd')
+        omar = LocalUser(username='omar', password='passwd')
+        niko = RemoteUser(username='nikola', server='twitter.com')
+        tuxie.follow(omar, backend=self.BACKEND)
+        tuxie.follow(niko, backend=self.BACKEND)
+        tuxie.follow(niko, backend=self.BACKEND)
+        self.assertEquals(len(tuxie.following), 2)
+        self.assertTrue(niko.get_key() in tuxie.following)
+        self.assertEquals(omar.get_followers(backend=self.BACKEND), [tuxie])
+        self.assertEquals(omar.followers.keys(), [tuxie.get_key()])
+        del tuxie.following[omar.get_key()]
+        omar.followers.reset()
+        self.assertEquals(len(omar.followers), 0)
+        self.assertRaises(KeyError, tuxie.following.__delitem__,
+                          omar.get_key())
+
+    def test_notices_by_date(self):
+        tuxie = LocalUser(username='tuxie', password='passwd')
+        now = datetime.now()
+        later = Notice(content=u'Later', date_publish=now)
+        sooner = Notice(content=u'Sooner',
+                        date_publish=now - timedelta(minutes=1))
+        tuxie.post_notice(later, backend=self.BACKEND)
+        tuxie.post_notice(sooner, backend=self.BACKEND)
+        self.assertEquals(list(tuxie.notices), [sooner, later])
+        sooner.delete(backend=self.BACKEND)
+        tuxie.notices.reset()
+        self.assertEquals(list(tuxie.notices), [later])
+
+    def test_delete_user(self):
+        tuxie = LocalUser(username='tuxie', password='passwd')
+        omar = LocalUser(username='omar', password='passwd')
+        userlist = UserList(name='millencolin')
+        tuxie.add_list(userlist, backend=self.BACKEND)
+        tuxie.follow(omar, userlist, backend=self.BACKEND)
+        self.assertEquals(len(userlist.members), 1)
+        pk = omar.pk
+        omar.delete(backend=self.BACKEND)
+        self.assertEquals(LocalUser(pk=pk, backend=self.BACKEND), None)
+        tuxie.following.reset()
+        userlist.members.reset()
+        self.assertEquals(len(tuxie.following), 0)
+        self.assertEquals(len(userlist.members), 0)
+
+    def test_delete_owner(self):
+        tuxie = LocalUser(username='tuxie', password='passwd')
+        omar = LocalUser(username='omar', password='passwd')
+        userlist = UserList(name='millencolin')
+        notice = Notice(content=u'Hello', date_publish=datetime.now())
+        private_notice = PrivateNotice(content=u'Hallo', recipient=omar)
+        tuxie.add_list(userlist, backend=self.BACKEND)
+        tuxie.follow(omar, userlist, backend=self.BACKEND)
+        tuxie.post_notice(notice, backend=self.BACKEND)
+        tuxie.send_private_notice(private_notice, backend=self.BACKEND)
+        pks = (userlist.pk, notice.pk, private_notice.pk)
+        tuxie.delete(backend=self.BACKEND)
+        self.assertEquals(UserList(pk=pks[0], backend=self.BACKEND), None)
+        self.assertEquals(Notice(pk=pks[1], backend=self.BACKEND), None)
+        self.assertEquals(PrivateNotice(pk=pks[2], backend=self.BACKEND),
+                          None)
+        self.assertEquals(memory.default_store.owners, {})
+        self.assertEquals(memory.default_store.listed.keys(omar.pk), [])
+
+
+class SQLAlchemyBackendTests(ModelTestsBase, unittest.TestCase):
+
+    BACKEND = 'syrinx.models.backends.sqlalchemy.ModelBackend'
+
+    def setUp(self):
+        ModelTestsBase.setUp(self)
+        self.database_uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        identity.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.database_uri
+        ModelTestsBase.tearDown(self)
+
+    def test_sequences(self):
+        # Every keyed table has its sequence once created.
+        names = [row[0] for row in
+                 db.session.execute(db.select([sequences.c.name]))]
+        self.assertEquals(sorted(names),
+                          sorted(table.name for table in KEYED_TABLES))
+        tuxie = LocalUser(username='tuxie', password='passwd')
+        omar = LocalUser(username='omar', password='passwd')
+        tuxie.save(backend=self.BACKEND)
+        omar.save(backend=self.BACKEND)
+        self.assertEquals((tuxie.pk, omar.pk), (1, 2))
+
+    def test_followers(self):
+        tuxie = LocalUser(username='tuxie', password='passwd')
+        omar = LocalUser(username='omar', password='passwd')
+        tuxie.save(backend=self.BACKEND)
+        omar.save(backend=self.BACKEND)
+        tuxie.follow(omar, backend=self.BACKEND)
+        followers = omar.get_followers(backend=self.BACKEND)
+        self.assertEquals([user.pk for user in followers], [tuxie.pk])
+        self.assertEquals(omar.followers.keys(), [tuxie.get_key()])
+
+    def test_delete_owner(self):
+        tuxie = LocalUser(username='tuxie', password='passwd',
+                          user_config=UserConfig(), admin_user=AdminUser())
+        omar = LocalUser(username='omar', password='passwd')
+        userlist = UserList(name='millencolin')
+        notice = Notice(content=u'Hello')
+        tuxie.add_list(userlist, backend=self.BACKEND)
+        tuxie.follow(omar, userlist, backend=self.BACKEND)
+        omar.follow(tuxie, backend=self.BACKEND)
+        tuxie.post_notice(notice, backend=self.BACKEND)
+        omar.post_notice(Notice(content=u'Hello', repeats=notice),
+                         backend=self.BACKEND)
+        tuxie.send_private_notice(PrivateNotice(content=u'Hallo',
+            recipient=omar), backend=self.BACKEND)
+        omar.send_private_notice(PrivateNotice(content=u'Hi',
+            recipient=tuxie), backend=self.BACKEND)
+        tuxie.delete(backend=self.BACKEND)
+        # Only omar and his notice are left, which repeats nothing now.
+        for table, count in (('accounts', 1), ('subscriptions', 0),
+                             ('user_lists', 0), ('list_members', 0),
+                             ('notices', 1), ('private_notices', 0),
+                             ('user_configs', 0), ('admin_users', 0)):
+            self.assertEquals(db.session.execute(
+                'SELECT COUNT(*) FROM %s' % table).scalar(), count)
+        self.assertEquals(db.session.execute(
+            'SELECT repeats_id FROM notices').scalar(), None)
+
+
+class IdentityMapTests(unittest.TestCase):
+
+    def test_scope(self):
+        tuxie = LocalUser(username='tuxie', password='passwd')
+        identity.add(LocalUser, 1, tuxie)
+        # Nothing is kept outside of a scope.
+        self.assertEquals(identity.get(LocalUser, 1), None)
+        with identity.scope():
+            identity.add(LocalUser, 1, tuxie)
+            with identity.scope():
+                self.assertTrue(identity.get(LocalUser, 1) is tuxie)
+            self.assertTrue(identity.get(LocalUser, 1) is tuxie)
+        self.assertEquals(identity.get(LocalUser, 1), None)
+
+    def test_request_scope(self):
+        tuxie = LocalUser(username='tuxie', password='passwd')
+        with app.test_request_context('/'):
+            app.preprocess_request()
+            identity.add(LocalUser, 1, tuxie)
+            self.assertTrue(identity.get(LocalUser, 1) is tuxie)
+            app.process_response(app.response_class())
+        self.assertEquals(identity.get(LocalUser, 1), None)
+
+
+class RecordingBackend(BaseModelBackend):
+    """Keeps the writes it is asked to do, in order.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def flush(self, saved, deleted):
+        self.calls.append(('flush', list(saved), list(deleted)))
+
+    def follow(self, instance, user, ulist=None):
+        self.calls.append(('follow', instance, user))
+
+
+class UnitOfWorkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = RecordingBackend()
+        self.tuxie = LocalUser(username='tuxie', password='passwd')
+        self.omar = LocalUser(username='omar', password='passwd')
+
+    def test_operations_after_saves(self):
+        with self.backend.session():
+            self.tuxie.save(backend=self.backend)
+            self.omar.save(backend=self.backend)
+            self.tuxie.follow(self.omar, backend=self.backend)
+        self.assertEquals(self.backend.calls, [
+            ('flush', [self.tuxie, self.omar], []),
+            ('follow', self.tuxie, self.omar)])
+
+    def test_last_change_wins(self):
+        with self.backend.session():
+            self.tuxie.save(backend=self.backend)
+            self.omar.delete(backend=self.backend)
+            self.tuxie.delete(backend=self.backend)
+            self.omar.save(backend=self.backend)
+        self.assertEquals(self.backend.calls, [
+            ('flush', [self.omar], [self.tuxie])])
+
+
+class PagingBackend(BaseModelBackend):
+    """Keeps collections in memory, by name, counting the calls made to
+    read them.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.calls = []
+
+    def get_page(self, instance, offset, limit):
+        self.calls.append(('get_page', offset))
+        items = self.items[instance.name]
+        if isinstance(items, dict):
+            items = sorted(items.items())
+        return items[offset:offset + limit]
+
+    def len(self, instance):
+        self.calls.append(('len',))
+        return len(self.items[instance.name])
+
+    def contains(self, instance, key):
+        self.calls.append(('contains', key))
+        return key in self.items[instance.name]
+
+    def getitem(self, instance, key):
+        self.calls.append(('getitem', key))
+        return self.items[instance.name][key]
+
+    def setitem(self, instance, key, value):
+        self.calls.append(('setitem', key))
+        self.items[instance.name][key] = value
+
+    def extend(self, instance, items):
+        self.calls.append(('extend', len(items)))
+        self.items[instance.name].extend(items)
+
+
+class BackendCollectionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = PagingBackend({
+            'following': dict((n, 'user %d' % n) for n in range(5)),
+            'notices': ['notice %d' % n for n in range(5)],
+        })
+        self.tuxie = LocalUser(username='tuxie', password='passwd')
+
+    def collection(self, cls, name):
+        collection = cls(self.tuxie, name, backend=self.backend)
+        collection.page_size = 2
+        return collection
+
+    def test_dict_lookups(self):
+        following = self.collection(BackendDict, 'following')
+        self.assertEquals(following[3], 'user 3')
+        self.assertEquals(following[3], 'user 3')
+        self.assertTrue(4 in following)
+        self.assertFalse(7 in following)
+        self.assertEquals(following.get(7), None)
+        self.assertEquals(self.backend.calls, [('getitem', 3),
+            ('contains', 4), ('contains', 7), ('getitem', 7)])
+
+    def test_dict_paging(self):
+        following = self.collection(BackendDict, 'following')
+        self.assertEquals(sorted(following), range(5))
+        self.assertEquals(self.backend.calls, [('get_page', 0),
+            ('get_page', 2), ('get_page', 4)])
+        # Once fully fetched, answered without the backend.
+        del self.backend.calls[:]
+        self.assertEquals(len(following), 5)
+        self.assertFalse(7 in following)
+        self.assertRaises(KeyError, following.__getitem__, 7)
+        self.assertEquals(following.values()[0], 'user 0')
+        self.assertEquals(self.backend.calls, [])
+        following[7] = 'user 7'
+        self.assertEquals(len(following), 6)
+        self.assertEquals(self.backend.calls, [('setitem', 7)])
+
+    def test_list_paging(self):
+        notices = self.collection(BackendList, 'notices')
+        self.assertEquals(notices[3], 'notice 3')
+        self.assertEquals(notices[2], 'notice 2')
+        self.assertEquals(self.backend.calls, [('get_page', 2)])
+        self.assertEquals([notice for notice in notices],
+                          ['notice %d' % n for n in range(5)])
+        self.assertEquals(self.backend.calls, [('get_page', 2),
+            ('get_page', 0), ('get_page', 4)])
+        # The count is read once, the pages are not read again.
+        del self.backend.calls[:]
+        self.assertEquals(notices[-1], 'notice 4')
+        self.assertEquals(notices[1:3], ['notice 1', 'notice 2'])
+        self.assertRaises(IndexError, notices.__getitem__, 5)
+        self.assertEquals(self.backend.calls, [('len',)])
+
+    def test_list_extend(self):
+        notices = self.collection(BackendList, 'notices')
+        self.assertEquals(len(notices), 5)
+        notices.extend(['notice 5', 'notice 6'])
+        # A single write, after which the pages are read again.
+        self.assertEquals(len(notices), 7)
+        self.assertEquals(notices[6], 'notice 6')
+        self.assertEquals(self.backend.calls, [('len',), ('extend', 2),
+            ('len',), ('get_page', 6)])
+
+
+class FollowerGraphTests(unittest.TestCase):
+
+    def test_set_operations(self):
+        self.assertEquals(intersection([1, 3, 5, 7], [3, 4, 5]), [3, 5])
+        self.assertEquals(intersection([4], range(100)), [4])
+        self.assertEquals(difference([1, 3, 5, 7], [3, 4, 5]), [1, 7])
+        self.assertEquals(difference([4, 200], range(100)), [200])
+
+    def test_graph(self):
+        graph = FollowerGraph()
+        graph.load([(1, 2), (2, 1), (3, 1), (1, 3), (4, 2)])
+        graph.follow(4, 3)
+        graph.follow(4, 3)
+        graph.unfollow(1, 3)
+        self.assertTrue(graph.is_following(4, 3))
+        self.assertFalse(graph.is_following(1, 3))
+        self.assertEquals(list(graph.followers(2)), [1, 4])
+        self.assertEquals(graph.count_followers(3), 1)
+        self.assertEquals(graph.count_following(4), 2)
+        self.assertEquals(graph.mutual(1), [2])
+        self.assertEquals(graph.followed_by_following(4, 1), [2, 3])
+        self.assertEquals(graph.not_followed(4, [1, 2, 3]), [1])
+
+    def test_replace(self):
+        graph = FollowerGraph()
+        graph.load([(1, 2), (2, 1)])
+        graph.replace(1, [3, 2], [])
+        self.assertEquals(list(graph.following(1)), [2, 3])
+        self.assertEquals(list(graph.followers(1)), [])
+        # Only the follows of the user replaced change.
+        self.assertEquals(list(graph.following(2)), [1])
+
 
 if __name__ == '__main__':
     unittest.main()
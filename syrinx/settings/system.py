@@ -9,14 +9,81 @@ PROJECT_DIR = dirname(abspath(__file__))[:-len('/settings')]
 
 DEBUG = False
 
+CACHE_BACKEND = 'locmem://?timeout=300&max_entries=1000'
 CONFIRMATION_EMAIL_SUBJECT = _('Confirm your email')
 CONFIRMATION_EMAIL_TEMPLATE = 'confirmation.txt'
 DEFAULT_CHARSET = 'utf-8'
+DIRECTORY_CACHE_TIMEOUT = 300
+DIRECTORY_PER_PAGE = 30
+# Email is sent as it is written. To queue it instead, set this to
+# 'syrinx.core.mail.backends.queued.EmailBackend' and run the
+# send_queued_mail command, which sends it with EMAIL_QUEUE_BACKEND; without
+# it queued email is never sent. See syrinx.core.mail.queue.
 EMAIL_BACKEND = 'syrinx.core.mail.backends.smtp.EmailBackend'
+# Messages per batch and threads sending them, see syrinx.core.mail.bulk.
+EMAIL_BULK_BATCH_SIZE = 500
+EMAIL_BULK_WORKERS = 4
 EMAIL_CONFIRMATION_TIMEOUT_DAYS = 3
+# Where the file based backend writes messages. With EMAIL_FILE_SPOOL they
+# are appended to segment files, rotated once they reach
+# EMAIL_FILE_SEGMENT_SIZE bytes or EMAIL_FILE_SEGMENT_AGE seconds, see
+# syrinx.core.mail.spool.
+EMAIL_FILE_BUFFER_SIZE = 64 * 1024
+EMAIL_FILE_PATH = join(dirname(PROJECT_DIR), 'mail')
+EMAIL_FILE_SEGMENT_AGE = 3600
+EMAIL_FILE_SEGMENT_SIZE = 64 * 1024 * 1024
+EMAIL_FILE_SPOOL = False
+# Connections to the email server kept open per process, how many messages
+# each sends before being replaced, the seconds one is kept idle and those
+# after which it is checked before being reused. Past EMAIL_POOL_SIZE
+# connections in use, senders wait up to EMAIL_POOL_TIMEOUT seconds for one.
+EMAIL_POOL_CHECK_AFTER = 5
+EMAIL_POOL_KEEPALIVE = 60
+EMAIL_POOL_MAX_MESSAGES = 100
+EMAIL_POOL_SIZE = 4
+EMAIL_POOL_TIMEOUT = 30
 EMAIL_PORT = 25
+EMAIL_QUEUE_BACKEND = 'syrinx.core.mail.backends.smtp.EmailBackend'
+EMAIL_QUEUE_BATCH_SIZE = 100
+# Seconds a worker has to send the messages it takes from the queue.
+EMAIL_QUEUE_LEASE = 300
+EMAIL_QUEUE_MAX_ATTEMPTS = 8
+EMAIL_QUEUE_MAX_RETRY_DELAY = 3600
+EMAIL_QUEUE_PATH = join(dirname(PROJECT_DIR), 'mail_queue.db')
+EMAIL_QUEUE_POLL_INTERVAL = 1
+# Seconds to wait after the first failed attempt, doubled after each one.
+EMAIL_QUEUE_RETRY_DELAY = 60
+# Threads sending the messages of a batch, each with its own connection.
+EMAIL_QUEUE_WORKERS = 4
 EMAIL_SUBJECT_PREFIX = '[Syrinx] '
 EMAIL_USE_TLS = False
 EMAIL_SIGNATURE_TEMPLATE = 'signature.txt'
+# Rendered messages kept to be sent again, see EmailMessage.message().
+EMAIL_SKELETON_CACHE_SIZE = 256
+# Notifications are gathered per user and sent in a single message once the
+# oldest is NOTIFICATION_DIGEST_WINDOW seconds old, listing up to
+# NOTIFICATION_DIGEST_MAX_ITEMS of them, see syrinx.core.mail.digest.
+NOTIFICATION_DIGEST_BATCH_SIZE = 500
+NOTIFICATION_DIGEST_MAX_ITEMS = 20
+NOTIFICATION_DIGEST_PATH = join(dirname(PROJECT_DIR), 'notifications.db')
+NOTIFICATION_DIGEST_POLL_INTERVAL = 60
+NOTIFICATION_DIGEST_SUBJECT = _('Your notifications')
+NOTIFICATION_DIGEST_WINDOW = 900
+# How passwords are hashed: on startup the work factor is set so that a hash
+# takes about PASSWORD_HASH_TIME seconds, never below PASSWORD_WORK_FACTOR
+# (the minimum of the method if None). If PASSWORD_HASH_TIME is None,
+# PASSWORD_WORK_FACTOR is used, or the default of the method.
+PASSWORD_HASH_METHOD = 'bcrypt'
+PASSWORD_HASH_TIME = 0.25
+PASSWORD_WORK_FACTOR = None
+# Threads hashing passwords, and how many hashes may wait for them.
+PASSWORD_QUEUE_SIZE = 32
+PASSWORD_TIMEOUT = 10
+PASSWORD_WORKERS = 2
+PER_PAGE = 30
 SERVER_EMAIL = 'root@ideal.com.uy'
 TEMPLATES_DIR = join(PROJECT_DIR, 'interface/www/templates')
+# Maximum number of messages kept in each user's home timeline.
+TIMELINE_SIZE = 800
+USER_CACHE_BACKEND = 'locmem://?timeout=300&max_entries=10000'
+WHO_TO_FOLLOW_SIZE = 5
@@ -11,8 +11,14 @@
 
 import hmac
 import string
+import time
 from random import SystemRandom
 
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
 # because the API of hmac changed with the introduction of the
 # new hashlib module, we have to support both.  This sets up a
 # mapping to the digest factory functions and the digest modules
@@ -30,6 +36,11 @@ except ImportError:
     _hash_funcs = {'sha1': _sha1_mod.new, 'md5': _md5_mod.new}
 
 
+try:
+    from hashlib import pbkdf2_hmac
+except ImportError:
+    pbkdf2_hmac = None
+
 SALT_CHARS = string.letters + string.digits
 
 
@@ -105,3 +116,193 @@ def check_password_hash(pwhash, password):
         return False
     method, salt, hashval = pwhash.split('$', 2)
     return _hash_internal(method, salt, password) == hashval
+
+
+def _pbkdf2(hash_name, password, salt, iterations):
+    """PBKDF2 with HMAC, as hashlib.pbkdf2_hmac() in Python 2.7.8 and later,
+    for a single block of key.
+    """
+    if pbkdf2_hmac is not None:
+        return pbkdf2_hmac(hash_name, password, salt, iterations)
+    mac = hmac.new(password, None, _hash_mods[hash_name])
+
+    def prf(data):
+        h = mac.copy()
+        h.update(data)
+        return h.digest()
+
+    block = u = prf(salt + '\x00\x00\x00\x01')
+    result = [ord(c) for c in block]
+    for i in xrange(iterations - 1):
+        u = prf(u)
+        for j, c in enumerate(u):
+            result[j] ^= ord(c)
+    return ''.join(chr(c) for c in result)
+
+
+class HashingPolicy(object):
+    """How passwords are hashed: the method and its work factor.
+
+    Supported methods are ``'bcrypt'``, whose work factor is the log2 of
+    its rounds, and ``'pbkdf2:sha256'`` and ``'pbkdf2:sha1'``, whose work
+    factor is their number of iterations.  The hashes generated look like
+    this::
+
+        $2a$12$<salt and hash>
+        pbkdf2:sha256:20000$salt$hash
+
+    Hashes of any other method :func:`check_password_hash` knows about are
+    checked as well, so that they can be upgraded with
+    :meth:`verify_and_update`.
+
+    :param method: the hash method to use
+    :param work_factor: the cost of the method, its default if not given
+    """
+
+    DEFAULT_WORK_FACTORS = {
+        'bcrypt': 12,
+        'pbkdf2:sha256': 20000,
+        'pbkdf2:sha1': 20000,
+    }
+
+    # The work factors below which hashes are too weak to be used, whatever
+    # the hardware.
+    MINIMUM_WORK_FACTORS = {
+        'bcrypt': 10,
+        'pbkdf2:sha256': 10000,
+        'pbkdf2:sha1': 10000,
+    }
+
+    # The lowest and highest work factors of each method.
+    WORK_FACTOR_RANGES = {
+        'bcrypt': (4, 31),
+        'pbkdf2:sha256': (1000, 10 ** 8),
+        'pbkdf2:sha1': (1000, 10 ** 8),
+    }
+
+    def __init__(self, method='bcrypt', work_factor=None, salt_length=16):
+        if method not in self.DEFAULT_WORK_FACTORS:
+            raise TypeError('Invalid method %r' % method)
+        if method == 'bcrypt' and bcrypt is None:
+            raise TypeError('Method %r needs py-bcrypt' % method)
+        self.method = method
+        self.work_factor = work_factor or self.DEFAULT_WORK_FACTORS[method]
+        self.salt_length = salt_length
+
+    def hash(self, password, work_factor=None):
+        """Hash a password with the method of the policy."""
+        work_factor = work_factor or self.work_factor
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        if self.method == 'bcrypt':
+            return bcrypt.hashpw(password, bcrypt.gensalt(work_factor))
+        hash_name = self.method.split(':', 1)[1]
+        salt = gen_salt(self.salt_length)
+        h = _pbkdf2(hash_name, password, salt, work_factor)
+        return '%s:%d$%s$%s' % (self.method, work_factor, salt,
+                                h.encode('hex'))
+
+    def identify(self, pwhash):
+        """Return the ``(method, work_factor)`` a hash was generated with.
+        The work factor is `None` for methods without one, and for
+        malformed hashes.
+        """
+        if pwhash.startswith('$2'):
+            parts = pwhash.split('$')
+            if len(parts) < 4 or not parts[2].isdigit():
+                return 'bcrypt', None
+            return 'bcrypt', int(parts[2])
+        method = pwhash.split('$', 1)[0]
+        if method.startswith('pbkdf2:'):
+            method, sep, iterations = method[len('pbkdf2:'):].rpartition(':')
+            if not sep or not iterations.isdigit() or not int(iterations):
+                return 'pbkdf2:' + (method or iterations), None
+            return 'pbkdf2:' + method, int(iterations)
+        return method, None
+
+    def check(self, pwhash, password):
+        """Check a password against a hash of any known method."""
+        if not pwhash:
+            return False
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        method, work_factor = self.identify(pwhash)
+        if method == 'bcrypt':
+            if bcrypt is None or work_factor is None:
+                return False
+            try:
+                return _constant_time_compare(bcrypt.hashpw(password, pwhash),
+                                              pwhash)
+            except ValueError:
+                # An invalid salt.
+                return False
+        if method.startswith('pbkdf2:'):
+            if work_factor is None or pwhash.count('$') != 2:
+                return False
+            hash_name = method.split(':', 1)[1]
+            if hash_name not in _hash_mods:
+                return False
+            method, salt, hashval = pwhash.split('$', 2)
+            h = _pbkdf2(hash_name, password, salt, work_factor)
+            return _constant_time_compare(h.encode('hex'), hashval)
+        return check_password_hash(pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Tell whether a hash is weaker than the policy: generated with
+        another method or a lower work factor.
+        """
+        method, work_factor = self.identify(pwhash)
+        return method != self.method or work_factor < self.work_factor
+
+    def verify_and_update(self, pwhash, password):
+        """Check a password against a hash.  Return a ``(valid, new_hash)``
+        tuple, where `new_hash` is a hash of the password following the
+        policy if the one given did not, and `None` otherwise.
+        """
+        if not self.check(pwhash, password):
+            return False, None
+        if self.needs_rehash(pwhash):
+            return True, self.hash(password)
+        return True, None
+
+    def calibrate(self, target, password='calibration', minimum=None):
+        """Set the work factor so that hashing a password takes about
+        `target` seconds on this machine, but not more, and not less than
+        `minimum` if given, and return it.
+        """
+        lowest, highest = self.WORK_FACTOR_RANGES[self.method]
+        if self.method == 'bcrypt':
+            # Each round doubles the time taken.
+            work_factor = lowest
+            while work_factor < highest:
+                if self._time(password, work_factor + 1) > target:
+                    break
+                work_factor += 1
+        else:
+            elapsed = self._time(password, lowest * 10)
+            work_factor = int(lowest * 10 * target / elapsed)
+            work_factor = max(lowest, min(highest, work_factor))
+        self.work_factor = max(work_factor, minimum or lowest)
+        return self.work_factor
+
+    def _time(self, password, work_factor, repeat=3):
+        best = None
+        for i in xrange(repeat):
+            start = time.time()
+            self.hash(password, work_factor)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+
+
+def _constant_time_compare(val1, val2):
+    """Compare two strings in a time independent of how many of their
+    characters match.
+    """
+    if len(val1) != len(val2):
+        return False
+    result = 0
+    for x, y in zip(val1, val2):
+        result |= ord(x) ^ ord(y)
+    return result == 0
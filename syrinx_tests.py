@@ -7,7 +7,15 @@
 """
 
 import syrinx
+from syrinx.core.cache import cache
+from syrinx.core.mail.digest import notify
+from syrinx.interface.www import views
+from syrinx.models.backends.sqlalchemy.models import (db, Follower,
+    FollowVersion, Message, TimelineEntry, User, user_ids)
+from syrinx.models.graph import FollowerGraph
 
+from datetime import datetime, timedelta
+from werkzeug.http import parse_date
 import os
 import tempfile
 import unittest
@@ -17,14 +25,26 @@ class SyrinxTestCase(unittest.TestCase):
 
     def setUp(self):
         """Before each test, set up a blank database"""
-        self.db_fd, syrinx.app.config['DATABASE'] = tempfile.mkstemp()
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        syrinx.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///%s' % self.db_path
+        syrinx.app.config['SQLALCHEMY_RECORD_QUERIES'] = True
+        cache.clear()
+        # The graph and the user ids of the previous test's database.
+        views.follower_graph = FollowerGraph()
+        user_ids.clear()
+        # Notifications are recorded instead of written to the digests.
+        self.notified = []
+        views.notify = lambda *args: self.notified.append(args)
         self.app = syrinx.app.test_client()
-        syrinx.init_db()
+        db.create_all()
 
     def tearDown(self):
         """Get rid of the database again after each test."""
+        db.session.remove()
+        views.notify = notify
         os.close(self.db_fd)
-        os.unlink(syrinx.app.config['DATABASE'])
+        os.unlink(self.db_path)
 
     # helper functions
 
@@ -59,12 +79,22 @@ class SyrinxTestCase(unittest.TestCase):
 
     def add_message(self, text):
         """Records a message"""
-        rv = self.app.post('/add_message', data={'text': text},
+        rv = self.app.post('/add-message', data={'text': text},
                                     follow_redirects=True)
         if text:
             assert 'Your message was recorded' in rv.data
         return rv
 
+    def count_queries(self, path):
+        """Returns the number of SQL queries issued to render a page with
+        an empty cache"""
+        from flaskext.sqlalchemy import get_debug_queries
+        cache.clear()
+        with syrinx.app.test_request_context(path):
+            syrinx.app.preprocess_request()
+            syrinx.app.dispatch_request()
+            return len(get_debug_queries())
+
     # testing functions
 
     def test_register(self):
@@ -94,6 +124,34 @@ class SyrinxTestCase(unittest.TestCase):
         rv = self.login('user2', 'wrongpassword')
         assert 'Invalid username' in rv.data
 
+    def test_user_snapshot(self):
+        """Make sure cached users are refreshed once invalidated"""
+        self.register_and_login('foo', 'default')
+        self.app.get('/')
+        with syrinx.app.test_request_context():
+            user = User.query.get(('foo', ''))
+            user.email = 'new@example.com'
+            user.set_password('changed')
+            db.session.commit()
+            # Served from the cache until told otherwise.
+            snapshot = views.get_user('foo')
+            self.assertEqual(snapshot.email, 'foo@example.com')
+            self.assertFalse(hasattr(snapshot, 'password'))
+            views.invalidate_user('foo')
+            self.assertEqual(views.get_user('foo').email, 'new@example.com')
+        self.logout()
+        rv = self.login('foo', 'default')
+        assert 'Invalid password' in rv.data
+        rv = self.login('foo', 'changed')
+        assert 'You were logged in' in rv.data
+        with syrinx.app.test_request_context():
+            User.query.filter_by(username='foo').delete()
+            db.session.commit()
+            views.invalidate_user('foo')
+        # Still logged in, but no longer a user.
+        rv = self.app.get('/', follow_redirects=True)
+        assert 'Public timeline' in rv.data
+
     def test_message_recording(self):
         """Check if adding messages works"""
         self.register_and_login('foo', 'default')
@@ -143,6 +201,235 @@ class SyrinxTestCase(unittest.TestCase):
         assert 'the message by foo' not in rv.data
         assert 'the message by bar' in rv.data
 
+    def test_pagination(self):
+        """Make sure cursors page through messages published together"""
+        self.register('foo', 'default')
+        day = datetime(2010, 10, 1)
+        with syrinx.app.test_request_context():
+            author = User.query.get(('foo', '')).id
+            # Published on these days, in id order.
+            for days in (1, 0, 0, 2, 0, 1, 0):
+                db.session.add(Message(author=author, text=u'message',
+                    date_publish=day + timedelta(days=days)))
+            db.session.commit()
+            newest_first = [4, 6, 1, 7, 5, 3, 2]
+            pages, max_id = [], None
+            while True:
+                page = [message.id for message in
+                        Message.paginate(max_id=max_id, limit=2)]
+                if not page:
+                    break
+                pages.append(page)
+                max_id = page[-1]
+            self.assertEqual(pages, [[4, 6], [1, 7], [5, 3], [2]])
+            self.assertEqual([message.id for message in
+                              Message.paginate(since_id=3, limit=10)],
+                             newest_first[:5])
+            self.assertEqual([message.id for message in
+                              Message.paginate(max_id=1, since_id=3)], [7, 5])
+        rv = self.app.get('/public?max_id=1')
+        assert '/public?max_id=' not in rv.data
+
+    def test_timeline_entries(self):
+        """Make sure home timelines are fanned out, backfilled and trimmed"""
+        def timeline(username):
+            with syrinx.app.test_request_context():
+                owner = User.query.get((username, '')).id
+                return [message.text for message in
+                        TimelineEntry.get_messages(owner, limit=10)]
+        timeline_size = syrinx.app.config['TIMELINE_SIZE']
+        syrinx.app.config['TIMELINE_SIZE'] = 3
+        try:
+            self.register_and_login('foo', 'default')
+            for i in range(4):
+                self.add_message('message %d by foo' % i)
+            self.logout()
+            self.register_and_login('bar', 'default')
+            self.add_message('message by bar')
+            self.app.get('/foo/follow')
+            # Backfilled, then trimmed to the newest three.
+            self.assertEqual(timeline('bar'), ['message by bar',
+                'message 3 by foo', 'message 2 by foo'])
+            self.logout()
+            self.login('foo', 'default')
+            # Following oneself backfills nothing already there.
+            rv = self.app.get('/foo/follow', follow_redirects=True)
+            assert 'You are now following &#34;foo&#34;' in rv.data
+            self.add_message('message 4 by foo')
+            self.assertEqual(timeline('foo'), ['message 4 by foo',
+                'message 3 by foo', 'message 2 by foo'])
+            self.assertEqual(timeline('bar'), ['message 4 by foo',
+                'message by bar', 'message 3 by foo'])
+            # Nor does unfollowing oneself empty one's timeline.
+            rv = self.app.get('/foo/unfollow', follow_redirects=True)
+            assert 'You are no longer following &#34;foo&#34;' in rv.data
+            self.assertEqual(len(timeline('foo')), 3)
+        finally:
+            syrinx.app.config['TIMELINE_SIZE'] = timeline_size
+
+    def test_directory(self):
+        """Make sure the user directory pages through all users"""
+        for username in ('foo', 'bar', 'baz'):
+            self.register(username, 'default')
+        per_page = syrinx.app.config['DIRECTORY_PER_PAGE']
+        syrinx.app.config['DIRECTORY_PER_PAGE'] = 2
+        try:
+            rv = self.app.get('/users')
+            assert 'href="/bar"' in rv.data
+            assert 'href="/baz"' in rv.data
+            assert 'href="/foo"' not in rv.data
+            assert '/users?after=baz' in rv.data
+            rv = self.app.get('/users?after=baz')
+            assert 'href="/foo"' in rv.data
+            assert 'href="/baz"' not in rv.data
+            assert 'More users' not in rv.data
+            # New users are listed right away.
+            self.register('bat', 'default')
+            rv = self.app.get('/users')
+            assert 'href="/bat"' in rv.data
+        finally:
+            syrinx.app.config['DIRECTORY_PER_PAGE'] = per_page
+
+    def test_public_timeline_cache(self):
+        """Make sure posting drops the cached public timeline"""
+        self.register_and_login('foo', 'default')
+        self.add_message('the message by foo')
+        self.logout()
+        self.app.get('/public')
+        cached = cache.get(views.PUBLIC_TIMELINE_KEY)
+        self.assertEqual([message['text'] for message in cached],
+                         ['the message by foo'])
+        self.register_and_login('bar', 'default')
+        self.add_message('the message by bar')
+        self.assertEqual(cache.get(views.PUBLIC_TIMELINE_KEY), None)
+        rv = self.app.get('/public')
+        assert 'the message by foo' in rv.data
+        assert 'the message by bar' in rv.data
+
+    def test_who_to_follow(self):
+        """Make sure who to follow leaves out oneself and the followed"""
+        for username in ('foo', 'baz'):
+            self.register(username, 'default')
+        self.register_and_login('bar', 'default')
+        self.app.get('/foo/follow')
+        users = self.app.get('/').data.split('Who to follow')[1]
+        assert 'href="/baz"' in users
+        assert 'href="/foo"' not in users
+        assert 'href="/bar"' not in users
+        self.app.get('/baz/follow')
+        assert 'Who to follow' not in self.app.get('/').data
+        self.logout()
+        users = self.app.get('/public').data.split('Who to follow')[1]
+        for username in ('foo', 'bar', 'baz'):
+            assert 'href="/%s"' % username in users
+
+    def test_follower_graph(self):
+        """Make sure follows made elsewhere reach the follower graph"""
+        for username in ('foo', 'baz'):
+            self.register(username, 'default')
+        self.register_and_login('bar', 'default')
+        self.app.get('/foo/follow')
+        with syrinx.app.test_request_context():
+            foo, bar, baz = [User.query.get((username, '')).id
+                             for username in ('foo', 'bar', 'baz')]
+            graph = views.get_graph(bar, foo)
+            self.assertTrue(graph.is_following(bar, foo))
+        self.app.get('/baz/follow')
+        with syrinx.app.test_request_context():
+            # Applied to the graph as it was made, nothing to load again.
+            versions = FollowVersion.get_many([foo, bar, baz])
+            self.assertEqual(graph.versions, {foo: 1, bar: 2})
+            self.assertEqual(versions, {foo: 1, bar: 2, baz: 1})
+            self.assertTrue(graph.is_following(bar, baz))
+            # As another process would.
+            Follower.query.filter_by(who_id=bar, whom_id=foo).delete()
+            FollowVersion.bump([bar, foo])
+            db.session.commit()
+            self.assertFalse(views.get_graph(bar).is_following(bar, foo))
+            self.assertEqual(list(views.get_graph(foo).followers(foo)), [])
+
+    def test_follow_notification(self):
+        """Make sure users are told about new followers, if they want to"""
+        for username in ('foo', 'bar'):
+            self.register(username, 'default')
+        self.register_and_login('baz', 'default')
+        self.app.get('/foo/follow')
+        self.assertEqual(self.notified, [
+            ('foo@example.com', 'follow', 'baz is now following you')])
+        with syrinx.app.test_request_context():
+            User.query.get(('bar', '')).email_notification = False
+            db.session.commit()
+        self.app.get('/bar/follow')
+        self.assertEqual(len(self.notified), 1)
+
+    def test_follow_notification_failure(self):
+        """Make sure a notification failing does not fail the follow"""
+        def fail(*args):
+            raise IOError('disk full')
+        views.notify = fail
+        self.register('foo', 'default')
+        self.register_and_login('bar', 'default')
+        rv = self.app.get('/foo/follow', follow_redirects=True)
+        assert 'You are now following &#34;foo&#34;' in rv.data
+
+    def test_timeline_query_count(self):
+        """Make sure rendering a page does not query once per message"""
+        for username in ('foo', 'bar', 'baz'):
+            self.register_and_login(username, 'default')
+            for i in range(5):
+                self.add_message('message %d by %s' % (i, username))
+            self.logout()
+        per_page = syrinx.app.config['PER_PAGE']
+        try:
+            syrinx.app.config['PER_PAGE'] = 3
+            short_page = self.count_queries('/public')
+            syrinx.app.config['PER_PAGE'] = 15
+            long_page = self.count_queries('/public')
+        finally:
+            syrinx.app.config['PER_PAGE'] = per_page
+        self.assertEqual(short_page, long_page)
+
+    def test_conditional_get(self):
+        """Make sure timelines carry private GMT validators"""
+        self.register_and_login('foo', 'default')
+        self.add_message('the message by foo')
+        rv = self.app.get('/')
+        assert rv.headers['Cache-Control'] == 'private'
+        last_modified = parse_date(rv.headers['Last-Modified'])
+        assert abs(datetime.utcnow() - last_modified) < timedelta(minutes=1)
+        rv = self.app.get('/', headers={
+            'If-Modified-Since': rv.headers['Last-Modified']})
+        self.assertEqual(rv.status_code, 304)
+
+    def test_intern_user_ids(self):
+        """Make sure tables referring to users by username are migrated"""
+        from syrinx.models.backends.sqlalchemy.migrations import \
+            intern_user_ids
+        self.register('foo', 'default')
+        for statement in (
+                'DROP TABLE timelines', 'DROP TABLE messages',
+                'DROP TABLE followers',
+                'CREATE TABLE followers (who_id VARCHAR, whom_id VARCHAR, '
+                'date_follow DATETIME)',
+                'CREATE TABLE messages (id INTEGER PRIMARY KEY, '
+                'author VARCHAR, text TEXT, date_publish DATETIME)',
+                'CREATE TABLE timelines (owner VARCHAR, message_id INTEGER)',
+                "INSERT INTO messages VALUES (1, 'foo', 'by foo', NULL)",
+                "INSERT INTO messages VALUES (2, NULL, 'by nobody', NULL)",
+                "INSERT INTO timelines VALUES ('foo', 1)"):
+            db.engine.execute(statement)
+        self.assertEqual(sorted(intern_user_ids()),
+                         ['followers', 'messages', 'timelines'])
+        self.assertEqual(intern_user_ids(), [])
+        with syrinx.app.test_request_context():
+            foo = User.query.get(('foo', '')).id
+            # Messages by no one are kept.
+            self.assertEqual(list(db.session.execute(
+                'SELECT id, author FROM messages ORDER BY id')),
+                [(1, foo), (2, None)])
+            self.assertEqual(list(db.session.execute(
+                'SELECT owner, message_id FROM timelines')), [(foo, 1)])
+
 
 if __name__ == '__main__':
     unittest.main()